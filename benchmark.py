@@ -0,0 +1,605 @@
+# 🍓 Blox Fruits Stats Tracker - Benchmark
+# Đo ingest throughput, tăng trưởng database và so sánh threaded/async serving của server.py trên database tạm
+#
+#   python benchmark.py load --accounts 1000 --interval 30 --duration 120 --output results/load-1000.json
+#   python benchmark.py serve --modes threaded,async
+#   python benchmark.py ingest | growth
+#   python benchmark.py parse --batch-size 100   # decode throughput từng Content-Type / Content-Encoding
+#
+# --output ghi JSON (meta: commit, thời điểm, tham số + result) để so sánh giữa các commit
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SWORDS = ['Katana', 'Cutlass', 'Saber', 'Pole', 'Bisento', 'Yama', 'Tushita', 'Shisui', 'Saddi', 'Wando']
+GUNS = ['Slingshot', 'Musket', 'Flintlock', 'Refined Slingshot', 'Kabucha', 'Acidum Rifle', 'Soul Guitar']
+FRUITS = ['Bomb-Bomb', 'Spike-Spike', 'Flame-Flame', 'Ice-Ice', 'Light-Light', 'Magma-Magma', 'Buddha-Buddha', 'Dough-Dough']
+STYLES = ['Combat', 'DarkStep', 'Electro', 'WaterKungFu', 'DragonBreath', 'Superhuman',
+          'DeathStep', 'SharkmanKarate', 'ElectricClaw', 'DragonTalon', 'Godhuman']
+
+def make_payload(index, rng):
+    """Tạo payload giống sendDataToServer trong Lua script (tối đa 12 player mỗi game server)"""
+    job_id = f'bench-job-{index // 12:04d}'
+    return {
+        'player_name': f'BenchPlayer{index:05d}',
+        'user_id': 100000 + index,
+        'level': rng.randint(1, 2550),
+        'beli': rng.randint(0, 50_000_000),
+        'fragments': rng.randint(0, 100_000),
+        'bounty': rng.randint(0, 30_000_000),
+        'honor': rng.randint(0, 10_000),
+        'equipped_fruit': rng.choice(FRUITS),
+        'fighting_style': rng.choice(STYLES),
+        'fighting_styles': {'owned': ['Combat'] + rng.sample(STYLES[1:], rng.randint(0, 6))},
+        'items': {
+            'swords': rng.sample(SWORDS, rng.randint(1, 6)),
+            'guns': rng.sample(GUNS, rng.randint(0, 4)),
+            'fruits': rng.sample(FRUITS, rng.randint(0, 3))
+        },
+        'session_id': job_id,
+        'timestamp': int(time.time()),
+        'server_info': {'place_id': 7449423635, 'job_id': job_id, 'players_count': rng.randint(1, 12)}
+    }
+
+def evolve_payload(payload, rng):
+    """Report tiếp theo của cùng player: đa số field giữ nguyên, thỉnh thoảng tiến triển"""
+    payload = dict(payload, timestamp=payload['timestamp'] + 30)
+    if rng.random() < 0.05:
+        payload['level'] = min(2550, payload['level'] + 1)
+    if rng.random() < 0.3:
+        payload['beli'] += rng.randint(0, 50_000)
+    if rng.random() < 0.002:
+        missing = [s for s in STYLES if s not in payload['fighting_styles']['owned']]
+        if missing:
+            payload['fighting_styles'] = {'owned': payload['fighting_styles']['owned'] + [rng.choice(missing)]}
+    if rng.random() < 0.002:
+        missing = [s for s in SWORDS if s not in payload['items']['swords']]
+        if missing:
+            payload['items'] = dict(payload['items'], swords=payload['items']['swords'] + [rng.choice(missing)])
+    return payload
+
+def load_server(db_dir):
+    """Import server.py với DB_FILE nằm trong thư mục tạm"""
+    os.environ['BF_DB_FILE'] = os.path.join(db_dir, 'bench.db')
+    os.chdir(db_dir)
+    sys.path.insert(0, REPO_DIR)
+    import server
+    return server
+
+def run_ingest(server, players, requests_total, threads, seed):
+    """Bắn requests_total POST tới /api/bloxfruits/stats, trả về kết quả"""
+    rng = random.Random(seed)
+    bodies = [json.dumps(make_payload(i % players, rng)) for i in range(requests_total)]
+    local = threading.local()
+    errors = []
+
+    def post(body):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = server.app.test_client()
+        resp = client.post('/api/bloxfruits/stats', data=body, content_type='application/json')
+        if resp.status_code >= 400:
+            errors.append(resp.status_code)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(post, bodies))
+    # Chờ write-behind queue ghi xong để số đo là throughput thật xuống DB
+    if hasattr(server, 'ingest_queue'):
+        server.ingest_queue.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': requests_total,
+        'threads': threads,
+        'players': players,
+        'errors': len(errors),
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(requests_total / elapsed, 1)
+    }
+
+def compact_row(payload):
+    """Payload -> fixed-field array form (COMPACT_FIELDS trong server.py)"""
+    styles = payload['fighting_styles']
+    items = payload['items']
+    info = payload['server_info']
+    return [1, payload['player_name'], payload['user_id'], payload['level'], payload['beli'], payload['fragments'],
+            payload['bounty'], payload['honor'], payload['equipped_fruit'], payload['fighting_style'],
+            True if styles.get('unchanged') else styles['owned'],
+            [items['swords'], items['guns'], items['fruits']], payload['session_id'], payload['timestamp'],
+            [info['place_id'], info['job_id'], info['players_count']]]
+
+# Tên format -> Content-Type của ingest endpoint
+BODY_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'compact+json': 'application/vnd.bloxfruits.compact+json',
+    'msgpack': 'application/msgpack',
+    'compact+msgpack': 'application/vnd.bloxfruits.compact+msgpack',
+}
+
+BODY_ENCODINGS = {
+    'identity': lambda body: body,
+    'gzip': lambda body: (lambda c: c.compress(body) + c.flush())(zlib.compressobj(6, zlib.DEFLATED, 31)),
+    'deflate': lambda body: zlib.compress(body, 6),
+}
+
+def encode_body(fmt, payloads, batch):
+    """Body giống client gửi: JSON compact như HttpService:JSONEncode, hoặc MessagePack"""
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(p, separators=(',', ':')) + '\n' for p in payloads).encode()
+    obj = [compact_row(p) for p in payloads] if fmt.startswith('compact') else payloads
+    if not batch:
+        obj = obj[0]
+    if fmt.endswith('msgpack'):
+        return msgpack.packb(obj)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+def run_parse(server, players, batch_size, seed, min_seconds=0.5):
+    """Decode throughput (giải nén + parse + expand compact) của server.decode_ingest_body, không ghi DB"""
+    rng = random.Random(seed)
+    payloads = [make_payload(i, rng) for i in range(players)]
+    formats = [fmt for fmt in BODY_FORMATS if msgpack is not None or not fmt.endswith('msgpack')]
+    results = {'single': {}, 'batch': {}}
+
+    for batch in (False, True):
+        groups = ([payloads[i:i + batch_size] for i in range(0, players, batch_size)] if batch
+                  else [[p] for p in payloads])
+        for fmt in formats:
+            if fmt == 'ndjson' and not batch:
+                continue
+            content_type = BODY_FORMATS[fmt]
+            raw_bodies = [encode_body(fmt, group, batch) for group in groups]
+            for encoding, compress in BODY_ENCODINGS.items():
+                bodies = [compress(body) for body in raw_bodies]
+                header = None if encoding == 'identity' else encoding
+                decoded = rounds = 0
+                start = time.perf_counter()
+                while True:
+                    for body, group in zip(bodies, groups):
+                        server.decode_ingest_body(body, content_type, header, batch=batch)
+                        decoded += len(group)
+                    rounds += 1
+                    elapsed = time.perf_counter() - start
+                    if elapsed >= min_seconds:
+                        break
+                wire_bytes = sum(len(body) for body in bodies)
+                results['batch' if batch else 'single'][f'{fmt}/{encoding}'] = {
+                    'bytes_per_payload': round(wire_bytes / players, 1),
+                    'payloads_per_sec': round(decoded / elapsed),
+                    'wire_mb_per_sec': round(wire_bytes * rounds / elapsed / 1e6, 2)
+                }
+
+    return {'players': players, 'batch_size': batch_size, 'msgpack': msgpack is not None, **results}
+
+def table_rows(server, table):
+    with server.db_pool.connection() as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+def run_growth(server, players, days, reports_per_day, seed, idle_ratio=0.0, samples=50):
+    """Mô phỏng nhiều ngày report (mỗi 30s) rồi đo size table + latency của detail query
+
+    idle_ratio: tỉ lệ account AFK, report không bao giờ thay đổi (trừ timestamp).
+    """
+    rng = random.Random(seed)
+    idle_players = int(players * idle_ratio)
+    current = [make_payload(i, rng) for i in range(players)]
+    client = server.app.test_client()
+    chunk = 500
+    result_days = []
+
+    for day in range(1, days + 1):
+        pending = []
+        for _ in range(reports_per_day):
+            for index in range(players):
+                if index < idle_players:
+                    current[index] = dict(current[index], timestamp=current[index]['timestamp'] + 30)
+                else:
+                    current[index] = evolve_payload(current[index], rng)
+                pending.append(current[index])
+            if len(pending) >= chunk:
+                server.ingest_batch(pending)
+                pending = []
+        if pending:
+            server.ingest_batch(pending)
+
+        start = time.perf_counter()
+        for i in range(samples):
+            client.get(f'/api/account-details/{current[i % players]["player_name"]}')
+        detail_ms = (time.perf_counter() - start) * 1000 / samples
+
+        result_days.append({
+            'day': day,
+            'player_stats_rows': table_rows(server, 'player_stats'),
+            'fighting_styles_rows': table_rows(server, 'fighting_styles'),
+            'player_items_rows': table_rows(server, 'player_items'),
+            # WAL chưa checkpoint cũng là dung lượng trên đĩa
+            **db_file_sizes(server.DB_FILE),
+            'detail_query_ms': round(detail_ms, 3)
+        })
+
+    return {'players': players, 'idle_players': idle_players, 'days': days,
+            'reports_per_day': reports_per_day, 'per_day': result_days}
+
+def percentile(values, pct):
+    """Percentile (nearest-rank) của list đã sort"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server_process(mode, db_dir):
+    """Chạy `server.py serve` trên port trống, chờ /api/ping trả lời
+
+    mode: 'threaded', 'async' hoặc 'async:N' (N worker process).
+    """
+    port = free_port()
+    mode, _, workers = mode.partition(':')
+    env = dict(os.environ, BF_DB_FILE=os.path.join(db_dir, f'{mode}{workers}.db'))
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'server.py'), 'serve', '--mode', mode,
+                             '--workers', workers or '1',
+                             '--host', '127.0.0.1', '--port', str(port), '--no-browser'],
+                            cwd=db_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            status, _ = asyncio.run(http_request(port, 'GET', '/api/ping'))
+            if status == 200:
+                return proc, port
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'{mode} server did not start (is uvicorn installed for async mode?)')
+
+async def http_request(port, method, path, body=b'', content_type='application/json'):
+    """HTTP/1.1 request tối giản (Connection: close), trả về (status, body)"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(f'{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: {content_type}\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    status = int(response.split(b' ', 2)[1]) if response.startswith(b'HTTP/') else 0
+    return status, response.partition(b'\r\n\r\n')[2]
+
+async def open_stream(port, timeout):
+    """Mở một SSE connection, trả về writer khi đã nhận response header (None nếu không kịp)"""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+        writer.write(b'GET /api/stream HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n')
+        await writer.drain()
+        await asyncio.wait_for(reader.readuntil(b'retry:'), timeout)
+        return writer
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        return None
+
+async def load_test(port, players, requests_total, concurrency, streams, seed):
+    """Giữ `streams` SSE connections mở, đồng thời bắn POST với `concurrency` clients, đo latency"""
+    start = time.perf_counter()
+    writers = await asyncio.gather(*(open_stream(port, 10) for _ in range(streams)))
+    open_seconds = time.perf_counter() - start
+    held = [w for w in writers if w is not None]
+
+    rng = random.Random(seed)
+    bodies = [json.dumps(make_payload(i % players, rng)).encode() for i in range(requests_total)]
+    latencies = []
+    errors = 0
+    next_index = iter(range(requests_total))
+
+    async def client():
+        nonlocal errors
+        for i in next_index:
+            sent = time.perf_counter()
+            try:
+                status, _ = await asyncio.wait_for(http_request(port, 'POST', '/api/bloxfruits/stats', bodies[i]), 30)
+            except (OSError, asyncio.TimeoutError):
+                status = 0
+            latencies.append((time.perf_counter() - sent) * 1000)
+            if status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    # Read route trong lúc stream vẫn mở (đi qua DB)
+    read_start = time.perf_counter()
+    summary_status, _ = await http_request(port, 'GET', '/api/dashboard/summary')
+    summary_ms = (time.perf_counter() - read_start) * 1000
+
+    for writer in held:
+        writer.close()
+    latencies.sort()
+    return {
+        'streams_requested': streams,
+        'streams_open': len(held),
+        'streams_open_seconds': round(open_seconds, 3),
+        'requests': requests_total,
+        'concurrency': concurrency,
+        'errors': errors,
+        'requests_per_sec': round(requests_total / elapsed, 1),
+        'latency_ms': {f'p{pct}': round(percentile(latencies, pct), 2) for pct in (50, 95, 99)},
+        'summary_status': summary_status,
+        'summary_ms': round(summary_ms, 2)
+    }
+
+def latency_summary(latencies):
+    """count + p50/p90/p99/max (ms) của list latency"""
+    latencies = sorted(latencies)
+    summary = {'count': len(latencies)}
+    if latencies:
+        summary.update({f'p{pct}': round(percentile(latencies, pct), 2) for pct in (50, 90, 99)})
+        summary['max'] = round(latencies[-1], 2)
+    return summary
+
+def db_file_sizes(db_file):
+    """Bytes của file DB và WAL (chỉ stat, không mở DB)"""
+    return {name: os.path.getsize(db_file + suffix) if os.path.exists(db_file + suffix) else 0
+            for name, suffix in (('db_bytes', ''), ('wal_bytes', '-wal'))}
+
+def db_footprint(db_file):
+    """Bytes (file + WAL) và số rows của các table lớn, đọc read-only từ file DB của server
+
+    COUNT(*) là full scan và có thể chờ lock: trong load generator phải gọi qua thread.
+    """
+    files = db_file_sizes(db_file)
+    rows = {}
+    try:
+        conn = sqlite3.connect(f'file:{db_file}?mode=ro', uri=True, timeout=30)
+        try:
+            for table in ('player_stats', 'player_latest', 'fighting_styles', 'player_items', 'progress_log'):
+                rows[table] = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
+    return dict(files, rows=rows)
+
+READ_MIX = [
+    # (tên nhóm, trọng số, path builder) - gần giống dashboard + tool bên ngoài
+    ('dashboard_summary', 5, lambda player, cursor: f'/api/dashboard/summary?since={cursor}'),
+    ('recent_accounts', 2, lambda player, cursor: '/api/recent-accounts?limit=10'),
+    ('account_details', 3, lambda player, cursor: f'/api/account-details/{player}'),
+    ('history', 1, lambda player, cursor: f'/api/history/{player}?metric=level&points=100'),
+    ('progress', 1, lambda player, cursor: f'/api/progress/{player}?limit=50'),
+]
+
+async def run_load(port, db_file, accounts, interval, duration, readers, read_think, max_inflight, seed):
+    """Open-loop ingest: mỗi account report mỗi `interval` giây (rải đều), cùng lúc `readers` client đọc"""
+    rng = random.Random(seed)
+    current = [make_payload(i, rng) for i in range(accounts)]
+    rate = accounts / interval
+    latencies = {'ingest': []}
+    errors = {'ingest': 0}
+    not_found = {}
+    reported = [0]
+    lateness = []
+    growth = []
+    inflight = asyncio.Semaphore(max_inflight)
+    stop = asyncio.Event()
+    tasks = set()
+
+    async def timed(group, method, path, body=b''):
+        sent = time.perf_counter()
+        try:
+            status, response = await asyncio.wait_for(http_request(port, method, path, body), 30)
+        except (OSError, asyncio.TimeoutError):
+            status, response = 0, b''
+        latencies.setdefault(group, []).append((time.perf_counter() - sent) * 1000)
+        if status == 404:
+            # Account vừa report có thể chưa được writer ghi xuống DB
+            not_found[group] = not_found.get(group, 0) + 1
+        elif status not in (200, 304):
+            errors[group] = errors.get(group, 0) + 1
+        return status, response
+
+    async def post(body):
+        async with inflight:
+            await timed('ingest', 'POST', '/api/bloxfruits/stats', body)
+
+    async def ingest():
+        start = time.perf_counter()
+        sent = 0
+        while time.perf_counter() - start < duration:
+            due = start + sent / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                lateness.append(-delay * 1000)
+            index = sent % accounts
+            current[index] = evolve_payload(current[index], rng)
+            task = asyncio.ensure_future(post(json.dumps(current[index]).encode()))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+            reported[0] = min(sent, accounts)
+        return sent
+
+    async def reader(reader_rng):
+        cursor = 0
+        groups = [entry for entry in READ_MIX for _ in range(entry[1])]
+        while not stop.is_set():
+            group, _, build_path = reader_rng.choice(groups)
+            player = current[reader_rng.randrange(max(1, reported[0]))]['player_name']
+            status, response = await timed(group, 'GET', build_path(player, cursor))
+            if group == 'dashboard_summary' and status == 200:
+                cursor = json.loads(response).get('cursor', cursor)
+            await asyncio.sleep(read_think)
+
+    async def sample_growth():
+        start = time.perf_counter()
+        while not stop.is_set():
+            # Trong load window chỉ stat file (qua thread), không COUNT(*) trên event loop
+            sizes = await loop.run_in_executor(None, db_file_sizes, db_file)
+            growth.append({'t': round(time.perf_counter() - start, 1), **sizes})
+            await asyncio.sleep(max(1.0, duration / 30))
+
+    loop = asyncio.get_running_loop()
+    before = await loop.run_in_executor(None, db_footprint, db_file)
+    reader_tasks = [asyncio.ensure_future(reader(random.Random(seed + i + 1))) for i in range(readers)]
+    sampler = asyncio.ensure_future(sample_growth())
+    start = time.perf_counter()
+    sent = await ingest()
+    if tasks:
+        await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await asyncio.gather(*reader_tasks, sampler)
+    # Chờ write-behind queue của server ghi xong trước khi đo size cuối
+    for _ in range(100):
+        status, response = await http_request(port, 'GET', '/api/ping')
+        if status != 200 or json.loads(response).get('ingest_queue', {}).get('depth', 0) == 0:
+            break
+        await asyncio.sleep(0.1)
+    after = await loop.run_in_executor(None, db_footprint, db_file)
+
+    return {
+        'accounts': accounts,
+        'interval_seconds': interval,
+        'target_requests_per_sec': round(rate, 1),
+        'achieved_requests_per_sec': round(sent / elapsed, 1),
+        'duration_seconds': round(elapsed, 1),
+        'ingest_requests': sent,
+        'readers': readers,
+        'schedule_lateness_ms': latency_summary(lateness),
+        'latency_ms': {group: latency_summary(values) for group, values in latencies.items()},
+        'errors': errors,
+        'not_found': not_found,
+        'db_before': before,
+        'db_after': after,
+        'db_growth_bytes': (after['db_bytes'] + after['wal_bytes']) - (before['db_bytes'] + before['wal_bytes']),
+        'db_growth_series': growth
+    }
+
+def run_load_test(mode, accounts, interval, duration, readers, read_think, max_inflight, seed):
+    """Chạy run_load với server `mode` trên DB tạm"""
+    with tempfile.TemporaryDirectory() as db_dir:
+        proc, port = start_server_process(mode, db_dir)
+        mode_name, _, workers = mode.partition(':')
+        try:
+            result = asyncio.run(run_load(port, os.path.join(db_dir, f'{mode_name}{workers}.db'), accounts,
+                                          interval, duration, readers, read_think, max_inflight, seed))
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+    return dict(result, mode=mode)
+
+def run_metadata(args):
+    """Thông tin để so sánh kết quả giữa các commit"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'scenario': args.scenario,
+        'commit': commit,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'cpus': os.cpu_count(),
+        'args': vars(args)
+    }
+
+def write_output(path, meta, result):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'result': result}, f, indent=2)
+
+def run_serve_comparison(modes, players, requests_total, concurrency, streams, seed):
+    """Chạy load_test lần lượt với threaded Flask và async (ASGI) server, mỗi mode một server + DB riêng"""
+    results = {}
+    with tempfile.TemporaryDirectory() as db_dir:
+        for mode in modes:
+            proc, port = start_server_process(mode, db_dir)
+            try:
+                results[mode] = asyncio.run(load_test(port, players, requests_total, concurrency, streams, seed))
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ingest của Blox Fruits tracker')
+    parser.add_argument('scenario', nargs='?', default='ingest', choices=['ingest', 'growth', 'serve', 'load', 'parse'])
+    parser.add_argument('--players', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--reports-per-day', type=int, default=2880)
+    parser.add_argument('--idle-ratio', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--streams', type=int, default=500, help='SSE connections giữ mở trong serve scenario')
+    parser.add_argument('--modes', default='threaded,async', help='vd. threaded,async,async:2,async:4')
+    parser.add_argument('--accounts', type=int, default=1000, help='số account giả lập (load scenario)')
+    parser.add_argument('--interval', type=float, default=30, help='giây giữa hai report của một account')
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--readers', type=int, default=4, help='client đọc dashboard/API chạy song song')
+    parser.add_argument('--read-think', type=float, default=0.5, help='giây nghỉ giữa hai request đọc')
+    parser.add_argument('--max-inflight', type=int, default=256)
+    parser.add_argument('--mode', default='async', help='server mode cho load scenario: threaded, async, async:N')
+    parser.add_argument('--batch-size', type=int, default=100, help='số payload mỗi batch body (parse scenario)')
+    parser.add_argument('--output', help='ghi kết quả JSON (kèm meta) ra file')
+    parser.add_argument('--seed', type=int, default=1337)
+    args = parser.parse_args()
+    meta = run_metadata(args)
+
+    if args.scenario in ('serve', 'load'):
+        if args.scenario == 'serve':
+            result = run_serve_comparison(args.modes.split(','), args.players, args.requests, args.concurrency,
+                                          args.streams, args.seed)
+        else:
+            result = run_load_test(args.mode, args.accounts, args.interval, args.duration, args.readers,
+                                   args.read_think, args.max_inflight, args.seed)
+        print(json.dumps(result, indent=2))
+        if args.output:
+            write_output(args.output, meta, result)
+        return
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        # Ẩn console output của server để không ảnh hưởng số đo
+        with contextlib.redirect_stdout(io.StringIO()):
+            server = load_server(db_dir)
+            if args.scenario == 'growth':
+                result = run_growth(server, args.players, args.days, args.reports_per_day, args.seed,
+                                    args.idle_ratio)
+            elif args.scenario == 'parse':
+                result = run_parse(server, args.players, args.batch_size, args.seed)
+            else:
+                result = run_ingest(server, args.players, args.requests, args.threads, args.seed)
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        write_output(args.output, meta, result)
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,376 @@
 # 🍓 Blox Fruits Stats Tracker Server
 # Advanced Python Flask server để track stats Blox Fruits players
 
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, request, jsonify, render_template_string, Response, g
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
 import threading
 import webbrowser
 import time
 import sqlite3
 import os
+import queue
+import atexit
+import csv
+import io
+import zlib
+import itertools
+import asyncio
+import sys
+import bisect
+import random
+import logging
+import logging.handlers
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import parse_qs
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 app = Flask(__name__)
 CORS(app)
 
 # Database setup
-DB_FILE = 'blox_fruits_stats.db'
-
-def init_database():
+DB_FILE = os.environ.get('BF_DB_FILE', 'blox_fruits_stats.db')
+DB_POOL_SIZE = int(os.environ.get('BF_DB_POOL_SIZE', 8))
+DB_CACHE_KB = int(os.environ.get('BF_DB_CACHE_KB', 16384))
+DB_STATEMENT_CACHE = 256
+
+# Write-behind ingest queue setup
+INGEST_QUEUE_SIZE = int(os.environ.get('BF_INGEST_QUEUE_SIZE', 5000))
+INGEST_FLUSH_SIZE = int(os.environ.get('BF_INGEST_FLUSH_SIZE', 200))
+INGEST_FLUSH_INTERVAL = float(os.environ.get('BF_INGEST_FLUSH_INTERVAL', 0.5))
+# Batch gặp lock contention (nhiều worker cùng ghi) được ghi lại tối đa chừng này lần, backoff tăng dần
+INGEST_WRITE_RETRIES = int(os.environ.get('BF_INGEST_WRITE_RETRIES', 5))
+INGEST_RETRY_BACKOFF = 0.2
+BATCH_MAX_ITEMS = int(os.environ.get('BF_BATCH_MAX_ITEMS', 500))
+# /api/clear chờ queue flush tối đa chừng này giây, quá thì trả 503
+CLEAR_FLUSH_TIMEOUT = float(os.environ.get('BF_CLEAR_FLUSH_TIMEOUT', 10))
+# Giới hạn body ingest, cả khi đọc từ socket lẫn sau khi giải nén (chặn gzip bomb)
+INGEST_MAX_BODY_BYTES = int(os.environ.get('BF_INGEST_MAX_BODY_BYTES', 8 * 1024 * 1024))
+EXPORT_CHUNK_ROWS = int(os.environ.get('BF_EXPORT_CHUNK_ROWS', 1000))
+STREAM_KEEPALIVE_SECONDS = 15
+
+# Async (ASGI) mode: số thread tối đa chạy Flask routes / DB work, ngoài event loop
+ASYNC_DB_WORKERS = int(os.environ.get('BF_ASYNC_DB_WORKERS', DB_POOL_SIZE))
+
+# Live state (active sessions + recent updates feed)
+# 'memory': trong process, chỉ đúng khi chạy một worker
+# 'sqlite': SQLite file riêng dùng chung giữa các worker process (`serve --mode async --workers N`)
+#
+# Multi-worker deployment (mỗi worker một CPU core):
+#   python server.py serve --mode async --workers 4          (tự bật BF_LIVE_STATE=sqlite)
+#   BF_LIVE_STATE=sqlite uvicorn server:asgi_app --workers 4 --port 5000
+# Mọi worker dùng chung DB_FILE và LIVE_STATE_FILE. Chỉ phần parse/validate/enqueue và các route đọc
+# scale theo số worker; ghi DB vẫn là một SQLite writer tại một thời điểm (BEGIN IMMEDIATE, batch bị
+# busy thì ghi lại), nên throughput ghi bị chặn bởi một writer, không tăng tuyến tính theo số core.
+# Batch lớn (BF_INGEST_FLUSH_SIZE) giảm số lần tranh write lock. /api/ping: ingest_queue là số liệu
+# của worker trả lời. tests/test_multiworker.py kiểm tra hai worker ghi chung một DB.
+# Mỗi worker có ingest queue riêng: hai report của cùng player cách nhau < BF_INGEST_FLUSH_INTERVAL
+# có thể được ghi ngược thứ tự (client thật report mỗi 30s nên không gặp).
+# Đo: python benchmark.py serve --modes async,async:2,async:4
+LIVE_STATE_BACKEND = os.environ.get('BF_LIVE_STATE', 'memory')
+LIVE_STATE_FILE = os.environ.get('BF_LIVE_STATE_FILE', DB_FILE + '.live')
+LIVE_STATE_POLL_INTERVAL = 0.25
+
+# Metrics (/metrics) + sampling profiler (/api/admin/profiler)
+METRICS_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PROFILER_ENABLED = os.environ.get('BF_PROFILE', '0') == '1'
+PROFILER_INTERVAL = float(os.environ.get('BF_PROFILE_INTERVAL', 0.005))
+PROFILER_MAX_DEPTH = 40
+# Số stack phân biệt tối đa giữ trong memory, stack mới sau đó gộp vào '<other>'
+PROFILER_MAX_STACKS = int(os.environ.get('BF_PROFILE_MAX_STACKS', 5000))
+
+# Logging: 'json' = JSON lines (mặc định khi stdout không phải terminal), 'pretty' = log emoji như cũ
+# BF_LOG_SAMPLE: tỉ lệ ingest event được log (warning/error luôn được log)
+LOG_FORMAT = os.environ.get('BF_LOG_FORMAT', 'pretty' if sys.stdout.isatty() else 'json')
+LOG_LEVEL = os.environ.get('BF_LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.environ.get('BF_LOG_SAMPLE', 1.0))
+LOG_QUEUE_SIZE = int(os.environ.get('BF_LOG_QUEUE_SIZE', 10000))
+
+class JsonLineFormatter(logging.Formatter):
+    """Một JSON object mỗi dòng: ts, level, event, message + fields của event"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname.lower(),
+            'event': getattr(record, 'event', 'log')
+        }
+        message = record.getMessage()
+        if message:
+            entry['message'] = message
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class PrettyFormatter(logging.Formatter):
+    """Log cho người đọc trên terminal (block emoji cho mỗi ingest như trước đây)"""
+
+    def format(self, record):
+        fields = getattr(record, 'fields', {})
+        if getattr(record, 'event', None) == 'ingest':
+            time_str = datetime.fromtimestamp(record.created).strftime('%H:%M:%S')
+            return '\n'.join([
+                f"🍓 [{time_str}] Blox Fruits Stats Received:",
+                f"   👤 Player: {fields['player']} (ID: {fields.get('user_id', 'Unknown')})",
+                f"   ⭐ Level: {fields.get('player_level', 0)} | 💰 Beli: {fields.get('beli', 0):,}",
+                f"   💎 Fragments: {fields.get('fragments', 0):,} | ⚔️ Style: {fields.get('fighting_style', 'None')}",
+                "   " + "-" * 60
+            ])
+        message = record.getMessage() or ' '.join(
+            [getattr(record, 'event', 'log')] + [f'{name}={value}' for name, value in fields.items()])
+        if record.exc_info:
+            message += '\n' + self.formatException(record.exc_info)
+        return message
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler không bao giờ block request thread: queue đầy thì bỏ record và đếm"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Format ở listener thread, không phải thread gọi log
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class BufferedStreamHandler(logging.StreamHandler):
+    """StreamHandler chỉ flush khi log queue đã cạn, thay vì một syscall mỗi dòng"""
+
+    def __init__(self, stream, log_queue):
+        super().__init__(stream)
+        self.log_queue = log_queue
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+            if self.log_queue.empty():
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+# BF_LOG_LEVEL sai không được làm server crash lúc import: dùng INFO và cảnh báo (sau khi có log_event)
+_invalid_log_level = None
+if LOG_LEVEL not in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'):
+    _invalid_log_level, LOG_LEVEL = LOG_LEVEL, 'INFO'
+
+logger = logging.getLogger('bloxfruits')
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+log_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+logger.addHandler(log_handler)
+_log_output = BufferedStreamHandler(sys.stdout, log_handler.queue)
+_log_output.setFormatter(JsonLineFormatter() if LOG_FORMAT == 'json' else PrettyFormatter())
+log_listener = logging.handlers.QueueListener(log_handler.queue, _log_output)
+log_listener.start()
+
+LOG_LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warning': logging.WARNING, 'error': logging.ERROR}
+
+def log_event(level, event, message='', sampled=False, exc_info=None, **fields):
+    """Đưa một structured event vào log queue; sampled=True áp dụng BF_LOG_SAMPLE"""
+    levelno = LOG_LEVELS[level]
+    if not logger.isEnabledFor(levelno):
+        return
+    if sampled and LOG_SAMPLE_RATE < 1.0 and random.random() >= LOG_SAMPLE_RATE:
+        return
+    if exc_info is True:
+        exc_info = sys.exc_info()
+    # makeRecord trực tiếp: bỏ qua findCaller (walk stack) của logger.log trên request thread
+    logger.handle(logger.makeRecord(logger.name, levelno, '', 0, message, (), exc_info,
+                                    extra={'event': event, 'fields': fields}))
+
+if _invalid_log_level is not None:
+    log_event('warning', 'invalid_log_level', f"⚠️ Unknown BF_LOG_LEVEL {_invalid_log_level!r}, using INFO",
+              value=_invalid_log_level)
+
+# Delta protocol giữa Lua sender và server (keyframe + delta có sequence number)
+DELTA_PROTOCOL_VERSION = 1
+
+# Snapshot dedup: report giống hệt report trước chỉ bump heartbeat, keyframe tối thiểu mỗi MAX_GAP giây
+SNAPSHOT_DEDUP = os.environ.get('BF_SNAPSHOT_DEDUP', '1') != '0'
+SNAPSHOT_MAX_GAP = float(os.environ.get('BF_SNAPSHOT_MAX_GAP', 600))
+
+# beli_delta chỉ được log khi beli lệch ít nhất chừng này so với lần log trước (farm liên tục không spam progress_log)
+BELI_EVENT_THRESHOLD = int(os.environ.get('BF_BELI_EVENT_THRESHOLD', 1000000))
+
+# Retention: raw snapshots giữ N ngày (sau đó chỉ còn rollups + progress_log), minute rollups giữ M ngày
+RAW_RETENTION_DAYS = float(os.environ.get('BF_RAW_RETENTION_DAYS', 30))
+MINUTE_ROLLUP_RETENTION_DAYS = float(os.environ.get('BF_MINUTE_ROLLUP_RETENTION_DAYS', 30))
+COMPACT_INTERVAL = float(os.environ.get('BF_COMPACT_INTERVAL', 3600))
+COMPACT_BATCH_ROWS = int(os.environ.get('BF_COMPACT_BATCH_ROWS', 500))
+COMPACT_VACUUM_PAGES = int(os.environ.get('BF_COMPACT_VACUUM_PAGES', 2000))
+
+# Time-series rollups: metrics + resolution -> (strftime bucket format, giây mỗi bucket), mịn -> thô
+ROLLUP_METRICS = ('level', 'beli', 'fragments', 'bounty', 'honor')
+ROLLUP_RESOLUTIONS = {
+    'minute': ('%Y-%m-%d %H:%M', 60),
+    'hour': ('%Y-%m-%d %H:00', 3600),
+    'day': ('%Y-%m-%d', 86400),
+}
+
+class ConnectionPool:
+    """Pool SQLite connections dùng chung cho mọi route (WAL mode)"""
+
+    def __init__(self, db_file, size=DB_POOL_SIZE):
+        self.db_file = db_file
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Mở connection mới và áp dụng pragmas"""
+        # sqlite3 tự cache prepared statements theo SQL text trên mỗi connection,
+        # nên giữ connection sống lâu = reuse statements giữa các request
+        conn = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False,
+                               cached_statements=DB_STATEMENT_CACHE)
+        # auto_vacuum phải set trước khi file được tạo; DB cũ cần `python server.py vacuum` một lần
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{DB_CACHE_KB}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA busy_timeout=30000')
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        """Mượn một connection từ pool, tự trả lại khi xong"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close_all(self):
+        """Đóng tất cả connections đang idle"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+db_pool = ConnectionPool(DB_FILE)
+
+def init_database(pool=db_pool):
     """Khởi tạo SQLite database"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Player stats table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS player_stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            player_name TEXT NOT NULL,
+    with pool.connection() as conn:
+        # Schema gốc (v0) chỉ tạo cho database mới để migrations chạy từ đầu; từ v9
+        # player_stats, fighting_styles, player_items là views
+        if get_schema_version(conn) == 0:
+            cursor = conn.cursor()
+
+            # Player stats table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS player_stats (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    player_name TEXT NOT NULL,
+                    user_id INTEGER,
+                    level INTEGER DEFAULT 0,
+                    beli INTEGER DEFAULT 0,
+                    fragments INTEGER DEFAULT 0,
+                    bounty INTEGER DEFAULT 0,
+                    honor INTEGER DEFAULT 0,
+                    equipped_fruit TEXT,
+                    fighting_style TEXT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    session_id TEXT
+                )
+            ''')
+
+            # Fighting styles table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS fighting_styles (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    player_name TEXT NOT NULL,
+                    user_id INTEGER,
+                    style_name TEXT NOT NULL,
+                    owned BOOLEAN DEFAULT FALSE,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Weapons/Items table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS player_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    player_name TEXT NOT NULL,
+                    user_id INTEGER,
+                    item_name TEXT NOT NULL,
+                    item_type TEXT, -- Sword, Gun, Fruit, etc.
+                    rarity TEXT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Progress tracking
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS progress_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    player_name TEXT NOT NULL,
+                    user_id INTEGER,
+                    event_type TEXT, -- level_up, new_fruit, new_weapon, etc.
+                    old_value TEXT,
+                    new_value TEXT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            conn.commit()
+
+        run_migrations(conn)
+
+def migration_001_indexes(conn):
+    """Indexes cho các dashboard/detail queries"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_player_stats_player_ts ON player_stats (player_name, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_player_stats_ts_level ON player_stats (timestamp, level)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_fighting_styles_player ON fighting_styles (player_name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_player_items_player ON player_items (player_name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_progress_log_player_ts ON progress_log (player_name, timestamp)')
+
+def migration_002_player_latest(conn):
+    """Bảng player_latest: snapshot mới nhất của mỗi player, upsert khi ingest"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS player_latest (
+            player_name TEXT PRIMARY KEY,
             user_id INTEGER,
             level INTEGER DEFAULT 0,
             beli INTEGER DEFAULT 0,
@@ -35,59 +379,843 @@ def init_database():
             honor INTEGER DEFAULT 0,
             equipped_fruit TEXT,
             fighting_style TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            session_id TEXT
+            session_id TEXT,
+            last_update DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
-    # Fighting styles table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS fighting_styles (
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_player_latest_last_update ON player_latest (last_update)')
+    conn.execute('''
+        INSERT INTO player_latest
+        (player_name, user_id, level, beli, fragments, bounty, honor,
+         equipped_fruit, fighting_style, session_id, last_update)
+        SELECT player_name, user_id, level, beli, fragments, bounty, honor,
+               equipped_fruit, fighting_style, session_id, timestamp
+        FROM player_stats
+        WHERE id IN (SELECT MAX(id) FROM player_stats GROUP BY player_name)
+    ''')
+
+def raw_history_start(conn):
+    """None nếu player_stats còn đủ history; sau khi retention đã prune thì trả timestamp
+    raw row cũ nhất còn lại (bucket chứa nó có thể chỉ còn một phần)"""
+    pruned = conn.execute("SELECT value FROM tracker_counters WHERE name = 'pruned_snapshots'").fetchone()
+    if not pruned or not pruned[0]:
+        return None
+    oldest = conn.execute('SELECT MIN(timestamp) FROM player_stats').fetchone()[0]
+    return oldest or '9999-12-31 23:59:59'
+
+def rebuild_player_latest(conn):
+    """Backfill player_latest từ history player_stats (row mới nhất theo id)
+
+    Khi retention đã prune raw rows, player không còn row nào vẫn được giữ nguyên
+    (player_latest là nơi duy nhất còn trạng thái của họ), chỉ upsert các player còn history.
+    """
+    if raw_history_start(conn) is None:
+        conn.execute('DELETE FROM player_latest')
+    conn.execute('''
+        INSERT INTO player_latest
+        (player_name, user_id, level, beli, fragments, bounty, honor,
+         equipped_fruit, fighting_style, session_id, last_update, change_seq)
+        SELECT player_name, user_id, level, beli, fragments, bounty, honor,
+               equipped_fruit, fighting_style, session_id, timestamp, id
+        FROM player_stats
+        WHERE id IN (SELECT MAX(id) FROM player_stats GROUP BY player_name)
+        ON CONFLICT(player_name) DO UPDATE SET
+            user_id = excluded.user_id,
+            level = excluded.level,
+            beli = excluded.beli,
+            fragments = excluded.fragments,
+            bounty = excluded.bounty,
+            honor = excluded.honor,
+            equipped_fruit = excluded.equipped_fruit,
+            fighting_style = excluded.fighting_style,
+            session_id = excluded.session_id,
+            last_update = MAX(player_latest.last_update, excluded.last_update),
+            change_seq = excluded.change_seq
+    ''')
+
+def migration_003_fighting_styles_unique(conn):
+    """Dedup fighting_styles: mỗi (player_name, style_name) một row với first_seen/last_seen"""
+    conn.execute('''
+        CREATE TABLE fighting_styles_new (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             player_name TEXT NOT NULL,
             user_id INTEGER,
             style_name TEXT NOT NULL,
             owned BOOLEAN DEFAULT FALSE,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (player_name, style_name)
         )
     ''')
-    
-    # Weapons/Items table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS player_items (
+    conn.execute('''
+        INSERT INTO fighting_styles_new (player_name, user_id, style_name, owned, first_seen, last_seen)
+        SELECT player_name, MAX(user_id), style_name, MAX(owned), MIN(timestamp), MAX(timestamp)
+        FROM fighting_styles
+        GROUP BY player_name, style_name
+    ''')
+    conn.execute('DROP TABLE fighting_styles')
+    conn.execute('ALTER TABLE fighting_styles_new RENAME TO fighting_styles')
+
+def migration_004_player_latest_change_seq(conn):
+    """change_seq trên player_latest: cursor tăng dần cho dashboard delta API"""
+    conn.execute('ALTER TABLE player_latest ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0')
+    conn.execute('UPDATE player_latest SET change_seq = rowid')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_player_latest_change_seq ON player_latest (change_seq)')
+
+def migration_005_counters(conn):
+    """Running totals + cửa sổ level theo phút cho headline counters"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tracker_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS level_window (
+            minute TEXT PRIMARY KEY, -- 'YYYY-MM-DD HH:MM' UTC
+            level_sum INTEGER NOT NULL DEFAULT 0,
+            samples INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    rebuild_counters(conn)
+
+def recompute_counters(conn):
+    """Tính lại counters từ đầu (full scan) - dùng cho rebuild và consistency check"""
+    # Raw rows đã bị retention xóa
+    # (và report trùng lặp chỉ bump heartbeat) vẫn tính vào total_updates
+    not_stored = conn.execute('''
+        SELECT COALESCE(SUM(value), 0) FROM tracker_counters WHERE name IN ('pruned_snapshots', 'skipped_snapshots')
+    ''').fetchone()[0]
+    total_updates = conn.execute('SELECT COUNT(*) FROM player_stats').fetchone()[0] + not_stored
+    # Đếm từ nguồn độc lập với player_latest: players dimension (v9+, không bị retention
+    # prune), trước v9 là tên player trong history
+    has_players = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'players'").fetchone()
+    total_players = conn.execute(
+        'SELECT COUNT(*) FROM players' if has_players else
+        'SELECT COUNT(DISTINCT player_name) FROM player_stats').fetchone()[0]
+    window = conn.execute('''
+        SELECT strftime('%Y-%m-%d %H:%M', timestamp) AS minute, SUM(level), COUNT(*)
+        FROM player_stats
+        WHERE timestamp > datetime('now', '-1 hour')
+        GROUP BY minute
+    ''').fetchall()
+    return {'total_updates': total_updates, 'total_players': total_players}, window
+
+def rebuild_counters(conn):
+    """Ghi đè tracker_counters và level_window bằng giá trị tính lại từ history"""
+    counters, window = recompute_counters(conn)
+    conn.executemany('INSERT OR REPLACE INTO tracker_counters (name, value) VALUES (?, ?)', counters.items())
+    conn.execute('DELETE FROM level_window')
+    conn.executemany('INSERT INTO level_window (minute, level_sum, samples) VALUES (?, ?, ?)', window)
+
+def migration_006_rollups(conn):
+    """Rollup tables (min/max/last mỗi metric mỗi bucket) cho minute/hour/day"""
+    metric_columns = ',\n'.join(
+        f'            {m}_min INTEGER, {m}_max INTEGER, {m}_last INTEGER' for m in ROLLUP_METRICS
+    )
+    for resolution in ROLLUP_RESOLUTIONS:
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS rollup_{resolution} (
+                player_name TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+{metric_columns},
+                PRIMARY KEY (player_name, bucket)
+            ) WITHOUT ROWID
+        ''')
+    rebuild_rollups(conn)
+
+def rebuild_rollups(conn):
+    """Backfill rollup tables từ history player_stats
+
+    Sau khi retention đã prune raw rows, chỉ rebuild các bucket sau bucket chứa raw row cũ
+    nhất còn lại; bucket cũ hơn giữ nguyên vì rollup là nơi duy nhất còn history đó.
+    """
+    start = raw_history_start(conn)
+    columns = ', '.join(f'{m}_min, {m}_max, {m}_last' for m in ROLLUP_METRICS)
+    for resolution, (fmt, _) in ROLLUP_RESOLUTIONS.items():
+        window = ', '.join(
+            f'MIN({m}) OVER w AS {m}_min, MAX({m}) OVER w AS {m}_max, {m} AS {m}_last' for m in ROLLUP_METRICS
+        )
+        first_bucket = conn.execute(f"SELECT strftime('{fmt}', ?)", (start,)).fetchone()[0] if start else ''
+        conn.execute(f'DELETE FROM rollup_{resolution} WHERE bucket > ?', (first_bucket,))
+        conn.execute(f'''
+            INSERT INTO rollup_{resolution} (player_name, bucket, {columns})
+            SELECT player_name, bucket, {columns} FROM (
+                SELECT player_name, bucket, {window},
+                       ROW_NUMBER() OVER (PARTITION BY player_name, bucket ORDER BY id DESC) AS rn
+                FROM (SELECT *, strftime('{fmt}', timestamp) AS bucket FROM player_stats)
+                WINDOW w AS (PARTITION BY player_name, bucket)
+            )
+            WHERE rn = 1 AND bucket > ?
+        ''', (first_bucket,))
+
+def migration_007_retention(conn):
+    """Index bucket cho retention của rollup_minute + counter số raw rows đã prune"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_rollup_minute_bucket ON rollup_minute (bucket)')
+    conn.execute("INSERT OR IGNORE INTO tracker_counters (name, value) VALUES ('pruned_snapshots', 0)")
+
+def migration_008_skipped_snapshots(conn):
+    """Counter số report trùng lặp không ghi history row"""
+    conn.execute("INSERT OR IGNORE INTO tracker_counters (name, value) VALUES ('skipped_snapshots', 0)")
+
+def migration_009_dimensions(conn):
+    """Normalize player/fruit/style/item names thành dimension tables với integer ids
+
+    player_stats, fighting_styles, player_items trở thành views (cùng columns như cũ) trên
+    player_snapshots, player_styles, player_inventory để các query đọc không phải đổi.
+    """
+    conn.execute('CREATE TABLE players (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)')
+    conn.execute('CREATE TABLE fruits (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)')
+    conn.execute('CREATE TABLE styles (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)')
+    conn.execute('''
+        CREATE TABLE items (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            item_type TEXT,
+            UNIQUE (name, item_type)
+        )
+    ''')
+
+    # Dimension values từ data hiện có
+    conn.execute('''
+        INSERT OR IGNORE INTO players (name)
+        SELECT player_name FROM player_stats UNION SELECT player_name FROM fighting_styles
+        UNION SELECT player_name FROM player_items
+    ''')
+    conn.execute('INSERT OR IGNORE INTO fruits (name) SELECT DISTINCT equipped_fruit FROM player_stats '
+                 'WHERE equipped_fruit IS NOT NULL')
+    conn.execute('''
+        INSERT OR IGNORE INTO styles (name)
+        SELECT fighting_style FROM player_stats WHERE fighting_style IS NOT NULL
+        UNION SELECT style_name FROM fighting_styles
+    ''')
+    conn.execute('INSERT OR IGNORE INTO items (name, item_type) SELECT DISTINCT item_name, item_type FROM player_items')
+
+    # Snapshots
+    conn.execute('''
+        CREATE TABLE player_snapshots (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            player_name TEXT NOT NULL,
+            player_id INTEGER NOT NULL REFERENCES players (id),
             user_id INTEGER,
-            item_name TEXT NOT NULL,
-            item_type TEXT, -- Sword, Gun, Fruit, etc.
-            rarity TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            level INTEGER DEFAULT 0,
+            beli INTEGER DEFAULT 0,
+            fragments INTEGER DEFAULT 0,
+            bounty INTEGER DEFAULT 0,
+            honor INTEGER DEFAULT 0,
+            fruit_id INTEGER REFERENCES fruits (id),
+            style_id INTEGER REFERENCES styles (id),
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            session_id TEXT
         )
     ''')
-    
-    # Progress tracking
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS progress_log (
+    conn.execute('''
+        INSERT INTO player_snapshots
+        (id, player_id, user_id, level, beli, fragments, bounty, honor, fruit_id, style_id, timestamp, session_id)
+        SELECT s.id, p.id, s.user_id, s.level, s.beli, s.fragments, s.bounty, s.honor, f.id, st.id,
+               s.timestamp, s.session_id
+        FROM player_stats s
+        JOIN players p ON p.name = s.player_name
+        LEFT JOIN fruits f ON f.name = s.equipped_fruit
+        LEFT JOIN styles st ON st.name = s.fighting_style
+    ''')
+    conn.execute('DROP TABLE player_stats')
+    conn.execute('CREATE INDEX idx_player_snapshots_player_ts ON player_snapshots (player_id, timestamp)')
+    conn.execute('CREATE INDEX idx_player_snapshots_ts_level ON player_snapshots (timestamp, level)')
+    conn.execute('''
+        CREATE VIEW player_stats AS
+        SELECT s.id, p.name AS player_name, s.user_id, s.level, s.beli, s.fragments, s.bounty, s.honor,
+               f.name AS equipped_fruit, st.name AS fighting_style, s.timestamp, s.session_id
+        FROM player_snapshots s
+        JOIN players p ON p.id = s.player_id
+        LEFT JOIN fruits f ON f.id = s.fruit_id
+        LEFT JOIN styles st ON st.id = s.style_id
+    ''')
+
+    # Owned fighting styles
+    conn.execute('''
+        CREATE TABLE player_styles (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            player_name TEXT NOT NULL,
+            player_id INTEGER NOT NULL REFERENCES players (id),
             user_id INTEGER,
-            event_type TEXT, -- level_up, new_fruit, new_weapon, etc.
-            old_value TEXT,
-            new_value TEXT,
+            style_id INTEGER NOT NULL REFERENCES styles (id),
+            owned BOOLEAN DEFAULT FALSE,
+            first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (player_id, style_id)
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO player_styles (id, player_id, user_id, style_id, owned, first_seen, last_seen)
+        SELECT fs.id, p.id, fs.user_id, st.id, fs.owned, fs.first_seen, fs.last_seen
+        FROM fighting_styles fs
+        JOIN players p ON p.name = fs.player_name
+        JOIN styles st ON st.name = fs.style_name
+    ''')
+    conn.execute('DROP TABLE fighting_styles')
+    conn.execute('''
+        CREATE VIEW fighting_styles AS
+        SELECT ps.id, p.name AS player_name, ps.user_id, st.name AS style_name, ps.owned,
+               ps.first_seen, ps.last_seen
+        FROM player_styles ps
+        JOIN players p ON p.id = ps.player_id
+        JOIN styles st ON st.id = ps.style_id
+    ''')
+
+    # Inventory
+    conn.execute('''
+        CREATE TABLE player_inventory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            player_id INTEGER NOT NULL REFERENCES players (id),
+            user_id INTEGER,
+            item_id INTEGER NOT NULL REFERENCES items (id),
+            rarity TEXT,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
-    conn.commit()
-    conn.close()
+    conn.execute('''
+        INSERT INTO player_inventory (id, player_id, user_id, item_id, rarity, timestamp)
+        SELECT pi.id, p.id, pi.user_id, i.id, pi.rarity, pi.timestamp
+        FROM player_items pi
+        JOIN players p ON p.name = pi.player_name
+        JOIN items i ON i.name = pi.item_name AND i.item_type IS pi.item_type
+    ''')
+    conn.execute('DROP TABLE player_items')
+    conn.execute('CREATE INDEX idx_player_inventory_player ON player_inventory (player_id)')
+    conn.execute('''
+        CREATE VIEW player_items AS
+        SELECT pi.id, p.name AS player_name, pi.user_id, i.name AS item_name, i.item_type, pi.rarity, pi.timestamp
+        FROM player_inventory pi
+        JOIN players p ON p.id = pi.player_id
+        JOIN items i ON i.id = pi.item_id
+    ''')
+
+# Schema migrations: (version, mô tả, function). Version lưu trong PRAGMA user_version.
+# Chỉ thêm migration mới vào cuối list, không sửa migration đã release.
+MIGRATIONS = [
+    (1, 'indexes for player_stats, fighting_styles, player_items, progress_log', migration_001_indexes),
+    (2, 'player_latest snapshot table', migration_002_player_latest),
+    (3, 'unique (player_name, style_name) on fighting_styles', migration_003_fighting_styles_unique),
+    (4, 'change_seq cursor on player_latest', migration_004_player_latest_change_seq),
+    (5, 'tracker_counters and level_window', migration_005_counters),
+    (6, 'minute/hour/day stat rollups', migration_006_rollups),
+    (7, 'retention bookkeeping', migration_007_retention),
+    (8, 'skipped snapshot counter', migration_008_skipped_snapshots),
+    (9, 'interned dimension tables for players, fruits, styles, items', migration_009_dimensions),
+]
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def run_migrations(conn):
+    """Nâng cấp database file tại chỗ lên version mới nhất"""
+    current = get_schema_version(conn)
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Kiểm tra lại trong transaction, phòng khi process khác đã migrate
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            migrate(conn)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        log_event('info', 'migration', f"🛠️ Database migrated to v{version}: {description}",
+                  version=version, description=description)
+        current = version
+
+# Các query nóng phải dùng index; check_query_plans() phát hiện full table scan
+QUERY_PLAN_CHECKS = {
+    'active players (dashboard)': ('''
+        SELECT player_name, user_id, level, beli, fragments, fighting_style, equipped_fruit, last_update
+        FROM player_latest WHERE last_update > ? ORDER BY last_update DESC
+    ''', ('2000-01-01',)),
+    'recent accounts': ('''
+        SELECT player_name, user_id, level, beli, fragments, fighting_style, equipped_fruit, last_update
+        FROM player_latest ORDER BY last_update DESC LIMIT ?
+    ''', (10,)),
+    'changed players (summary)': ('''
+        SELECT player_name FROM player_latest WHERE change_seq > ? ORDER BY change_seq
+    ''', (0,)),
+    'history (hour rollup)': ('''
+        SELECT bucket, level_min, level_max, level_last FROM rollup_hour
+        WHERE player_name = ? AND bucket >= ? AND bucket <= ? ORDER BY bucket
+    ''', ('x', '2000-01-01', '2100-01-01')),
+    'history (raw)': ('''
+        SELECT timestamp, level FROM player_stats
+        WHERE player_name = ? AND timestamp >= ? AND timestamp <= ? ORDER BY timestamp
+    ''', ('x', '2000-01-01', '2100-01-01')),
+    'avg level window': ('SELECT SUM(level_sum), SUM(samples) FROM level_window WHERE minute > ?', ('2000-01-01',)),
+    'latest snapshot for player': ('SELECT * FROM player_latest WHERE player_name = ?', ('x',)),
+    'player id': ('SELECT id FROM players WHERE name = ?', ('x',)),
+    'player fighting styles': ('''
+        SELECT st.name, ps.owned FROM player_styles ps JOIN styles st ON st.id = ps.style_id
+        WHERE ps.player_id = ?
+    ''', (0,)),
+    'player items': ('''
+        SELECT i.name, i.item_type FROM player_inventory pi JOIN items i ON i.id = pi.item_id
+        WHERE pi.player_id = ?
+    ''', (0,)),
+    'player progress': ('''
+        SELECT event_type, old_value, new_value, timestamp FROM progress_log
+        WHERE player_name = ? AND timestamp >= ? ORDER BY timestamp DESC, id DESC LIMIT ?
+    ''', ('x', '2000-01-01', 100)),
+}
+
+def check_query_plans(conn):
+    """Chạy EXPLAIN QUERY PLAN cho QUERY_PLAN_CHECKS, trả về list (tên query, plan) bị full scan"""
+    problems = []
+    for name, (sql, params) in QUERY_PLAN_CHECKS.items():
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        # "SCAN <table>" không kèm "USING ... INDEX" nghĩa là đọc hết table
+        if any(step.startswith('SCAN') and 'INDEX' not in step for step in plan):
+            problems.append((name, plan))
+    return problems
 
 # Khởi tạo database khi start
 init_database()
 
-# In-memory storage for real-time data
-active_sessions = {}
-recent_updates = []
+class RecentUpdates:
+    """Ring buffer recent updates có sequence number, thread-safe, append O(1)"""
+
+    def __init__(self, maxlen):
+        self._items = deque(maxlen=maxlen)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._listeners = []
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    @property
+    def first_seq(self):
+        """seq của update cũ nhất còn giữ, buffer rỗng thì last_seq + 1"""
+        with self._cond:
+            return self._items[0]['seq'] if self._items else self._seq + 1
+
+    def append(self, update):
+        """Thêm update, trả về sequence number và đánh thức các SSE client đang chờ"""
+        with self._cond:
+            self._seq += 1
+            self._items.append(dict(update, seq=self._seq))
+            self._cond.notify_all()
+            seq = self._seq
+        for listener in self._listeners:
+            listener(seq)
+        return seq
+
+    def add_listener(self, callback):
+        """callback(seq) được gọi sau mỗi append (từ thread gọi append)"""
+        self._listeners.append(callback)
+
+    def latest(self, count):
+        """count updates mới nhất, cũ -> mới"""
+        with self._cond:
+            start = max(0, len(self._items) - count)
+            return list(itertools.islice(self._items, start, None))
+
+    def _since(self, seq):
+        if not self._items or seq >= self._seq:
+            return []
+        first_seq = self._items[0]['seq']
+        return list(itertools.islice(self._items, max(0, seq - first_seq + 1), None))
+
+    def since(self, seq):
+        """Các update có seq > seq (client resume); nếu seq quá cũ trả về hết những gì còn giữ"""
+        with self._cond:
+            return self._since(seq)
+
+    def wait_since(self, seq, timeout):
+        """Block tới khi có update mới hơn seq hoặc hết timeout"""
+        with self._cond:
+            # Chờ theo item trong buffer chứ không theo counter: sau clear() _seq vẫn giữ nguyên
+            self._cond.wait_for(lambda: self._items and self._items[-1]['seq'] > seq, timeout)
+            return self._since(seq)
+
+    def clear(self):
+        # Không reset sequence để client đang resume không bị lùi số
+        with self._cond:
+            self._items.clear()
+
+class MemoryLiveState:
+    """Live state trong process: active sessions dict + RecentUpdates ring buffer"""
+
+    # Update mới luôn đi qua append() của process này nên listener là đủ, không cần poll
+    poll_interval = None
+    # Chỉ thao tác dict/deque: gọi thẳng trên event loop được
+    blocking = False
+
+    def __init__(self, maxlen):
+        self.sessions = {}
+        self.updates = RecentUpdates(maxlen)
+        self.delta_bases = {}
+        self._epoch = 0
+
+    @property
+    def last_seq(self):
+        return self.updates.last_seq
+
+    @property
+    def first_seq(self):
+        return self.updates.first_seq
+
+    def record(self, data, current_time, update):
+        """Cập nhật active session của player và thêm update vào feed, trả về seq"""
+        self.sessions[data['player_name']] = {
+            'last_update': current_time,
+            'data': data
+        }
+        return self.updates.append(update)
+
+    def active_count(self):
+        return len(self.sessions)
+
+    def latest(self, count):
+        return self.updates.latest(count)
+
+    def since(self, seq):
+        return self.updates.since(seq)
+
+    def wait_since(self, seq, timeout):
+        return self.updates.wait_since(seq, timeout)
+
+    def add_listener(self, callback):
+        self.updates.add_listener(callback)
+
+    def delta_base(self, player_name):
+        """(seq, payload đầy đủ) cuối cùng của delta protocol, hoặc None"""
+        return self.delta_bases.get(player_name)
+
+    def set_delta_base(self, player_name, seq, payload):
+        self.delta_bases[player_name] = (seq, payload)
+
+    def epoch(self):
+        """Tăng mỗi lần clear, để worker khác biết phải bỏ cache"""
+        return self._epoch
+
+    def clear(self):
+        self.sessions.clear()
+        self.updates.clear()
+        self.delta_bases.clear()
+        self._epoch += 1
+
+class SqliteLiveState:
+    """Live state dùng chung giữa nhiều worker process, nằm trong SQLite file riêng
+
+    File riêng để write của live feed không tranh write lock với ingest writer của DB chính.
+    Không có cách push giữa process nên client chờ update phải poll last_seq.
+    """
+
+    poll_interval = LIVE_STATE_POLL_INTERVAL
+    # Mỗi call là SQLite I/O (có thể chờ busy_timeout): async mode phải gọi qua executor
+    blocking = True
+
+    def __init__(self, db_file, maxlen):
+        self.maxlen = maxlen
+        self.pool = ConnectionPool(db_file, size=4)
+        self._listeners = []
+        with self.pool.connection() as conn, conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS live_sessions (
+                    player_name TEXT PRIMARY KEY,
+                    last_update TEXT NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS live_updates (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS live_delta (
+                    player_name TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL,
+                    payload TEXT NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('CREATE TABLE IF NOT EXISTS live_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO live_meta (name, value) VALUES ('epoch', 0)")
+
+    @property
+    def last_seq(self):
+        with self.pool.connection() as conn:
+            # sqlite_sequence giữ seq cả khi live_updates vừa bị clear
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'live_updates'").fetchone()
+        return row[0] if row else 0
+
+    @property
+    def first_seq(self):
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT MIN(seq) FROM live_updates').fetchone()
+        return row[0] if row[0] is not None else self.last_seq + 1
+
+    def record(self, data, current_time, update):
+        """Cập nhật active session của player và thêm update vào feed, trả về seq"""
+        with self.pool.connection() as conn, conn:
+            conn.execute('''
+                INSERT INTO live_sessions (player_name, last_update) VALUES (?, ?)
+                ON CONFLICT(player_name) DO UPDATE SET last_update = excluded.last_update
+            ''', (data['player_name'], current_time.isoformat()))
+            seq = conn.execute('INSERT INTO live_updates (payload) VALUES (?)', (json.dumps(update),)).lastrowid
+            conn.execute('DELETE FROM live_updates WHERE seq <= ?', (seq - self.maxlen,))
+        for listener in self._listeners:
+            listener(seq)
+        return seq
+
+    def active_count(self):
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM live_sessions').fetchone()[0]
+
+    @staticmethod
+    def _rows_to_updates(rows):
+        return [dict(json.loads(payload), seq=seq) for seq, payload in rows]
+
+    def latest(self, count):
+        with self.pool.connection() as conn:
+            rows = conn.execute('SELECT seq, payload FROM live_updates ORDER BY seq DESC LIMIT ?', (count,)).fetchall()
+        return self._rows_to_updates(reversed(rows))
+
+    def since(self, seq):
+        with self.pool.connection() as conn:
+            rows = conn.execute('SELECT seq, payload FROM live_updates WHERE seq > ? ORDER BY seq', (seq,)).fetchall()
+        return self._rows_to_updates(rows)
+
+    def wait_since(self, seq, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            updates = self.since(seq)
+            if updates or time.monotonic() >= deadline:
+                return updates
+            time.sleep(self.poll_interval)
+
+    def add_listener(self, callback):
+        """Chỉ nhận update của process này; update từ worker khác phải poll last_seq"""
+        self._listeners.append(callback)
+
+    def delta_base(self, player_name):
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT seq, payload FROM live_delta WHERE player_name = ?', (player_name,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def set_delta_base(self, player_name, seq, payload):
+        with self.pool.connection() as conn, conn:
+            conn.execute('''
+                INSERT INTO live_delta (player_name, seq, payload) VALUES (?, ?, ?)
+                ON CONFLICT(player_name) DO UPDATE SET seq = excluded.seq, payload = excluded.payload
+            ''', (player_name, seq, json.dumps(payload)))
+
+    def epoch(self):
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT value FROM live_meta WHERE name = 'epoch'").fetchone()[0]
+
+    def clear(self):
+        with self.pool.connection() as conn, conn:
+            conn.execute('DELETE FROM live_sessions')
+            conn.execute('DELETE FROM live_updates')
+            conn.execute('DELETE FROM live_delta')
+            conn.execute("UPDATE live_meta SET value = value + 1 WHERE name = 'epoch'")
+
+def stream_start_seq(requested):
+    """seq bắt đầu một SSE stream từ Last-Event-ID / ?since=
+
+    Client không gửi seq, seq lớn hơn seq hiện tại (server restart, backend khác) hoặc đã
+    rớt khỏi buffer thì bắt đầu từ seq hiện tại, không chờ mãi hay replay một feed bị thủng.
+    """
+    current = live_state.last_seq
+    if requested is None or requested > current or requested < live_state.first_seq - 1:
+        return current
+    return requested
+
+LIVE_STATE_BACKENDS = {
+    'memory': lambda maxlen: MemoryLiveState(maxlen),
+    'sqlite': lambda maxlen: SqliteLiveState(LIVE_STATE_FILE, maxlen),
+}
+
+# Real-time data (active sessions + recent updates), dùng chung giữa workers nếu backend là sqlite
 max_recent_updates = 200
+live_state = LIVE_STATE_BACKENDS[LIVE_STATE_BACKEND](max_recent_updates)
+
+class Metrics:
+    """Counters + latency histograms trong process, render ra Prometheus text exposition format"""
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._meta = {}
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text):
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self, gauges=()):
+        """Text exposition; gauges: list (name, kind, help, value, labels dict) tính lúc scrape"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self._histograms.items())
+        lines = []
+        described = set()
+
+        def header(name, default_kind, help_text=''):
+            if name in described:
+                return
+            described.add(name)
+            kind, text = self._meta.get(name, (default_kind, help_text))
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        for name, kind, help_text, value, labels in gauges:
+            header(name, kind, help_text)
+            lines.append(f'{name}{self._labels(sorted(labels.items()))} {value}')
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f'{name}{self._labels(labels)} {value}')
+        for (name, labels), (bucket_counts, total, count) in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{self._labels(labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{self._labels(labels)} {total}')
+            lines.append(f'{name}_count{self._labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe('bf_http_requests_total', 'counter', 'HTTP requests theo route, method, status')
+metrics.describe('bf_http_request_duration_seconds', 'histogram',
+                 'Thời gian xử lý request theo route (streaming response: tới khi bắt đầu stream)')
+metrics.describe('bf_db_statement_duration_seconds', 'histogram',
+                 'Thời gian các nhóm statement: ingest (stats, latest, counters, rollups, styles, items...) '
+                 'và aggregates của dashboard')
+metrics.describe('bf_ingest_flush_duration_seconds', 'histogram', 'Thời gian một batch của ingest writer')
+
+class SamplingProfiler:
+    """Sample stack của mọi thread mỗi `interval` giây, đếm theo stack (collapsed, dùng được cho flamegraph)"""
+
+    OTHER = '<other>'
+
+    def __init__(self, interval=PROFILER_INTERVAL, max_depth=PROFILER_MAX_DEPTH, max_stacks=PROFILER_MAX_STACKS):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self.started_at = None
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        """Bật profiler (reset số liệu cũ)"""
+        with self._lock:
+            if self.running:
+                return
+            if interval:
+                self.interval = interval
+            self._stacks.clear()
+            self.samples = 0
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if self._thread is not None:
+                self._stop.set()
+                self._thread.join()
+                self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                stacks.append(';'.join(reversed(stack)))
+            del frames
+            self._record(stacks)
+
+    def _record(self, stacks):
+        """Đếm một lượt sample; quá max_stacks stack phân biệt thì stack mới vào OTHER"""
+        with self._lock:
+            for stack in stacks:
+                if stack not in self._stacks and len(self._stacks) >= self.max_stacks:
+                    stack = self.OTHER
+                self._stacks[stack] += 1
+            self.samples += 1
+
+    def top(self, limit=20, match=None):
+        """Các stack hay gặp nhất; match lọc stack có chứa chuỗi (vd. 'ingest_payload')"""
+        with self._lock:
+            stacks = [(stack, count) for stack, count in self._stacks.items() if not match or match in stack]
+        stacks.sort(key=lambda item: item[1], reverse=True)
+        return stacks[:limit]
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'interval_seconds': self.interval,
+            'samples': self.samples,
+            'distinct_stacks': len(self._stacks),
+            'started_at': self.started_at
+        }
+
+profiler = SamplingProfiler()
+if PROFILER_ENABLED:
+    profiler.start()
 
 # HTML Template cho Blox Fruits Dashboard
 HTML_TEMPLATE = """
@@ -422,19 +1550,19 @@ HTML_TEMPLATE = """
 
         <div class="stats-grid">
             <div class="stat-card">
-                <h3>{{ total_players }}</h3>
+                <h3 id="stat-total-players">{{ total_players }}</h3>
                 <p>👥 Tracked Players</p>
             </div>
             <div class="stat-card">
-                <h3>{{ total_updates }}</h3>
+                <h3 id="stat-total-updates">{{ total_updates }}</h3>
                 <p>📊 Total Updates</p>
             </div>
             <div class="stat-card">
-                <h3>{{ avg_level }}</h3>
+                <h3 id="stat-avg-level">{{ avg_level }}</h3>
                 <p>⭐ Average Level</p>
             </div>
             <div class="stat-card">
-                <h3>{{ active_now }}</h3>
+                <h3 id="stat-active-now">{{ active_now }}</h3>
                 <p>🎮 Active Now</p>
             </div>
         </div>
@@ -448,8 +1576,9 @@ HTML_TEMPLATE = """
 
         <div class="players-section">
             <h2>👑 Player Stats</h2>
+            <div id="active-players" data-cursor="{{ cursor }}" data-epoch="{{ epoch }}">
             {% for player in active_players %}
-            <div class="player-card">
+            <div class="player-card" data-player="{{ player.name }}" data-last-update="{{ player.last_update }}">
                 <div class="player-info">
                     <h4>🎮 {{ player.name }}</h4>
                     <p>🆔 ID: {{ player.user_id }}</p>
@@ -480,6 +1609,19 @@ HTML_TEMPLATE = """
                 </div>
             </div>
             {% endfor %}
+            </div>
+        </div>
+
+        <div class="players-section">
+            <h2>📡 Live Updates</h2>
+            <div id="updates-feed" class="updates-feed" data-last-seq="{{ last_seq }}">
+                {% for update in recent_updates|reverse %}
+                <div class="update-item">
+                    <span class="timestamp">{{ update.timestamp }}</span>
+                    🎮 {{ update.player_name }} - {{ update.message }}
+                </div>
+                {% endfor %}
+            </div>
         </div>
 
         <div class="players-section">
@@ -550,8 +1692,105 @@ HTML_TEMPLATE = """
         let refreshInterval;
         let currentAccountsLimit = 10;
 
+        // Incremental refresh: chỉ lấy counters + players thay đổi từ cursor, 304 khi không đổi
+        let summaryEtag = null;
+
+        function escapeHtml(value) {
+            const div = document.createElement('div');
+            div.textContent = value == null ? '' : String(value);
+            return div.innerHTML;
+        }
+
+        function formatNumber(value) {
+            return Number(value || 0).toLocaleString('en-US');
+        }
+
+        function renderPlayerCard(player) {
+            const card = document.createElement('div');
+            card.className = 'player-card';
+            card.dataset.player = player.name;
+            card.dataset.lastUpdate = player.last_update;
+            card.innerHTML = `
+                <div class="player-info">
+                    <h4>🎮 ${escapeHtml(player.name)}</h4>
+                    <p>🆔 ID: ${escapeHtml(player.user_id)}</p>
+                    <p>⏰ Last: ${escapeHtml(player.last_update)}</p>
+                </div>
+                
+                <div class="player-stats">
+                    <div class="stat-item">
+                        <strong>${escapeHtml(player.level)}</strong><br>Level
+                    </div>
+                    <div class="stat-item">
+                        <strong>${formatNumber(player.beli)}</strong><br>💰 Beli
+                    </div>
+                    <div class="stat-item">
+                        <strong>${formatNumber(player.fragments)}</strong><br>💎 Fragments
+                    </div>
+                </div>
+                
+                <div class="weapons-section">
+                    <div class="weapon-list">
+                        <strong>⚔️ Fighting Style:</strong><br>
+                        ${escapeHtml(player.fighting_style || 'Unknown')}
+                    </div>
+                    <div class="weapon-list">
+                        <strong>🍓 Devil Fruit:</strong><br>
+                        ${escapeHtml(player.equipped_fruit || 'None')}
+                    </div>
+                </div>
+            `;
+            return card;
+        }
+
+        function applySummary(data) {
+            const container = document.getElementById('active-players');
+            container.dataset.cursor = data.cursor;
+            container.dataset.epoch = data.epoch;
+            if (data.reset) {
+                // Data đã bị clear (epoch mới): cursor cũ vô nghĩa, dựng lại từ đầu
+                container.querySelectorAll('.player-card').forEach(card => card.remove());
+            }
+
+            document.getElementById('stat-total-players').textContent = data.counters.total_players;
+            document.getElementById('stat-total-updates').textContent = data.counters.total_updates;
+            document.getElementById('stat-avg-level').textContent = data.counters.avg_level;
+            document.getElementById('stat-active-now').textContent = data.counters.active_now;
+
+            // Players thay đổi (cũ -> mới): thay card cũ và đưa lên đầu
+            data.players.forEach(player => {
+                const existing = container.querySelector(`[data-player="${CSS.escape(player.name)}"]`);
+                if (existing) {
+                    existing.remove();
+                }
+                container.insertBefore(renderPlayerCard(player), container.firstChild);
+            });
+
+            // Bỏ các player đã ra khỏi cửa sổ 1 giờ
+            container.querySelectorAll('.player-card').forEach(card => {
+                if (card.dataset.lastUpdate <= data.active_cutoff) {
+                    card.remove();
+                }
+            });
+        }
+
         function refreshData() {
-            location.reload();
+            const { cursor, epoch } = document.getElementById('active-players').dataset;
+            const headers = summaryEtag ? { 'If-None-Match': summaryEtag } : {};
+            fetch(`/api/dashboard/summary?since=${cursor}&epoch=${epoch}`, { headers })
+                .then(response => {
+                    if (response.status === 304) {
+                        return null;
+                    }
+                    summaryEtag = response.headers.get('ETag');
+                    return response.json();
+                })
+                .then(data => {
+                    if (data) {
+                        applySummary(data);
+                    }
+                })
+                .catch(error => console.error('Error refreshing dashboard:', error));
         }
 
         function toggleAutoRefresh() {
@@ -589,8 +1828,31 @@ HTML_TEMPLATE = """
         // Recent Accounts Functions
         document.addEventListener('DOMContentLoaded', function() {
             loadRecentAccounts();
+            startLiveUpdates();
         });
 
+        // Live updates qua server-sent events (EventSource tự resume bằng Last-Event-ID)
+        const maxFeedItems = 50;
+
+        function startLiveUpdates() {
+            const feed = document.getElementById('updates-feed');
+            const source = new EventSource(`/api/stream?since=${feed.dataset.lastSeq}`);
+            source.addEventListener('update', event => {
+                const update = JSON.parse(event.data);
+                const item = document.createElement('div');
+                item.className = 'update-item';
+                const time = document.createElement('span');
+                time.className = 'timestamp';
+                time.textContent = update.timestamp;
+                item.appendChild(time);
+                item.appendChild(document.createTextNode(` 🎮 ${update.player_name} - ${update.message}`));
+                feed.insertBefore(item, feed.firstChild);
+                while (feed.children.length > maxFeedItems) {
+                    feed.removeChild(feed.lastChild);
+                }
+            });
+        }
+
         function loadRecentAccounts(limit = 10) {
             fetch(`/api/recent-accounts?limit=${limit}`)
                 .then(response => response.json())
@@ -710,16 +1972,103 @@ HTML_TEMPLATE = """
 </html>
 """
 
-def save_player_stats(data):
+class Interner:
+    """Cache in-process: giá trị dimension (player/fruit/style/item) -> integer id
+
+    Id tra/tạo trong một transaction chỉ vào cache chung sau khi transaction commit
+    (commit(conn)); rollback thì discard(conn), để không cache id của row đã bị hủy.
+    """
+
+    # table -> các cột tạo thành key
+    DIMENSIONS = {
+        'players': ('name',),
+        'fruits': ('name',),
+        'styles': ('name',),
+        'items': ('name', 'item_type'),
+    }
+
+    def __init__(self):
+        self._ids = {}
+        self._pending = {}  # id(conn) -> {(table, key): id} chưa commit
+        self._lock = threading.Lock()
+
+    def id_for(self, conn, table, *key):
+        """Id của key trong dimension table, tạo mới nếu chưa có; None -> NULL"""
+        if key[0] is None:
+            return None
+        with self._lock:
+            cached = self._ids.get((table, key))
+            if cached is None:
+                cached = self._pending.get(id(conn), {}).get((table, key))
+        if cached is not None:
+            return cached
+        columns = self.DIMENSIONS[table]
+        conn.execute(f'INSERT OR IGNORE INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in key)})',
+                     key)
+        row_id = conn.execute(f'SELECT id FROM {table} WHERE {" AND ".join(f"{c} IS ?" for c in columns)}',
+                              key).fetchone()[0]
+        with self._lock:
+            self._pending.setdefault(id(conn), {})[(table, key)] = row_id
+        return row_id
+
+    def commit(self, conn):
+        """Transaction trên conn đã commit: đưa các id của nó vào cache chung"""
+        with self._lock:
+            self._ids.update(self._pending.pop(id(conn), {}))
+
+    def discard(self, conn):
+        """Transaction (hoặc savepoint) trên conn bị rollback: bỏ các id chưa commit"""
+        with self._lock:
+            self._pending.pop(id(conn), None)
+
+    def clear(self):
+        """Xóa cả cache (sau /api/clear dimension tables đã rỗng)"""
+        with self._lock:
+            self._ids.clear()
+            self._pending.clear()
+
+interner = Interner()
+
+def save_player_stats(conn, data):
     """Lưu player stats vào database"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Insert player stats
-    cursor.execute('''
-        INSERT INTO player_stats 
-        (player_name, user_id, level, beli, fragments, bounty, honor, equipped_fruit, fighting_style, session_id)
+    conn.execute('''
+        INSERT INTO player_snapshots 
+        (player_id, user_id, level, beli, fragments, bounty, honor, fruit_id, style_id, session_id)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        interner.id_for(conn, 'players', data.get('player_name', '')),
+        data.get('user_id', 0),
+        data.get('level', 0),
+        data.get('beli', 0),
+        data.get('fragments', 0),
+        data.get('bounty', 0),
+        data.get('honor', 0),
+        interner.id_for(conn, 'fruits', data.get('equipped_fruit', '')),
+        interner.id_for(conn, 'styles', data.get('fighting_style', '')),
+        data.get('session_id', '')
+    ))
+
+def save_player_latest(conn, data):
+    """Upsert snapshot mới nhất của player vào player_latest"""
+    # change_seq = MAX + 1 (index, O(log n)); SQLite serialize writers nên luôn tăng dần
+    conn.execute('''
+        INSERT INTO player_latest
+        (player_name, user_id, level, beli, fragments, bounty, honor, equipped_fruit, fighting_style, session_id,
+         last_update, change_seq)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP,
+                (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM player_latest))
+        ON CONFLICT(player_name) DO UPDATE SET
+            user_id = excluded.user_id,
+            level = excluded.level,
+            beli = excluded.beli,
+            fragments = excluded.fragments,
+            bounty = excluded.bounty,
+            honor = excluded.honor,
+            equipped_fruit = excluded.equipped_fruit,
+            fighting_style = excluded.fighting_style,
+            session_id = excluded.session_id,
+            last_update = excluded.last_update,
+            change_seq = excluded.change_seq
     ''', (
         data.get('player_name', ''),
         data.get('user_id', 0),
@@ -732,137 +2081,791 @@ def save_player_stats(data):
         data.get('fighting_style', ''),
         data.get('session_id', '')
     ))
-    
-    conn.commit()
-    conn.close()
 
-def save_fighting_styles(player_name, user_id, styles_data):
+_last_window_prune = 0.0
+
+def update_counters(conn, data, skipped=False):
+    """Cập nhật running totals và level window trong cùng transaction với ingest
+
+    Gọi trước save_player_latest: player mới = chưa có row trong player_latest, kiểm tra ngay
+    trong write transaction nên hai worker không cùng đếm một player.
+    """
+    global _last_window_prune
+    conn.execute("UPDATE tracker_counters SET value = value + 1 WHERE name = 'total_updates'")
+    if skipped:
+        # Report trùng lặp: không có history row nhưng player vẫn đang online ở level này,
+        # vẫn tính vào level window để avg_level không lệch về phía player hay đổi stats
+        conn.execute("UPDATE tracker_counters SET value = value + 1 WHERE name = 'skipped_snapshots'")
+    else:
+        conn.execute('''
+            UPDATE tracker_counters SET value = value + 1
+            WHERE name = 'total_players' AND NOT EXISTS (SELECT 1 FROM player_latest WHERE player_name = ?)
+        ''', (data['player_name'],))
+    conn.execute('''
+        INSERT INTO level_window (minute, level_sum, samples)
+        VALUES (strftime('%Y-%m-%d %H:%M', 'now'), ?, 1)
+        ON CONFLICT(minute) DO UPDATE SET
+            level_sum = level_sum + excluded.level_sum,
+            samples = samples + 1
+    ''', (data.get('level', 0),))
+
+    # Bỏ các bucket ngoài cửa sổ, tối đa mỗi phút một lần
+    if time.monotonic() - _last_window_prune > 60:
+        _last_window_prune = time.monotonic()
+        conn.execute("DELETE FROM level_window WHERE minute <= strftime('%Y-%m-%d %H:%M', 'now', '-1 hour')")
+
+def _rollup_upsert_sql(resolution, fmt):
+    columns = ', '.join(f'{m}_min, {m}_max, {m}_last' for m in ROLLUP_METRICS)
+    placeholders = ', '.join('?, ?, ?' for _ in ROLLUP_METRICS)
+    updates = ',\n            '.join(
+        f'{m}_min = MIN({m}_min, excluded.{m}_min), {m}_max = MAX({m}_max, excluded.{m}_max), '
+        f'{m}_last = excluded.{m}_last' for m in ROLLUP_METRICS
+    )
+    return f'''
+        INSERT INTO rollup_{resolution} (player_name, bucket, {columns})
+        VALUES (?, strftime('{fmt}', 'now'), {placeholders})
+        ON CONFLICT(player_name, bucket) DO UPDATE SET
+            {updates}
+    '''
+
+ROLLUP_UPSERT_SQL = {resolution: _rollup_upsert_sql(resolution, fmt)
+                     for resolution, (fmt, _) in ROLLUP_RESOLUTIONS.items()}
+
+def update_rollups(conn, data):
+    """Cập nhật bucket hiện tại của mọi resolution cho player"""
+    values = [data['player_name']]
+    for metric in ROLLUP_METRICS:
+        value = data.get(metric, 0)
+        values += [value, value, value]
+    for sql in ROLLUP_UPSERT_SQL.values():
+        conn.execute(sql, values)
+
+def touch_player_latest(conn, player_name):
+    """Heartbeat cho report không đổi: chỉ bump last_update (+ change_seq cho dashboard)"""
+    conn.execute('''
+        UPDATE player_latest
+        SET last_update = CURRENT_TIMESTAMP,
+            change_seq = (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM player_latest)
+        WHERE player_name = ?
+    ''', (player_name,))
+
+def save_fighting_styles(conn, player_name, user_id, styles_data):
     """Lưu fighting styles data"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    for style in styles_data.get('owned', []):
-        cursor.execute('''
-            INSERT OR REPLACE INTO fighting_styles 
-            (player_name, user_id, style_name, owned)
-            VALUES (?, ?, ?, ?)
-        ''', (player_name, user_id, style, True))
-    
-    conn.commit()
-    conn.close()
+    player_id = interner.id_for(conn, 'players', player_name)
+    conn.executemany('''
+        INSERT INTO player_styles 
+        (player_id, user_id, style_id, owned, first_seen, last_seen)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        ON CONFLICT(player_id, style_id) DO UPDATE SET
+            user_id = excluded.user_id,
+            owned = excluded.owned,
+            last_seen = excluded.last_seen
+    ''', [(player_id, user_id, interner.id_for(conn, 'styles', style), True)
+          for style in styles_data.get('owned', [])])
+
+def log_progress_events(conn, player_name, user_id, events):
+    """Ghi events vào progress_log; events là list (event_type, old_value, new_value)"""
+    conn.executemany('''
+        INSERT INTO progress_log (player_name, user_id, event_type, old_value, new_value)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(player_name, user_id, event_type, old_value, new_value)
+          for event_type, old_value, new_value in events])
+
+def save_player_items(conn, player_name, user_id, items_data):
+    """Lưu weapons/items data: chỉ insert/delete phần thay đổi so với inventory đã lưu"""
+    player_id = interner.id_for(conn, 'players', player_name)
+    stored = set(conn.execute('''
+        SELECT i.name, i.item_type FROM player_inventory pi JOIN items i ON i.id = pi.item_id
+        WHERE pi.player_id = ?
+    ''', (player_id,)).fetchall())
+
+    # Swords + guns
+    current = {(sword, 'Sword') for sword in items_data.get('swords', [])}
+    current |= {(gun, 'Gun') for gun in items_data.get('guns', [])}
+
+    added = sorted(current - stored)
+    removed = sorted(stored - current)
+    if not added and not removed:
+        return
+
+    if removed:
+        conn.executemany(
+            'DELETE FROM player_inventory WHERE player_id = ? AND item_id = ?',
+            [(player_id, interner.id_for(conn, 'items', name, item_type)) for name, item_type in removed]
+        )
+    if added:
+        conn.executemany('''
+            INSERT INTO player_inventory (player_id, user_id, item_id)
+            VALUES (?, ?, ?)
+        ''', [(player_id, user_id, interner.id_for(conn, 'items', name, item_type)) for name, item_type in added])
+
+    log_progress_events(conn, player_name, user_id,
+                        [('new_weapon', None, name) for name, _ in added] +
+                        [('lost_weapon', name, None) for name, _ in removed])
+
+class PlayerStateCache:
+    """Cache in-memory trạng thái cuối của mỗi player, miss thì đọc từ DB
+
+    shared=True khi nhiều worker process cùng ghi DB: entry chỉ được dùng nếu change_seq
+    của player trong player_latest vẫn là seq do chính process này ghi.
+    """
+
+    def __init__(self, shared=False):
+        self.shared = shared
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def get(self, conn, player_name):
+        """Trạng thái cuối đã biết, hoặc None nếu player chưa từng report"""
+        with self._lock:
+            state = self._states.get(player_name)
+        if state is not None:
+            if not self.shared:
+                return state
+            row = conn.execute('SELECT change_seq FROM player_latest WHERE player_name = ?',
+                               (player_name,)).fetchone()
+            if row is not None and row[0] == state.get('change_seq'):
+                return state
+        row = conn.execute('''
+            SELECT level, beli, bounty, equipped_fruit, change_seq FROM player_latest WHERE player_name = ?
+        ''', (player_name,)).fetchone()
+        if row is None:
+            return None
+        styles = conn.execute(
+            'SELECT style_name FROM fighting_styles WHERE player_name = ? AND owned', (player_name,)
+        ).fetchall()
+        fruits = conn.execute(
+            "SELECT DISTINCT new_value FROM progress_log WHERE player_name = ? AND event_type = 'new_fruit'",
+            (player_name,)
+        ).fetchall()
+        state = {
+            'level': row[0],
+            'beli': row[1],
+            'beli_logged': row[1],
+            'bounty': row[2],
+            'equipped_fruit': row[3],
+            'styles': frozenset(style for (style,) in styles),
+            'fruits': frozenset(fruit for (fruit,) in fruits) | ({row[3]} if row[3] else frozenset()),
+            'change_seq': row[4]
+        }
+        self.put(player_name, state)
+        return state
+
+    def put(self, player_name, state):
+        with self._lock:
+            self._states[player_name] = state
+
+    def stamp(self, conn, player_name):
+        """shared mode: nhớ change_seq vừa ghi cho player để get() nhận ra write của worker khác"""
+        if not self.shared:
+            return
+        row = conn.execute('SELECT change_seq FROM player_latest WHERE player_name = ?', (player_name,)).fetchone()
+        with self._lock:
+            state = self._states.get(player_name)
+            if state is not None and row is not None:
+                state['change_seq'] = row[0]
+
+    def invalidate(self, player_names=None):
+        """Xóa cache của các player (hoặc tất cả) khi transaction bị rollback"""
+        with self._lock:
+            if player_names is None:
+                self._states.clear()
+            else:
+                for name in player_names:
+                    self._states.pop(name, None)
+
+player_state_cache = PlayerStateCache(shared=LIVE_STATE_BACKEND != 'memory')
+
+_seen_live_epoch = None
+
+def sync_live_epoch():
+    """Nếu một worker khác vừa /api/clear thì bỏ interner + state cache của process này"""
+    global _seen_live_epoch
+    epoch = live_state.epoch()
+    if epoch != _seen_live_epoch:
+        if _seen_live_epoch is not None:
+            interner.clear()
+            player_state_cache.invalidate()
+        _seen_live_epoch = epoch
+
+def detect_progress_events(previous, current):
+    """So sánh trạng thái cũ/mới, trả về list (event_type, old_value, new_value)"""
+    events = []
+    if current['level'] > previous['level']:
+        events.append(('level_up', previous['level'], current['level']))
+    if abs(current['beli'] - previous['beli_logged']) >= BELI_EVENT_THRESHOLD:
+        events.append(('beli_delta', previous['beli_logged'], current['beli']))
+    # new_fruit: chỉ fruit chưa từng thấy (equipped hoặc trong inventory), đổi qua lại giữa fruit cũ không tính
+    for fruit in sorted(current['fruits'] - previous['fruits']):
+        events.append(('new_fruit', previous['equipped_fruit'], fruit))
+    for style in sorted(current['styles'] - previous['styles']):
+        events.append(('style_unlocked', None, style))
+    if current['bounty'] != previous['bounty']:
+        events.append(('bounty_change', previous['bounty'], current['bounty']))
+    return events
+
+def snapshot_fingerprint(data):
+    """Các field quyết định report có khác report trước hay không (bỏ qua timestamp/server_info)"""
+    styles = data.get('fighting_styles')
+    items = data.get('items')
+    return (
+        data.get('user_id', 0), data.get('level', 0), data.get('beli', 0), data.get('fragments', 0),
+        data.get('bounty', 0), data.get('honor', 0), data.get('equipped_fruit', ''),
+        data.get('fighting_style', ''), data.get('session_id', ''),
+        frozenset(styles.get('owned', [])) if styles is not None else None,
+        frozenset(items.get('swords', [])) if items is not None else None,
+        frozenset(items.get('guns', [])) if items is not None else None,
+        frozenset(items.get('fruits', [])) if items is not None else None,
+    )
+
+def resolve_unchanged_styles(data, previous):
+    """fighting_styles = {"unchanged": true} (Lua sender không thấy style mới) -> owned styles đã biết
+
+    Player chưa có trạng thái nào thì coi như payload không có styles section.
+    """
+    styles = data.get('fighting_styles')
+    if not styles or not styles.get('unchanged'):
+        return data
+    if previous is None:
+        return {key: value for key, value in data.items() if key != 'fighting_styles'}
+    return dict(data, fighting_styles={'owned': sorted(previous['styles'])})
+
+def ingest_payload(conn, data):
+    """Ghi một payload (stats + styles + items + progress events) trên connection có sẵn, không commit"""
+    player_name = data['player_name']
+    user_id = data.get('user_id', 0)
+    previous = player_state_cache.get(conn, player_name)
+    data = resolve_unchanged_styles(data, previous)
+
+    # Report giống hệt report trước (và chưa tới hạn keyframe): chỉ bump heartbeat
+    fingerprint = snapshot_fingerprint(data)
+    if (SNAPSHOT_DEDUP and previous is not None and previous.get('fingerprint') == fingerprint
+            and (SNAPSHOT_MAX_GAP <= 0 or time.monotonic() - previous['written_at'] < SNAPSHOT_MAX_GAP)):
+        with metrics.timer('bf_db_statement_duration_seconds', group='heartbeat'):
+            touch_player_latest(conn, player_name)
+            update_counters(conn, data, skipped=True)
+            player_state_cache.stamp(conn, player_name)
+        return
+
+    with metrics.timer('bf_db_statement_duration_seconds', group='stats_insert'):
+        save_player_stats(conn, data)
+    with metrics.timer('bf_db_statement_duration_seconds', group='counters'):
+        update_counters(conn, data)
+    with metrics.timer('bf_db_statement_duration_seconds', group='latest_upsert'):
+        save_player_latest(conn, data)
+    with metrics.timer('bf_db_statement_duration_seconds', group='rollups'):
+        update_rollups(conn, data)
+
+    # Save fighting styles if provided
+    if 'fighting_styles' in data:
+        with metrics.timer('bf_db_statement_duration_seconds', group='styles'):
+            save_fighting_styles(conn, player_name, user_id, data['fighting_styles'])
+
+    # Save items if provided (kèm new_weapon/lost_weapon events)
+    if 'items' in data:
+        with metrics.timer('bf_db_statement_duration_seconds', group='items'):
+            save_player_items(conn, player_name, user_id, data['items'])
+
+    # Change detection so với trạng thái cuối đã biết (owned styles và fruits đã thấy chỉ tăng)
+    styles = frozenset(data.get('fighting_styles', {}).get('owned', []))
+    fruits = frozenset(data.get('items', {}).get('fruits', []))
+    if data.get('equipped_fruit'):
+        fruits |= {data['equipped_fruit']}
+    if previous is not None:
+        styles |= previous['styles']
+        fruits |= previous['fruits']
+    current = {
+        'level': data.get('level', 0),
+        'beli': data.get('beli', 0),
+        'beli_logged': data.get('beli', 0),
+        'bounty': data.get('bounty', 0),
+        'equipped_fruit': data.get('equipped_fruit', ''),
+        'styles': styles,
+        'fruits': fruits,
+        'fingerprint': fingerprint,
+        'written_at': time.monotonic()
+    }
+    if previous is not None:
+        events = detect_progress_events(previous, current)
+        if not any(event[0] == 'beli_delta' for event in events):
+            current['beli_logged'] = previous['beli_logged']
+        with metrics.timer('bf_db_statement_duration_seconds', group='progress_log'):
+            log_progress_events(conn, player_name, user_id, events)
+    elif fruits:
+        # Giống new_weapon: report đầu tiên log các fruit đang có, progress_log là nơi nhớ fruit đã thấy
+        log_progress_events(conn, player_name, user_id, [('new_fruit', None, fruit) for fruit in sorted(fruits)])
+    player_state_cache.put(player_name, current)
+    player_state_cache.stamp(conn, player_name)
+
+def ingest_batch(payloads):
+    """Ghi nhiều payload trong một transaction, mỗi payload có savepoint riêng
+
+    Trả về list kết quả theo thứ tự: None nếu ok, hoặc error message.
+    Payload lỗi chỉ rollback phần của nó, các payload khác vẫn được commit.
+    """
+    results = []
+    sync_live_epoch()
+    with db_pool.connection() as conn:
+        # Lấy write lock ngay từ đầu: mọi read trong batch (state cache miss, player mới hay không)
+        # thấy data của worker khác đã commit, không bị SQLITE_BUSY_SNAPSHOT khi upgrade lên write
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for data in payloads:
+                conn.execute('SAVEPOINT ingest_item')
+                try:
+                    ingest_payload(conn, data)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO ingest_item')
+                    player_state_cache.invalidate([data.get('player_name')])
+                    # Có thể bỏ cả id hợp lệ của item trước, chỉ tốn một lần tra lại
+                    interner.discard(conn)
+                    results.append(str(e))
+                else:
+                    results.append(None)
+                conn.execute('RELEASE ingest_item')
+            with metrics.timer('bf_db_statement_duration_seconds', group='commit'):
+                conn.commit()
+            interner.commit(conn)
+        except Exception:
+            conn.rollback()
+            player_state_cache.invalidate([data.get('player_name') for data in payloads])
+            interner.discard(conn)
+            raise
+    return results
+
+def is_string_list(value):
+    # String cũng iterable: phải check list trước, nếu không "Katana" thành 6 item một ký tự
+    return isinstance(value, list) and all(isinstance(x, str) for x in value)
+
+def validate_payload(data):
+    """Kiểm tra schema payload từ Lua sender, trả về error message hoặc None"""
+    if not isinstance(data, dict) or not data.get('player_name'):
+        return 'Invalid data'
+    if not isinstance(data['player_name'], str):
+        return 'player_name must be a string'
+    for field in ('user_id', 'level', 'beli', 'fragments', 'bounty', 'honor'):
+        # Thiếu field thì mặc định 0, còn null thì reject: ghi xuống sẽ vi phạm NOT NULL / format số
+        value = data.get(field, 0)
+        if value is None or isinstance(value, bool) or not isinstance(value, (int, float)):
+            return f'{field} must be a number'
+    styles = data.get('fighting_styles')
+    if styles is not None:
+        if not isinstance(styles, dict) or not is_string_list(styles.get('owned', [])):
+            return 'fighting_styles.owned must be a list of strings'
+        if not isinstance(styles.get('unchanged', False), bool):
+            return 'fighting_styles.unchanged must be a boolean'
+    items = data.get('items')
+    if items is not None:
+        if not isinstance(items, dict):
+            return 'items must be an object'
+        for kind in ('swords', 'guns', 'fruits'):
+            if not is_string_list(items.get(kind, [])):
+                return f'items.{kind} must be a list of strings'
+    return None
+
+class IngestQueue:
+    """Bounded write-behind queue: request thread enqueue, writer thread ghi theo batch"""
+
+    def __init__(self, maxsize=INGEST_QUEUE_SIZE, flush_size=INGEST_FLUSH_SIZE,
+                 flush_interval=INGEST_FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        self.flushed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.retried = 0
+        self.batches = 0
+        self.last_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def start(self):
+        """Khởi động writer thread (idempotent)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, data):
+        """Đưa payload vào queue; False nếu queue đầy (backpressure)"""
+        return self.submit_many([data])
+
+    def submit_many(self, items):
+        """Đưa cả list payload vào queue, hoặc không item nào nếu không đủ chỗ (False)"""
+        # Mọi submit đi qua lock, trong lúc giữ lock chỉ writer lấy item ra (chỗ trống chỉ tăng): put không bị Full
+        with self._submit_lock:
+            free = self._queue.maxsize - self._queue.qsize()
+            if self._queue.maxsize > 0 and free < len(items):
+                with self._lock:
+                    self.rejected += len(items)
+                return False
+            for data in items:
+                self._queue.put_nowait(data)
+        return True
+
+    def join(self, timeout=None):
+        """Chờ tới khi mọi payload đã enqueue được ghi xuống DB; False nếu hết timeout"""
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(
+                lambda: not self._queue.unfinished_tasks, timeout)
+
+    def stop(self, timeout=30):
+        """Graceful shutdown: flush hết queue rồi dừng writer"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _collect(self):
+        """Lấy tối đa flush_size payloads, chờ không quá flush_interval"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0 and not self._stop.is_set():
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+
+    def _write(self, batch):
+        """ingest_batch, ghi lại cả batch khi SQLite báo busy/locked thay vì bỏ nó"""
+        for attempt in range(INGEST_WRITE_RETRIES + 1):
+            try:
+                return ingest_batch(batch)
+            except sqlite3.OperationalError as e:
+                if attempt == INGEST_WRITE_RETRIES:
+                    return [str(e)] * len(batch)
+                with self._lock:
+                    self.retried += 1
+                log_event('warning', 'ingest_write_retry', f"⚠️ Batch write failed, retrying: {e}",
+                          error=str(e), attempt=attempt + 1, batch_size=len(batch))
+                time.sleep(INGEST_RETRY_BACKOFF * 2 ** attempt)
+            except Exception as e:
+                return [str(e)] * len(batch)
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        results = self._write(batch)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        metrics.observe('bf_ingest_flush_duration_seconds', elapsed_ms / 1000)
+
+        errors = [(data, error) for data, error in zip(batch, results) if error]
+        for data, error in errors:
+            log_event('error', 'ingest_write_failed', f"❌ Error writing stats for {data.get('player_name')}: {error}",
+                      player=data.get('player_name'), error=error)
+
+        with self._lock:
+            self.batches += 1
+            self.flushed += len(batch) - len(errors)
+            self.failed += len(errors)
+            self.last_flush_ms = elapsed_ms
+            self.total_flush_ms += elapsed_ms
+        for _ in batch:
+            self._queue.task_done()
+
+    def stats(self):
+        """Số liệu cho /api/ping"""
+        with self._lock:
+            return {
+                'depth': self._queue.qsize(),
+                'capacity': self._queue.maxsize,
+                'flushed': self.flushed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'retried': self.retried,
+                'batches': self.batches,
+                'last_flush_ms': round(self.last_flush_ms, 2),
+                'avg_flush_ms': round(self.total_flush_ms / self.batches, 2) if self.batches else 0.0
+            }
 
-def save_player_items(player_name, user_id, items_data):
-    """Lưu weapons/items data"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Clear old items for this player
-    cursor.execute('DELETE FROM player_items WHERE player_name = ?', (player_name,))
-    
-    # Insert swords
-    for sword in items_data.get('swords', []):
-        cursor.execute('''
-            INSERT INTO player_items (player_name, user_id, item_name, item_type)
-            VALUES (?, ?, ?, ?)
-        ''', (player_name, user_id, sword, 'Sword'))
-    
-    # Insert guns
-    for gun in items_data.get('guns', []):
+ingest_queue = IngestQueue()
+ingest_queue.start()
+
+def shutdown():
+    """atexit: dừng theo thứ tự cố định, log listener luôn dừng cuối để log của bước trước vẫn được ghi"""
+    ingest_queue.stop()
+    log_listener.stop()
+
+atexit.register(shutdown)
+
+def db_size_bytes(conn):
+    """Kích thước database (page_count * page_size) và số bytes đang nằm trong freelist"""
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return page_count * page_size, freelist * page_size
+
+class RetentionCompactor:
+    """Background job: xóa raw snapshots/minute rollups quá hạn theo batch nhỏ + incremental vacuum"""
+
+    def __init__(self, interval=COMPACT_INTERVAL, batch_rows=COMPACT_BATCH_ROWS):
+        self.interval = interval
+        self.batch_rows = batch_rows
+        self._wake = threading.Event()
+        self._run_lock = threading.Lock()
+        self._thread = None
+        self.runs = 0
+        self.total_rows_pruned = 0
+        self.total_bytes_reclaimed = 0
+        self.last_run = None
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='retention-compactor', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                log_event('error', 'retention_failed', f"❌ Retention compaction failed: {str(e)}", error=str(e))
+
+    def _delete_batches(self, sql, params, counter=None):
+        """Chạy DELETE ... LIMIT batch trong nhiều transaction ngắn, trả về tổng rows đã xóa"""
+        deleted = 0
+        while True:
+            with db_pool.connection() as conn:
+                with conn:
+                    count = conn.execute(sql, (*params, self.batch_rows)).rowcount
+                    if counter and count:
+                        conn.execute('UPDATE tracker_counters SET value = value + ? WHERE name = ?', (count, counter))
+            deleted += count
+            if count < self.batch_rows:
+                return deleted
+            # Nhường write lock cho ingest writer giữa các batch
+            time.sleep(0.01)
+
+    def run_once(self):
+        """Một lượt retention + vacuum, trả về kết quả cho admin endpoint"""
+        with self._run_lock:
+            started = time.perf_counter()
+            raw_cutoff = (datetime.utcnow() - timedelta(days=RAW_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+            minute_cutoff = (datetime.utcnow() - timedelta(days=MINUTE_ROLLUP_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M')
+
+            with db_pool.connection() as conn:
+                size_before, _ = db_size_bytes(conn)
+
+            raw_pruned = self._delete_batches('''
+                DELETE FROM player_snapshots WHERE id IN (
+                    SELECT id FROM player_snapshots WHERE timestamp < ? LIMIT ?
+                )
+            ''', (raw_cutoff,), counter='pruned_snapshots')
+            rollups_pruned = self._delete_batches('''
+                DELETE FROM rollup_minute WHERE (player_name, bucket) IN (
+                    SELECT player_name, bucket FROM rollup_minute WHERE bucket < ? LIMIT ?
+                )
+            ''', (minute_cutoff,))
+
+            # Trả freelist pages về OS (chỉ khi auto_vacuum = INCREMENTAL)
+            with db_pool.connection() as conn:
+                auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+                if auto_vacuum == 2:
+                    # executescript step tới SQLITE_DONE; execute() chỉ step một lần = một page
+                    conn.executescript(f'PRAGMA incremental_vacuum({COMPACT_VACUUM_PAGES});')
+                size_after, free_bytes = db_size_bytes(conn)
+
+            result = {
+                'time': datetime.now().isoformat(),
+                'raw_cutoff': raw_cutoff,
+                'raw_rows_pruned': raw_pruned,
+                'minute_rollups_pruned': rollups_pruned,
+                'bytes_reclaimed': max(0, size_before - size_after),
+                'db_bytes': size_after,
+                'freelist_bytes': free_bytes,
+                'incremental_vacuum': auto_vacuum == 2,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+            }
+            self.runs += 1
+            self.total_rows_pruned += raw_pruned + rollups_pruned
+            self.total_bytes_reclaimed += result['bytes_reclaimed']
+            self.last_run = result
+            if raw_pruned or rollups_pruned:
+                log_event('info', 'retention',
+                          f"🧹 Retention: pruned {raw_pruned:,} snapshots, {rollups_pruned:,} minute rollups, "
+                          f"reclaimed {result['bytes_reclaimed']:,} bytes",
+                          raw_rows_pruned=raw_pruned, minute_rollups_pruned=rollups_pruned,
+                          bytes_reclaimed=result['bytes_reclaimed'])
+            return result
+
+    def stats(self):
+        return {
+            'raw_retention_days': RAW_RETENTION_DAYS,
+            'minute_rollup_retention_days': MINUTE_ROLLUP_RETENTION_DAYS,
+            'interval_seconds': self.interval,
+            'batch_rows': self.batch_rows,
+            'runs': self.runs,
+            'total_rows_pruned': self.total_rows_pruned,
+            'total_bytes_reclaimed': self.total_bytes_reclaimed,
+            'last_run': self.last_run
+        }
+
+retention_compactor = RetentionCompactor()
+retention_compactor.start()
+
+LATEST_COLUMNS = '''player_name, user_id, level, beli, fragments,
+               fighting_style, equipped_fruit, last_update'''
+
+def latest_row_to_dict(row):
+    """Chuyển row player_latest (LATEST_COLUMNS) thành dict cho template/API"""
+    return {
+        'name': row[0],
+        'user_id': row[1],
+        'level': row[2],
+        'beli': row[3],
+        'fragments': row[4],
+        'fighting_style': row[5],
+        'equipped_fruit': row[6],
+        'last_update': row[7]
+    }
+
+def active_cutoff():
+    """Mốc 1 giờ trước theo UTC (timestamps trong DB là CURRENT_TIMESTAMP)"""
+    return (datetime.utcnow() - timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+
+def read_counters(cursor):
+    """Running totals (total_players, total_updates) và avg level 1 giờ từ level_window"""
+    with metrics.timer('bf_db_statement_duration_seconds', group='aggregates'):
+        cursor.execute('SELECT name, value FROM tracker_counters')
+        counters = dict(cursor.fetchall())
         cursor.execute('''
-            INSERT INTO player_items (player_name, user_id, item_name, item_type)
-            VALUES (?, ?, ?, ?)
-        ''', (player_name, user_id, gun, 'Gun'))
-    
-    conn.commit()
-    conn.close()
+            SELECT SUM(level_sum), SUM(samples) FROM level_window
+            WHERE minute > strftime('%Y-%m-%d %H:%M', 'now', '-1 hour')
+        ''')
+        level_sum, samples = cursor.fetchone()
+    return {
+        'total_players': counters.get('total_players', 0),
+        'total_updates': counters.get('total_updates', 0),
+        'avg_level': int(level_sum / samples) if samples else 0
+    }
+
+def dashboard_counters(cursor, one_hour_ago):
+    """Headline counters của dashboard"""
+    counters = read_counters(cursor)
+
+    with metrics.timer('bf_db_statement_duration_seconds', group='aggregates'):
+        cursor.execute('SELECT COUNT(*) FROM player_latest WHERE last_update > ?', (one_hour_ago,))
+        active_now = cursor.fetchone()[0]
+
+    return dict(counters, active_now=active_now)
+
+def current_change_seq(cursor):
+    with metrics.timer('bf_db_statement_duration_seconds', group='aggregates'):
+        cursor.execute('SELECT COALESCE(MAX(change_seq), 0) FROM player_latest')
+        return cursor.fetchone()[0]
 
 @app.route('/')
 def dashboard():
     """Main dashboard"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Get active players (last 1 hour)
-    one_hour_ago = datetime.now() - timedelta(hours=1)
-    cursor.execute('''
-        SELECT DISTINCT player_name, user_id, level, beli, fragments, 
-               fighting_style, equipped_fruit, MAX(timestamp) as last_update
-        FROM player_stats 
-        WHERE timestamp > ?
-        GROUP BY player_name
-        ORDER BY last_update DESC
-    ''', (one_hour_ago,))
-    
-    active_players = []
-    for row in cursor.fetchall():
-        active_players.append({
-            'name': row[0],
-            'user_id': row[1],
-            'level': row[2],
-            'beli': row[3],
-            'fragments': row[4],
-            'fighting_style': row[5],
-            'equipped_fruit': row[6],
-            'last_update': row[7]
-        })
-    
-    # Get stats
-    cursor.execute('SELECT COUNT(DISTINCT player_name) FROM player_stats')
-    total_players = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM player_stats')
-    total_updates = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT AVG(level) FROM player_stats WHERE timestamp > ?', (one_hour_ago,))
-    avg_level = int(cursor.fetchone()[0] or 0)
-    
-    conn.close()
-    
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+
+        # Get active players (last 1 hour)
+        one_hour_ago = active_cutoff()
+        cursor.execute(f'''
+            SELECT {LATEST_COLUMNS}
+            FROM player_latest
+            WHERE last_update > ?
+            ORDER BY last_update DESC
+        ''', (one_hour_ago,))
+        active_players = [latest_row_to_dict(row) for row in cursor.fetchall()]
+
+        # Get stats
+        counters = dashboard_counters(cursor, one_hour_ago)
+        change_seq = current_change_seq(cursor)
+
     return render_template_string(HTML_TEMPLATE,
-                                total_players=total_players,
-                                total_updates=total_updates,
-                                avg_level=avg_level,
-                                active_now=len(active_players),
                                 active_players=active_players,
-                                recent_updates=recent_updates[-20:])
+                                cursor=change_seq,
+                                epoch=live_state.epoch(),
+                                recent_updates=live_state.latest(20),
+                                last_seq=live_state.last_seq,
+                                **counters)
+
+@app.route('/api/dashboard/summary')
+def dashboard_summary():
+    """Delta API cho dashboard: counters + các player thay đổi sau cursor, 304 nếu không đổi
+
+    change_seq bắt đầu lại từ 0 sau /api/clear: client gửi kèm epoch nó đang giữ, lệch
+    epoch thì trả full list với reset=true để client bỏ hết card và cursor cũ.
+    """
+    since = request.args.get('since', 0, type=int)
+    epoch = live_state.epoch()
+    client_epoch = request.args.get('epoch', type=int)
+    reset = client_epoch is not None and client_epoch != epoch
+    if reset:
+        since = 0
+
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+
+        # ETag rẻ: epoch + change_seq hiện tại + bucket 30s (để active window trượt theo thời gian)
+        change_seq = current_change_seq(cursor)
+        etag = f'{epoch}-{change_seq}-{int(time.time()) // 30}'
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={'ETag': f'"{etag}"'})
+
+        one_hour_ago = active_cutoff()
+        cursor.execute(f'''
+            SELECT {LATEST_COLUMNS}
+            FROM player_latest
+            WHERE change_seq > ? AND last_update > ?
+            ORDER BY change_seq
+        ''', (since, one_hour_ago))
+        players = [latest_row_to_dict(row) for row in cursor.fetchall()]
+        counters = dashboard_counters(cursor, one_hour_ago)
+
+    response = jsonify({
+        'cursor': change_seq,
+        'epoch': epoch,
+        'reset': reset,
+        'active_cutoff': one_hour_ago,
+        'counters': counters,
+        'players': players
+    })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/recent-accounts')
 def get_recent_accounts():
     """API để lấy recent accounts với pagination"""
     limit = request.args.get('limit', 10, type=int)
-    
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Get recent accounts với thêm thông tin
-    cursor.execute('''
-        SELECT DISTINCT player_name, user_id, level, beli, fragments, 
-               fighting_style, equipped_fruit, MAX(timestamp) as last_update
-        FROM player_stats 
-        GROUP BY player_name
-        ORDER BY last_update DESC
-        LIMIT ?
-    ''', (limit,))
-    
-    accounts = []
-    for row in cursor.fetchall():
-        accounts.append({
-            'name': row[0],
-            'user_id': row[1], 
-            'level': row[2],
-            'beli': row[3],
-            'fragments': row[4],
-            'fighting_style': row[5],
-            'equipped_fruit': row[6],
-            'last_update': row[7]
-        })
-    
-    # Get total count
-    cursor.execute('SELECT COUNT(DISTINCT player_name) FROM player_stats')
-    total_count = cursor.fetchone()[0]
-    
-    conn.close()
-    
+
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+
+        # Get recent accounts với thêm thông tin
+        cursor.execute(f'''
+            SELECT {LATEST_COLUMNS}
+            FROM player_latest
+            ORDER BY last_update DESC
+            LIMIT ?
+        ''', (limit,))
+        accounts = [latest_row_to_dict(row) for row in cursor.fetchall()]
+
+        # Get total count
+        total_count = read_counters(cursor)['total_players']
+
     return jsonify({
         'accounts': accounts,
         'total_count': total_count,
@@ -872,40 +2875,42 @@ def get_recent_accounts():
 @app.route('/api/account-details/<player_name>')
 def get_account_details(player_name):
     """API để lấy chi tiết account bao gồm items"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Get account basic info
-    cursor.execute('''
-        SELECT player_name, user_id, level, beli, fragments, 
-               fighting_style, equipped_fruit, bounty, honor, timestamp
-        FROM player_stats 
-        WHERE player_name = ?
-        ORDER BY timestamp DESC
-        LIMIT 1
-    ''', (player_name,))
-    
-    account_data = cursor.fetchone()
-    if not account_data:
-        conn.close()
-        return jsonify({'error': 'Account not found'}), 404
-    
-    # Get fighting styles
-    cursor.execute('''
-        SELECT style_name, owned FROM fighting_styles 
-        WHERE player_name = ?
-    ''', (player_name,))
-    fighting_styles = [{'name': row[0], 'owned': bool(row[1])} for row in cursor.fetchall()]
-    
-    # Get weapons/items
-    cursor.execute('''
-        SELECT item_name, item_type FROM player_items 
-        WHERE player_name = ?
-    ''', (player_name,))
-    items = [{'name': row[0], 'type': row[1]} for row in cursor.fetchall()]
-    
-    conn.close()
-    
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+
+        # Get account basic info
+        cursor.execute('''
+            SELECT player_name, user_id, level, beli, fragments, 
+                   fighting_style, equipped_fruit, bounty, honor, last_update
+            FROM player_latest 
+            WHERE player_name = ?
+        ''', (player_name,))
+
+        account_data = cursor.fetchone()
+        if not account_data:
+            return jsonify({'error': 'Account not found'}), 404
+
+        # Styles/items join theo integer player_id
+        player_id = cursor.execute('SELECT id FROM players WHERE name = ?', (player_name,)).fetchone()
+        player_id = player_id[0] if player_id else None
+
+        # Get fighting styles
+        cursor.execute('''
+            SELECT st.name, ps.owned, ps.first_seen, ps.last_seen FROM player_styles ps
+            JOIN styles st ON st.id = ps.style_id
+            WHERE ps.player_id = ?
+        ''', (player_id,))
+        fighting_styles = [{'name': row[0], 'owned': bool(row[1]), 'first_seen': row[2], 'last_seen': row[3]}
+                           for row in cursor.fetchall()]
+
+        # Get weapons/items
+        cursor.execute('''
+            SELECT i.name, i.item_type FROM player_inventory pi
+            JOIN items i ON i.id = pi.item_id
+            WHERE pi.player_id = ?
+        ''', (player_id,))
+        items = [{'name': row[0], 'type': row[1]} for row in cursor.fetchall()]
+
     return jsonify({
         'name': account_data[0],
         'user_id': account_data[1],
@@ -921,134 +2926,1130 @@ def get_account_details(player_name):
         'items': items
     })
 
+def record_live_update(data, current_time):
+    """Cập nhật active sessions, recent updates và log ingest event cho một payload"""
+    update_msg = f"Level {data.get('level', 0)} - {data.get('beli', 0):,} Beli"
+    live_state.record(data, current_time, {
+        'timestamp': current_time.strftime("%H:%M:%S"),
+        'player_name': data['player_name'],
+        'message': update_msg
+    })
+
+    # Format (emoji / JSON) làm ở log listener thread, request thread chỉ enqueue
+    log_event('info', 'ingest', sampled=True,
+              player=data['player_name'], user_id=data.get('user_id', 'Unknown'),
+              player_level=data.get('level', 0), beli=data.get('beli', 0), fragments=data.get('fragments', 0),
+              fighting_style=data.get('fighting_style', 'None'))
+
+class ResyncRequired(Exception):
+    """Delta không áp dụng được (server không có base hoặc thiếu seq): client phải gửi keyframe"""
+
+    def __init__(self, expected_seq):
+        super().__init__('Sequence gap, send a keyframe')
+        self.expected_seq = expected_seq
+
+# Field điều khiển của delta protocol, không phải dữ liệu player
+DELTA_CONTROL_FIELDS = ('proto', 'kind', 'seq', 'unset')
+
+_delta_lock = threading.Lock()
+
+def merge_delta(base, fields, unset):
+    """Áp các field thay đổi lên payload base; items merge theo từng loại (swords/guns/fruits)"""
+    payload = dict(base)
+    for key, value in fields.items():
+        if key == 'items' and isinstance(value, dict) and isinstance(base.get('items'), dict):
+            payload['items'] = dict(base['items'], **value)
+        else:
+            payload[key] = value
+    for key in unset:
+        payload.pop(key, None)
+    return payload
+
+def apply_delta_message(data, pending=None):
+    """Delta protocol v1: keyframe thành base mới, delta (seq = base + 1) merge vào base
+
+    Message không có 'proto' (sender cũ) trả về nguyên vẹn. Trả về (payload đầy đủ, seq, candidate);
+    payload None nghĩa là delta gửi lại (seq đã áp dụng rồi). candidate là base mới, caller chỉ
+    commit_delta_base() sau khi payload đã vào ingest queue: bị 429 / lỗi ghi thì client gửi lại
+    đúng seq đó và vẫn được áp dụng. pending: base chưa commit của các item trước trong cùng batch.
+    Raise ValueError khi message sai format, ResyncRequired khi thiếu base hoặc có sequence gap.
+    """
+    if not isinstance(data, dict) or 'proto' not in data:
+        return data, None, None
+    if data['proto'] != DELTA_PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported delta protocol version {data['proto']!r}")
+    seq = data.get('seq')
+    kind = data.get('kind')
+    unset = data.get('unset', [])
+    if isinstance(seq, bool) or not isinstance(seq, int):
+        raise ValueError('seq must be an integer')
+    if kind not in ('keyframe', 'delta'):
+        raise ValueError("kind must be 'keyframe' or 'delta'")
+    if not isinstance(unset, list) or not all(isinstance(key, str) and key != 'player_name' for key in unset):
+        raise ValueError('unset must be a list of field names')
+    if not isinstance(data.get('player_name'), str) or not data['player_name']:
+        raise ValueError('Invalid data')
+
+    player_name = data['player_name']
+    fields = {key: value for key, value in data.items() if key not in DELTA_CONTROL_FIELDS}
+    if kind == 'keyframe':
+        payload = fields
+    else:
+        base = (pending or {}).get(player_name) or live_state.delta_base(player_name)
+        if base is None:
+            raise ResyncRequired(None)
+        base_seq, base_payload = base
+        if seq <= base_seq:
+            return None, seq, None
+        if seq != base_seq + 1:
+            raise ResyncRequired(base_seq + 1)
+        payload = merge_delta(base_payload, fields, unset)
+    error = validate_payload(payload)
+    if error:
+        raise ValueError(error)
+    return payload, seq, (player_name, seq, payload, kind == 'keyframe')
+
+def commit_delta_base(candidate):
+    """Lưu base mới (từ apply_delta_message) sau khi payload đã được nhận để ghi
+
+    Keyframe luôn thay base (sender restart thì seq bắt đầu lại); delta chỉ khi base vẫn là seq - 1.
+    """
+    if candidate is None:
+        return
+    player_name, seq, payload, keyframe = candidate
+    with _delta_lock:
+        if not keyframe:
+            base = live_state.delta_base(player_name)
+            if base is None or base[0] != seq - 1:
+                return
+        live_state.set_delta_base(player_name, seq, payload)
+
+def accept_snapshot(data):
+    """Validate + đưa payload vào ingest queue, trả về (body, status, headers); dùng chung cho Flask và ASGI"""
+    current_time = datetime.now()
+
+    # Delta protocol: dựng lại payload đầy đủ từ base của player
+    try:
+        data, seq, candidate = apply_delta_message(data)
+    except ResyncRequired as e:
+        return {'error': str(e), 'resync': True, 'expected_seq': e.expected_seq}, 409, {}
+    except ValueError as e:
+        return {'error': str(e)}, 400, {}
+    if data is None:
+        return {'status': 'duplicate', 'message': 'Delta already applied', 'seq': seq}, 200, {}
+
+    # Validate data
+    error = validate_payload(data)
+    if error:
+        return {'error': error}, 400, {}
+
+    # Đưa vào write-behind queue, writer thread sẽ ghi xuống database
+    if not ingest_queue.submit(data):
+        return ({'error': 'Ingest queue full, retry later'}, 429,
+                {'Retry-After': str(max(1, int(ingest_queue.flush_interval)))})
+    commit_delta_base(candidate)
+
+    record_live_update(data, current_time)
+
+    body = {
+        'status': 'success',
+        'message': 'Blox Fruits stats received successfully!',
+        'timestamp': current_time.isoformat(),
+        'player': data['player_name']
+    }
+    if seq is not None:
+        body['seq'] = seq
+    return body, 200, {}
+
+class BodyError(ValueError):
+    """Body ingest không giải nén / decode được, kèm HTTP status trả về cho client"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+# Fixed-field array form (Content-Type .../vnd.bloxfruits.compact+json hoặc +msgpack):
+#   [1, player_name, user_id, level, beli, fragments, bounty, honor, equipped_fruit, fighting_style,
+#    styles, [swords, guns, fruits], session_id, timestamp, [place_id, job_id, players_count]]
+# styles = list owned styles, true = không đổi (như {"unchanged": true}), null = không gửi
+COMPACT_VERSION = 1
+COMPACT_FIELDS = ('player_name', 'user_id', 'level', 'beli', 'fragments', 'bounty', 'honor', 'equipped_fruit',
+                  'fighting_style', 'fighting_styles', 'items', 'session_id', 'timestamp', 'server_info')
+COMPACT_ITEM_KINDS = ('swords', 'guns', 'fruits')
+COMPACT_SERVER_INFO = ('place_id', 'job_id', 'players_count')
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+def _unpack_msgpack(raw):
+    if msgpack is None:
+        raise BodyError('MessagePack body cần msgpack trên server: pip install -r requirements-optional.txt', 415)
+    return msgpack.unpackb(raw, raw=False)
+
+# Content-Type -> (loader, fixed-field array form)
+BODY_FORMATS = {
+    'application/json': (json.loads, False),
+    'application/msgpack': (_unpack_msgpack, False),
+    'application/x-msgpack': (_unpack_msgpack, False),
+    'application/vnd.bloxfruits.compact+json': (json.loads, True),
+    'application/vnd.bloxfruits.compact+msgpack': (_unpack_msgpack, True),
+}
+
+def expand_compact_payload(row):
+    """Fixed-field array -> payload dict như Lua sender gửi"""
+    if not isinstance(row, list) or len(row) != len(COMPACT_FIELDS) + 1 or row[0] != COMPACT_VERSION:
+        raise ValueError(f'Invalid compact payload (expected [{COMPACT_VERSION}, ...{len(COMPACT_FIELDS)} fields])')
+    data = {key: value for key, value in zip(COMPACT_FIELDS, row[1:]) if value is not None}
+    styles = data.get('fighting_styles')
+    if styles is True:
+        data['fighting_styles'] = {'unchanged': True}
+    elif isinstance(styles, list):
+        data['fighting_styles'] = {'owned': styles}
+    if isinstance(data.get('items'), list) and len(data['items']) == len(COMPACT_ITEM_KINDS):
+        data['items'] = dict(zip(COMPACT_ITEM_KINDS, data['items']))
+    if isinstance(data.get('server_info'), list) and len(data['server_info']) == len(COMPACT_SERVER_INFO):
+        data['server_info'] = dict(zip(COMPACT_SERVER_INFO, data['server_info']))
+    return data
+
+def body_too_large(what='decompressed'):
+    return BodyError(f'Body too large (max {INGEST_MAX_BODY_BYTES} bytes {what})', 413)
+
+def _inflate_member(raw, encoding, candidates, budget):
+    """Giải một zlib/gzip/deflate stream ở đầu raw, trả về (data, phần còn lại sau stream)"""
+    for wbits in candidates:
+        decompressor = zlib.decompressobj(wbits)
+        try:
+            data = decompressor.decompress(raw, budget + 1)
+            break
+        except zlib.error as e:
+            error = e
+    else:
+        raise BodyError(f'Invalid {encoding} body: {error}')
+    if len(data) > budget or decompressor.unconsumed_tail:
+        raise body_too_large()
+    if not decompressor.eof:
+        raise BodyError(f'Truncated {encoding} body')
+    return data, decompressor.unused_data
+
+def decompress_body(raw, content_encoding):
+    """Giải Content-Encoding (gzip, deflate, có thể nhiều lớp), không cho body giải nén vượt INGEST_MAX_BODY_BYTES
+
+    gzip có thể gồm nhiều member nối tiếp (RFC 1952), giải hết; deflate có data thừa sau stream là lỗi.
+    """
+    encodings = [e.strip().lower() for e in (content_encoding or '').split(',') if e.strip()]
+    for encoding in reversed(encodings):
+        if encoding == 'identity':
+            continue
+        if encoding in ('gzip', 'x-gzip'):
+            candidates = (31,)
+        elif encoding == 'deflate':
+            # Chuẩn là zlib stream, nhưng nhiều client gửi raw deflate
+            candidates = (15, -15)
+        else:
+            raise BodyError(f'Unsupported Content-Encoding: {encoding}', 415)
+        data, rest = _inflate_member(raw, encoding, candidates, INGEST_MAX_BODY_BYTES)
+        while rest:
+            if candidates != (31,):
+                raise BodyError(f'Trailing data after {encoding} body')
+            member, rest = _inflate_member(rest, encoding, candidates, INGEST_MAX_BODY_BYTES - len(data))
+            data += member
+        raw = data
+    if len(raw) > INGEST_MAX_BODY_BYTES:
+        raise body_too_large()
+    return raw
+
+def read_request_body():
+    """Body (wire bytes) của Flask request, đọc từng chunk và dừng ngay khi vượt INGEST_MAX_BODY_BYTES"""
+    if request.content_length is not None and request.content_length > INGEST_MAX_BODY_BYTES:
+        raise body_too_large('on the wire')
+    body = bytearray()
+    while True:
+        chunk = request.stream.read(64 * 1024)
+        if not chunk:
+            return bytes(body)
+        body += chunk
+        if len(body) > INGEST_MAX_BODY_BYTES:
+            raise body_too_large('on the wire')
+
+def decode_ingest_body(raw, content_type, content_encoding, batch=False):
+    """Body ingest -> payload: giải nén theo Content-Encoding, decode theo Content-Type
+
+    JSON (mặc định khi không có Content-Type), MessagePack, fixed-field array form; batch nhận thêm NDJSON.
+    batch=True trả về list (payload, parse_error), hoặc None nếu body không phải array.
+    """
+    raw = decompress_body(raw, content_encoding)
+    content_type = (content_type or 'application/json').split(';')[0].strip().lower()
+    if batch and content_type in NDJSON_TYPES:
+        entries = []
+        for line in raw.decode('utf-8', errors='replace').splitlines():
+            if not line.strip():
+                continue
+            try:
+                entries.append((json.loads(line), None))
+            except ValueError as e:
+                entries.append((None, f'Invalid JSON line: {e}'))
+        return entries
+
+    if content_type not in BODY_FORMATS:
+        raise BodyError(f'Unsupported Content-Type: {content_type}', 415)
+    loader, compact = BODY_FORMATS[content_type]
+    try:
+        data = loader(raw)
+    except BodyError:
+        raise
+    except Exception as e:
+        raise BodyError(f'Invalid {content_type} body: {e}')
+
+    if not batch:
+        try:
+            return expand_compact_payload(data) if compact else data
+        except ValueError as e:
+            raise BodyError(str(e))
+    if not isinstance(data, list):
+        return None
+    if not compact:
+        return [(item, None) for item in data]
+    entries = []
+    for row in data:
+        try:
+            entries.append((expand_compact_payload(row), None))
+        except ValueError as e:
+            entries.append((None, str(e)))
+    return entries
+
 @app.route('/api/bloxfruits/stats', methods=['POST'])
 def receive_bloxfruits_stats():
     """Nhận stats data từ Blox Fruits"""
     try:
-        data = request.get_json()
-        current_time = datetime.now()
-        
-        # Validate data
-        if not data or not data.get('player_name'):
-            return jsonify({'error': 'Invalid data'}), 400
-        
-        # Save to database
-        save_player_stats(data)
-        
-        # Save fighting styles if provided
-        if 'fighting_styles' in data:
-            save_fighting_styles(data['player_name'], data.get('user_id', 0), data['fighting_styles'])
-        
-        # Save items if provided
-        if 'items' in data:
-            save_player_items(data['player_name'], data.get('user_id', 0), data['items'])
-        
-        # Update active sessions
-        session_key = data['player_name']
-        active_sessions[session_key] = {
-            'last_update': current_time,
-            'data': data
-        }
-        
-        # Add to recent updates
-        update_msg = f"Level {data.get('level', 0)} - {data.get('beli', 0):,} Beli"
-        recent_updates.append({
-            'timestamp': current_time.strftime("%H:%M:%S"),
-            'player_name': data['player_name'],
-            'message': update_msg
-        })
-        
-        # Keep only recent updates
-        if len(recent_updates) > max_recent_updates:
-            recent_updates.pop(0)
-        
-        print(f"🍓 [{current_time.strftime('%H:%M:%S')}] Blox Fruits Stats Received:")
-        print(f"   👤 Player: {data['player_name']} (ID: {data.get('user_id', 'Unknown')})")
-        print(f"   ⭐ Level: {data.get('level', 0)} | 💰 Beli: {data.get('beli', 0):,}")
-        print(f"   💎 Fragments: {data.get('fragments', 0):,} | ⚔️ Style: {data.get('fighting_style', 'None')}")
-        print("   " + "-" * 60)
+        try:
+            data = decode_ingest_body(read_request_body(), request.mimetype,
+                                      request.headers.get('Content-Encoding'))
+        except BodyError as e:
+            return jsonify({'error': str(e)}), e.status
+        body, status, headers = accept_snapshot(data)
+        response = jsonify(body)
+        response.headers.update(headers)
+        return response, status
         
+    except Exception as e:
+        log_event('error', 'ingest_failed', f"❌ Error processing Blox Fruits stats: {str(e)}", error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/bloxfruits/stats/batch', methods=['POST'])
+def receive_bloxfruits_stats_batch():
+    """Nhận nhiều player snapshots trong một request (JSON/MessagePack/compact array hoặc NDJSON)
+
+    Item hợp lệ vào ingest queue như endpoint single: status 'ok' là đã nhận, writer ghi sau.
+    """
+    try:
+        current_time = datetime.now()
+        try:
+            entries = decode_ingest_body(read_request_body(), request.mimetype,
+                                         request.headers.get('Content-Encoding'), batch=True)
+        except BodyError as e:
+            return jsonify({'error': str(e)}), e.status
+        if entries is None:
+            return jsonify({'error': 'Expected an array or NDJSON body'}), 400
+        if len(entries) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'Batch too large (max {BATCH_MAX_ITEMS} items)'}), 413
+
+        # Validate từng item, chỉ ghi những item hợp lệ
+        results = []
+        valid = []
+        candidates = {}  # index -> base mới, commit sau khi đã vào ingest queue
+        pending_bases = {}
+        for index, (data, error) in enumerate(entries):
+            player = data.get('player_name') if isinstance(data, dict) else None
+            result = {'index': index, 'player': player}
+            if not error:
+                # Delta protocol theo thứ tự trong batch, gap chỉ làm lỗi item đó
+                try:
+                    data, seq, candidate = apply_delta_message(data, pending_bases)
+                except ResyncRequired as e:
+                    error = str(e)
+                    result.update(resync=True, expected_seq=e.expected_seq)
+                except ValueError as e:
+                    error = str(e)
+                else:
+                    if seq is not None:
+                        result['seq'] = seq
+                    if data is None:
+                        results.append(dict(result, status='duplicate', error=None))
+                        continue
+                    if candidate is not None:
+                        candidates[index] = candidate
+                        pending_bases[candidate[0]] = (candidate[1], candidate[2])
+            error = error or validate_payload(data)
+            results.append(dict(result, status='error' if error else 'ok', error=error))
+            if not error:
+                valid.append((index, data))
+
+        # Item hợp lệ đi qua write-behind queue như endpoint single (cùng writer, cùng backpressure):
+        # không đủ chỗ cho cả batch thì 429, client gửi lại nguyên batch
+        if valid and not ingest_queue.submit_many([data for _, data in valid]):
+            return (jsonify({'error': 'Ingest queue full, retry later'}), 429,
+                    {'Retry-After': str(max(1, int(ingest_queue.flush_interval)))})
+        for index, data in valid:
+            commit_delta_base(candidates.get(index))
+            record_live_update(data, current_time)
+
+        accepted = sum(1 for r in results if r['status'] == 'ok')
         return jsonify({
             'status': 'success',
-            'message': 'Blox Fruits stats received successfully!',
+            'message': f'{accepted}/{len(results)} Blox Fruits snapshots accepted',
             'timestamp': current_time.isoformat(),
-            'player': data['player_name']
+            'accepted': accepted,
+            'rejected': len(results) - accepted,
+            'results': results
         })
-        
+
     except Exception as e:
-        print(f"❌ Error processing Blox Fruits stats: {str(e)}")
+        log_event('error', 'ingest_batch_failed', f"❌ Error processing Blox Fruits stats batch: {str(e)}",
+                  error=str(e))
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/progress/<player_name>')
+def get_progress(player_name):
+    """API lấy progress events của player, lọc theo thời gian (UTC) và event type"""
+    try:
+        since = parse_utc_arg('since', None)
+        until = parse_utc_arg('until', None)
+    except ValueError:
+        return jsonify({'error': 'since/until must be ISO timestamps (UTC)'}), 400
+    event_type = request.args.get('type')
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+
+    query = 'SELECT event_type, old_value, new_value, timestamp FROM progress_log WHERE player_name = ?'
+    params = [player_name]
+    if since:
+        query += ' AND timestamp >= ?'
+        params.append(since.strftime('%Y-%m-%d %H:%M:%S'))
+    if until:
+        query += ' AND timestamp <= ?'
+        params.append(until.strftime('%Y-%m-%d %H:%M:%S'))
+    if event_type:
+        query += ' AND event_type = ?'
+        params.append(event_type)
+    query += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+    params.append(limit)
+
+    with db_pool.connection() as conn:
+        events = [{'type': row[0], 'old_value': row[1], 'new_value': row[2], 'timestamp': row[3]}
+                  for row in conn.execute(query, params)]
+
+    return jsonify({
+        'player': player_name,
+        'events': events,
+        'showing': len(events)
+    })
+
+# Các table được export: table -> (cột thời gian cho since/until, mới nhất trước?)
+# Thứ tự theo id (timestamp là CURRENT_TIMESTAMP lúc insert nên cùng thứ tự), dùng làm keyset cho từng chunk
+EXPORT_TABLES = {
+    'player_stats': ('timestamp', True),
+    'fighting_styles': ('last_seen', False),
+    'player_items': ('timestamp', False),
+    'progress_log': ('timestamp', False),
+}
+EXPORT_DEFAULT_TABLES = ['player_stats', 'fighting_styles', 'player_items']
+
+def iter_export_rows(table, since=None, until=None, player=None):
+    """Yield (columns, rows) theo từng chunk, không load cả table vào memory
+
+    since/until là datetime UTC. Mỗi chunk mượn connection riêng (keyset theo id): client download
+    chậm không giữ connection của pool trong suốt response, writer thread không bị chờ.
+    """
+    time_column, newest_first = EXPORT_TABLES[table]
+    query = f'SELECT * FROM {table} WHERE 1 = 1'
+    params = []
+    if since:
+        query += f' AND {time_column} >= ?'
+        params.append(since.strftime('%Y-%m-%d %H:%M:%S'))
+    if until:
+        query += f' AND {time_column} <= ?'
+        params.append(until.strftime('%Y-%m-%d %H:%M:%S'))
+    if player:
+        query += ' AND player_name = ?'
+        params.append(player)
+    last_id = None
+    while True:
+        chunk_query, chunk_params = query, list(params)
+        if last_id is not None:
+            chunk_query += ' AND id < ?' if newest_first else ' AND id > ?'
+            chunk_params.append(last_id)
+        chunk_query += f" ORDER BY id {'DESC' if newest_first else 'ASC'} LIMIT ?"
+        chunk_params.append(EXPORT_CHUNK_ROWS)
+        with db_pool.connection() as conn:
+            cursor = conn.execute(chunk_query, chunk_params)
+            columns = [col[0] for col in cursor.description]
+            rows = cursor.fetchall()
+        if not rows:
+            break
+        yield columns, rows
+        if len(rows) < EXPORT_CHUNK_ROWS:
+            break
+        last_id = rows[-1][columns.index('id')]
+
+def export_json_chunks(tables, **filters):
+    """JSON giống format cũ: {"export_time", "<table>": [[row], ...]}"""
+    yield '{"export_time": ' + json.dumps(datetime.now().isoformat())
+    for table in tables:
+        yield f', "{table}": ['
+        first = True
+        for _, rows in iter_export_rows(table, **filters):
+            chunk = ', '.join(json.dumps(list(row)) for row in rows)
+            yield chunk if first else ', ' + chunk
+            first = False
+        yield ']'
+    yield '}'
+
+def export_ndjson_chunks(tables, **filters):
+    """Mỗi dòng một object {"table": ..., <column>: <value>}"""
+    for table in tables:
+        for columns, rows in iter_export_rows(table, **filters):
+            yield ''.join(json.dumps({'table': table, **dict(zip(columns, row))}) + '\n' for row in rows)
+
+def export_csv_chunks(tables, **filters):
+    """CSV một table (header + rows)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_written = False
+    for columns, rows in iter_export_rows(tables[0], **filters):
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+EXPORT_FORMATS = {
+    'json': (export_json_chunks, 'application/json', 'json'),
+    'ndjson': (export_ndjson_chunks, 'application/x-ndjson', 'ndjson'),
+    'csv': (export_csv_chunks, 'text/csv', 'csv'),
+}
+
+def gzip_chunks(chunks):
+    """Nén stream text chunks thành gzip, từng chunk một"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/api/stream')
+def stream_updates():
+    """Server-sent events: push recent updates tới dashboard, resume bằng Last-Event-ID"""
+    last_seq = request.headers.get('Last-Event-ID', type=int)
+    if last_seq is None:
+        last_seq = request.args.get('since', type=int)
+    last_seq = stream_start_seq(last_seq)
+
+    def generate(last_seq):
+        yield 'retry: 3000\n\n'
+        while True:
+            updates = live_state.wait_since(last_seq, STREAM_KEEPALIVE_SECONDS)
+            if not updates:
+                yield ': keepalive\n\n'
+                continue
+            for update in updates:
+                last_seq = update['seq']
+                yield f"id: {last_seq}\nevent: update\ndata: {json.dumps(update)}\n\n"
+
+    return Response(generate(last_seq), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def parse_utc_arg(name, default):
+    """Đọc query param thời gian (ISO) thành datetime UTC naive như utcnow() và timestamp trong DB
+
+    Có offset (+07:00, Z) thì đổi về UTC; sai format thì ValueError.
+    """
+    value = request.args.get(name)
+    if not value:
+        return default
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def pick_history_resolution(span_seconds, points):
+    """Resolution thô nhất vẫn cho ít nhất `points` điểm, không có thì dùng raw"""
+    for resolution, (_, bucket_seconds) in reversed(ROLLUP_RESOLUTIONS.items()):
+        if span_seconds / bucket_seconds >= points:
+            return resolution
+    return 'raw'
+
+@app.route('/api/history/<player_name>')
+def get_history(player_name):
+    """Time-series của một metric, tự chọn resolution theo số điểm yêu cầu"""
+    metric = request.args.get('metric', 'level')
+    if metric not in ROLLUP_METRICS:
+        return jsonify({'error': f'Unknown metric, use one of: {", ".join(ROLLUP_METRICS)}'}), 400
+    resolution = request.args.get('resolution', 'auto')
+    if resolution not in ('auto', 'raw', *ROLLUP_RESOLUTIONS):
+        return jsonify({'error': 'resolution must be auto, raw, minute, hour or day'}), 400
+    points = max(1, request.args.get('points', 200, type=int))
+
+    try:
+        end = parse_utc_arg('to', datetime.utcnow())
+        start = parse_utc_arg('from', end - timedelta(days=1))
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO timestamps (UTC)'}), 400
+
+    if resolution == 'auto':
+        resolution = pick_history_resolution((end - start).total_seconds(), points)
+
+    with db_pool.connection() as conn:
+        if resolution == 'raw':
+            rows = conn.execute(f'''
+                SELECT timestamp, {metric}, {metric}, {metric} FROM player_stats
+                WHERE player_name = ? AND timestamp >= ? AND timestamp <= ? ORDER BY timestamp
+            ''', (player_name, start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'))).fetchall()
+        else:
+            fmt = ROLLUP_RESOLUTIONS[resolution][0]
+            rows = conn.execute(f'''
+                SELECT bucket, {metric}_min, {metric}_max, {metric}_last FROM rollup_{resolution}
+                WHERE player_name = ? AND bucket >= ? AND bucket <= ? ORDER BY bucket
+            ''', (player_name, start.strftime(fmt), end.strftime(fmt))).fetchall()
+
+    return jsonify({
+        'player': player_name,
+        'metric': metric,
+        'resolution': resolution,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'points': [{'t': row[0], 'min': row[1], 'max': row[2], 'last': row[3]} for row in rows]
+    })
+
 @app.route('/api/export', methods=['GET'])
 def export_data():
-    """Export all data as JSON"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Get all data
-    cursor.execute('SELECT * FROM player_stats ORDER BY timestamp DESC')
-    stats = cursor.fetchall()
-    
-    cursor.execute('SELECT * FROM fighting_styles')
-    styles = cursor.fetchall()
-    
-    cursor.execute('SELECT * FROM player_items')
-    items = cursor.fetchall()
-    
-    conn.close()
-    
-    export_data = {
-        'export_time': datetime.now().isoformat(),
-        'player_stats': stats,
-        'fighting_styles': styles,
-        'player_items': items
-    }
-    
-    return jsonify(export_data)
+    """Export data dạng stream (json/ndjson/csv, optional gzip), memory cố định"""
+    export_format = request.args.get('format', 'json')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unknown format, use one of: {", ".join(EXPORT_FORMATS)}'}), 400
+
+    table = request.args.get('table')
+    if table and table not in EXPORT_TABLES:
+        return jsonify({'error': f'Unknown table, use one of: {", ".join(EXPORT_TABLES)}'}), 400
+    if table:
+        tables = [table]
+    elif export_format == 'csv':
+        tables = ['player_stats']
+    else:
+        tables = EXPORT_DEFAULT_TABLES
+
+    try:
+        filters = {
+            'since': parse_utc_arg('since', None),
+            'until': parse_utc_arg('until', None),
+            'player': request.args.get('player')
+        }
+    except ValueError:
+        return jsonify({'error': 'since/until must be ISO timestamps (UTC)'}), 400
+    use_gzip = request.args.get('gzip', '0').lower() in ('1', 'true', 'yes')
+    make_chunks, mimetype, extension = EXPORT_FORMATS[export_format]
+
+    def generate():
+        chunks = make_chunks(tables, **filters)
+        if use_gzip:
+            yield from gzip_chunks(chunks)
+        else:
+            for chunk in chunks:
+                yield chunk.encode('utf-8')
+
+    filename = f'blox_fruits_stats.{extension}' + ('.gz' if use_gzip else '')
+    return Response(generate(), mimetype='application/gzip' if use_gzip else mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 @app.route('/api/clear', methods=['POST'])
 def clear_data():
     """Clear all tracking data"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    # Ghi nốt các payload đang chờ để chúng không xuất hiện lại sau khi clear
+    if not ingest_queue.join(CLEAR_FLUSH_TIMEOUT):
+        log_event('warning', 'clear_timeout', 'Ingest queue chưa flush xong, bỏ qua clear',
+                  depth=ingest_queue.stats()['depth'], timeout=CLEAR_FLUSH_TIMEOUT)
+        return jsonify({'error': 'Ingest queue is still flushing, retry later'}), 503, {'Retry-After': '5'}
+
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('DELETE FROM player_snapshots')
+        cursor.execute('DELETE FROM player_styles')
+        cursor.execute('DELETE FROM player_inventory')
+        for table in Interner.DIMENSIONS:
+            cursor.execute(f'DELETE FROM {table}')
+        cursor.execute('DELETE FROM progress_log')
+        cursor.execute('DELETE FROM player_latest')
+        cursor.execute('UPDATE tracker_counters SET value = 0')  # gồm cả pruned_snapshots
+        cursor.execute('DELETE FROM level_window')
+        for resolution in ROLLUP_RESOLUTIONS:
+            cursor.execute(f'DELETE FROM rollup_{resolution}')
+
+        conn.commit()
     
-    cursor.execute('DELETE FROM player_stats')
-    cursor.execute('DELETE FROM fighting_styles')
-    cursor.execute('DELETE FROM player_items')
-    cursor.execute('DELETE FROM progress_log')
+    live_state.clear()
+    player_state_cache.invalidate()
+    interner.clear()
     
-    conn.commit()
-    conn.close()
-    
-    global recent_updates, active_sessions
-    recent_updates.clear()
-    active_sessions.clear()
-    
-    print("🗑️ All Blox Fruits tracking data cleared!")
+    log_event('warning', 'clear', "🗑️ All Blox Fruits tracking data cleared!", remote_addr=request.remote_addr)
     return jsonify({'status': 'success', 'message': 'All data cleared'})
 
+@app.route('/api/admin/retention', methods=['GET', 'POST'])
+def admin_retention():
+    """GET: số liệu retention/compaction; POST: chạy một lượt ngay"""
+    if request.method == 'POST':
+        return jsonify({'status': 'success', 'result': retention_compactor.run_once(),
+                        'retention': retention_compactor.stats()})
+    return jsonify({'retention': retention_compactor.stats()})
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Label theo route rule (không phải path) để player name không nổ cardinality
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    started = g.get('request_started')
+    if started is not None:
+        metrics.observe('bf_http_request_duration_seconds', time.perf_counter() - started, route=route)
+    metrics.inc('bf_http_requests_total', route=route, method=request.method, status=response.status_code)
+    return response
+
+def scrape_gauges():
+    """Metrics đọc lúc scrape: ingest queue, DB size, live state"""
+    queue_stats = ingest_queue.stats()
+    with db_pool.connection() as conn:
+        db_bytes, freelist_bytes = db_size_bytes(conn)
+    wal_file = DB_FILE + '-wal'
+    wal_bytes = os.path.getsize(wal_file) if os.path.exists(wal_file) else 0
+    return [
+        ('bf_ingest_queue_depth', 'gauge', 'Payload đang chờ writer ghi xuống DB', queue_stats['depth'], {}),
+        ('bf_ingest_queue_capacity', 'gauge', 'Sức chứa ingest queue', queue_stats['capacity'], {}),
+        ('bf_ingest_flushed_total', 'counter', 'Payload đã ghi xuống DB', queue_stats['flushed'], {}),
+        ('bf_ingest_failed_total', 'counter', 'Payload ghi lỗi', queue_stats['failed'], {}),
+        ('bf_ingest_rejected_total', 'counter', 'Payload bị từ chối do queue đầy (429)', queue_stats['rejected'], {}),
+        ('bf_ingest_retried_total', 'counter', 'Batch ghi lại do SQLite busy/locked', queue_stats['retried'], {}),
+        ('bf_db_size_bytes', 'gauge', 'Kích thước database (page_count * page_size)', db_bytes, {}),
+        ('bf_db_freelist_bytes', 'gauge', 'Bytes trong freelist chờ incremental vacuum', freelist_bytes, {}),
+        ('bf_db_wal_bytes', 'gauge', 'Kích thước WAL file', wal_bytes, {}),
+        ('bf_active_players', 'gauge', 'Active sessions trong live state', live_state.active_count(), {}),
+        ('bf_live_updates_seq', 'gauge', 'Sequence number cuối của live updates feed', live_state.last_seq, {}),
+        ('bf_retention_rows_pruned_total', 'counter', 'Rows đã bị retention xóa (process này)',
+         retention_compactor.total_rows_pruned, {}),
+        ('bf_profiler_running', 'gauge', '1 nếu sampling profiler đang chạy', int(profiler.running), {}),
+        ('bf_log_queue_depth', 'gauge', 'Log records chờ listener thread ghi ra', log_handler.queue.qsize(), {}),
+        ('bf_log_dropped_total', 'counter', 'Log records bị bỏ do log queue đầy', log_handler.dropped, {}),
+    ]
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition format"""
+    return Response(metrics.render(scrape_gauges()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/profiler', methods=['GET', 'POST'])
+def admin_profiler():
+    """GET: các stack nóng nhất (?limit, ?match, ?format=collapsed); POST {"enabled": bool, "interval": s}"""
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        interval = body.get('interval')
+        if interval is not None and (isinstance(interval, bool) or not isinstance(interval, (int, float))
+                                     or not 0.001 <= interval <= 60):
+            return jsonify({'error': 'interval must be a number of seconds between 0.001 and 60'}), 400
+        if body.get('enabled', True):
+            profiler.start(interval)
+        else:
+            profiler.stop()
+        return jsonify({'status': 'success', 'profiler': profiler.stats()})
+
+    stacks = profiler.top(request.args.get('limit', 20, type=int), request.args.get('match'))
+    if request.args.get('format') == 'collapsed':
+        # "frame;frame;frame count" mỗi dòng, đưa thẳng vào flamegraph.pl / speedscope
+        return Response(''.join(f'{stack} {count}\n' for stack, count in stacks), mimetype='text/plain')
+    samples = max(1, profiler.samples)
+    return jsonify({
+        'profiler': profiler.stats(),
+        'stacks': [{'count': count, 'percent': round(100 * count / samples, 1),
+                    'stack': stack.split(';')} for stack, count in stacks]
+    })
+
 @app.route('/api/ping', methods=['GET'])
 def ping():
     return jsonify({
         'message': 'Blox Fruits Tracker Online!',
         'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'active_players': len(active_sessions)
+        'active_players': live_state.active_count(),
+        'ingest_queue': ingest_queue.stats()
     })
 
-def open_browser():
+class AsyncTracker:
+    """ASGI app cho async serving mode (uvicorn server:asgi_app)
+
+    Ingest và SSE chạy trên event loop (ingest chỉ enqueue, không đụng tracker DB), nên một
+    connection chờ không giữ OS thread nào. Các route còn lại là Flask app gọi qua WSGI
+    trong ThreadPoolExecutor giới hạn ASYNC_DB_WORKERS thread.
+    Live state có blocking I/O (sqlite backend) cũng được gọi qua executor đó, không chặn loop.
+    """
+
+    def __init__(self, wsgi_app, workers=ASYNC_DB_WORKERS):
+        self.wsgi_app = wsgi_app
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bf-async-db')
+        self._loop = None
+        self._updated = None
+
+    def _bind_loop(self):
+        """Gắn vào event loop đầu tiên gọi app, đăng ký nhận live updates"""
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._updated = asyncio.Event()
+        live_state.add_listener(lambda seq: self._loop.call_soon_threadsafe(self._notify_updated))
+        if live_state.poll_interval:
+            # Backend dùng chung: update của worker khác chỉ thấy được bằng poll, một task cho cả process
+            self._loop.create_task(self._poll_updates())
+
+    async def _live(self, func, *args):
+        """Gọi live_state (hoặc function dùng nó), qua executor nếu backend là blocking I/O"""
+        if not live_state.blocking:
+            return func(*args)
+        return await self._loop.run_in_executor(self.executor, func, *args)
+
+    @staticmethod
+    def _last_seq():
+        return live_state.last_seq
+
+    async def _poll_updates(self):
+        last_seq = await self._live(self._last_seq)
+        while True:
+            await asyncio.sleep(live_state.poll_interval)
+            seq = await self._live(self._last_seq)
+            if seq != last_seq:
+                last_seq = seq
+                self._notify_updated()
+
+    def _notify_updated(self):
+        # Event một lần: set cái hiện tại cho mọi SSE đang chờ, thay bằng event mới
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        self._bind_loop()
+        if scope['path'] == '/api/bloxfruits/stats' and scope['method'] == 'POST':
+            await self._ingest(scope, receive, send)
+        elif scope['path'] == '/api/stream' and scope['method'] == 'GET':
+            await self._stream(scope, receive, send)
+        else:
+            await self._call_wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._bind_loop()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _read_body(scope, receive, limit=INGEST_MAX_BODY_BYTES):
+        """Đọc hết request body; BodyError 413 ngay khi Content-Length hoặc số bytes đã nhận vượt limit"""
+        content_length = dict(scope['headers']).get(b'content-length', b'')
+        if content_length.isdigit() and int(content_length) > limit:
+            raise body_too_large('on the wire')
+        body = bytearray()
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if len(body) > limit:
+                raise body_too_large('on the wire')
+            if not message.get('more_body'):
+                return bytes(body)
+
+    @staticmethod
+    async def _send_json(send, body, status=200, headers=None):
+        payload = json.dumps(body).encode()
+        raw_headers = [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode()),
+                       (b'access-control-allow-origin', b'*')]
+        raw_headers += [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in (headers or {}).items()]
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+        await send({'type': 'http.response.body', 'body': payload})
+
+    async def _ingest(self, scope, receive, send):
+        """POST /api/bloxfruits/stats: parse + validate + enqueue ngay trên event loop"""
+        started = time.perf_counter()
+        headers = dict(scope['headers'])
+        try:
+            data = decode_ingest_body(await self._read_body(scope, receive),
+                                      headers.get(b'content-type', b'').decode('latin-1'),
+                                      headers.get(b'content-encoding', b'').decode('latin-1'))
+        except BodyError as e:
+            body, status, headers = {'error': str(e)}, e.status, {}
+        else:
+            try:
+                # accept_snapshot ghi live state (record_live_update, delta base)
+                body, status, headers = await self._live(accept_snapshot, data)
+            except Exception as e:
+                log_event('error', 'ingest_failed', f"❌ Error processing Blox Fruits stats: {str(e)}",
+                          error=str(e))
+                body, status, headers = {'error': str(e)}, 500, {}
+        await self._send_json(send, body, status, headers)
+        metrics.observe('bf_http_request_duration_seconds', time.perf_counter() - started,
+                        route='/api/bloxfruits/stats')
+        metrics.inc('bf_http_requests_total', route='/api/bloxfruits/stats', method='POST', status=status)
+
+    async def _stream(self, scope, receive, send):
+        """GET /api/stream: SSE giống route Flask, chờ bằng asyncio.Event thay vì block thread"""
+        headers = dict(scope['headers'])
+        try:
+            last_seq = int(headers[b'last-event-id'])
+        except (KeyError, ValueError):
+            since = parse_qs(scope['query_string'].decode('latin-1')).get('since')
+            last_seq = int(since[0]) if since and since[0].isdigit() else None
+        last_seq = await self._live(stream_start_seq, last_seq)
+
+        metrics.inc('bf_http_requests_total', route='/api/stream', method='GET', status=200)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'), (b'access-control-allow-origin', b'*')]})
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+
+        async def wait_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        disconnected = asyncio.ensure_future(wait_disconnect())
+        try:
+            while not disconnected.done():
+                # Lấy event trước khi đọc buffer để không lỡ update đến giữa chừng
+                updated = self._updated
+                updates = await self._live(live_state.since, last_seq)
+                if updates:
+                    chunk = ''.join(f"id: {update['seq']}\nevent: update\ndata: {json.dumps(update)}\n\n"
+                                    for update in updates)
+                    last_seq = updates[-1]['seq']
+                    await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+                    continue
+                waiter = asyncio.ensure_future(updated.wait())
+                done, _ = await asyncio.wait({waiter, disconnected}, timeout=STREAM_KEEPALIVE_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if not done:
+                    await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+        finally:
+            disconnected.cancel()
+
+    @staticmethod
+    def _wsgi_environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name, value = name.decode('latin-1'), value.decode('latin-1')
+            if name == 'content-length':
+                continue
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+                continue
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    async def _call_wsgi(self, scope, receive, send):
+        """Chạy Flask route trong executor; response buffered gửi một lần, streaming (export) gửi từng chunk"""
+        try:
+            environ = self._wsgi_environ(scope, await self._read_body(scope, receive))
+        except BodyError as e:
+            await self._send_json(send, {'error': str(e)}, e.status)
+            return
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+            return lambda data: None
+
+        def call_app():
+            result = self.wsgi_app(environ, start_response)
+            chunks = iter(result)
+            # Có Content-Length = response đã buffered, đọc hết luôn trong cùng lần vào executor
+            if any(name.lower() == 'content-length' for name, _ in started['headers']):
+                body = b''.join(chunks)
+                if hasattr(result, 'close'):
+                    result.close()
+                return None, None, body
+            return result, chunks, b''
+
+        loop = asyncio.get_running_loop()
+        result, chunks, body = await loop.run_in_executor(self.executor, call_app)
+        await send({'type': 'http.response.start', 'status': started['status'],
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in started['headers']]})
+        if chunks is None:
+            await send({'type': 'http.response.body', 'body': body})
+            return
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
+        await send({'type': 'http.response.body', 'body': b''})
+
+asgi_app = AsyncTracker(app)
+
+def serve_async(host, port, workers=1):
+    """Chạy asgi_app bằng uvicorn (optional dependency), workers > 1 thì mỗi worker một process"""
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("❌ Async mode cần uvicorn: pip install -r requirements-optional.txt")
+    if workers <= 1:
+        uvicorn.run(asgi_app, host=host, port=port, log_level='warning', timeout_keep_alive=60)
+        return
+    if LIVE_STATE_BACKEND == 'memory':
+        # Worker process đọc env khi import server, live state phải dùng chung
+        os.environ['BF_LIVE_STATE'] = 'sqlite'
+        log_event('info', 'live_state_shared', f"🔗 Live state shared via {LIVE_STATE_FILE}",
+                  live_state_file=LIVE_STATE_FILE)
+    uvicorn.run('server:asgi_app', host=host, port=port, workers=workers, log_level='warning',
+                timeout_keep_alive=60, app_dir=os.path.dirname(os.path.abspath(__file__)))
+
+def open_browser(port=5000):
     """Auto-open browser"""
     time.sleep(2)
-    webbrowser.open('http://localhost:5000')
+    webbrowser.open(f'http://localhost:{port}')
+
+CLI_COMMANDS = ['serve', 'migrate', 'vacuum', 'compact', 'rebuild-latest', 'rebuild-rollups',
+                'check-counters', 'fix-counters', 'check-plans']
+
+def run_cli_command(command):
+    """Các lệnh bảo trì database chạy từ command line"""
+    with db_pool.connection() as conn:
+        if command == 'migrate':
+            # init_database() đã migrate khi import, chỉ báo version hiện tại
+            print(f"✅ Database schema at v{get_schema_version(conn)}")
+            return 0
+        if command == 'rebuild-latest':
+            with conn:
+                rebuild_player_latest(conn)
+            count = conn.execute('SELECT COUNT(*) FROM player_latest').fetchone()[0]
+            print(f"✅ player_latest rebuilt: {count} players")
+            if raw_history_start(conn) is not None:
+                print("   Raw history was pruned: players without raw rows were kept as-is")
+            return 0
+        if command == 'vacuum':
+            # VACUUM đầy đủ (offline), đồng thời bật incremental vacuum cho DB tạo trước đó
+            size_before, _ = db_size_bytes(conn)
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            size_after, _ = db_size_bytes(conn)
+            print(f"✅ Vacuumed: {size_before:,} -> {size_after:,} bytes (auto_vacuum=INCREMENTAL)")
+            return 0
+        if command == 'compact':
+            result = retention_compactor.run_once()
+            print(f"✅ Pruned {result['raw_rows_pruned']:,} snapshots, {result['minute_rollups_pruned']:,} "
+                  f"minute rollups, reclaimed {result['bytes_reclaimed']:,} bytes")
+            return 0
+        if command == 'rebuild-rollups':
+            with conn:
+                rebuild_rollups(conn)
+            print(f"✅ Rollups rebuilt: {', '.join(ROLLUP_RESOLUTIONS)}")
+            start = raw_history_start(conn)
+            if start is not None:
+                print(f"   Raw history was pruned: buckets up to {start} were kept as-is")
+            return 0
+        if command in ('check-counters', 'fix-counters'):
+            cached = read_counters(conn.cursor())
+            counters, window = recompute_counters(conn)
+            samples = sum(row[2] for row in window)
+            counters['avg_level'] = int(sum(row[1] for row in window) / samples) if samples else 0
+            drift = {name: cached[name] - value for name, value in counters.items() if cached[name] != value}
+            heartbeats = conn.execute(
+                "SELECT value FROM tracker_counters WHERE name = 'skipped_snapshots'").fetchone()[0]
+            if heartbeats:
+                # Heartbeat cũng là một level sample nhưng không có raw row để tính lại
+                drift.pop('avg_level', None)
+            for name, value in counters.items():
+                print(f"   {name}: cached={cached[name]} recomputed={value}")
+            if heartbeats:
+                print("   avg_level: heartbeat samples are not in raw history, not checked")
+            if command == 'fix-counters':
+                with conn:
+                    rebuild_counters(conn)
+                print("✅ Counters rebuilt from history")
+                return 0
+            print(f"❌ Counter drift: {drift}" if drift else "✅ Counters consistent")
+            return 1 if drift else 0
+        if command == 'check-plans':
+            problems = check_query_plans(conn)
+            for name, plan in problems:
+                print(f"❌ Full table scan in '{name}': {' | '.join(plan)}")
+            if not problems:
+                print(f"✅ All {len(QUERY_PLAN_CHECKS)} hot queries use an index")
+            return 1 if problems else 0
+    return 0
 
 if __name__ == '__main__':
-    print("🍓 Starting Blox Fruits Stats Tracker Server...")
-    print("🌐 Dashboard: http://localhost:5000")
-    print("📡 API Endpoint: http://localhost:5000/api/bloxfruits/stats")
-    print("🎮 Ready to track Blox Fruits players!")
-    print("=" * 60)
+    import argparse
+    parser = argparse.ArgumentParser(description='Blox Fruits Stats Tracker Server')
+    parser.add_argument('command', nargs='?', default='serve', choices=CLI_COMMANDS)
+    parser.add_argument('--mode', choices=['threaded', 'async'], default=os.environ.get('BF_SERVER_MODE', 'threaded'),
+                        help='threaded: Flask dev server, một thread mỗi request; async: ASGI qua uvicorn')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=1, help='số worker process (chỉ async mode)')
+    parser.add_argument('--no-browser', action='store_true')
+    args = parser.parse_args()
+    if args.command != 'serve':
+        raise SystemExit(run_cli_command(args.command))
+
+    if sys.stdout.isatty():
+        # Banner chỉ cho người chạy trên terminal; chạy dưới supervisor/pipe thì chỉ có JSON log
+        print("🍓 Starting Blox Fruits Stats Tracker Server...")
+        print(f"🌐 Dashboard: http://localhost:{args.port}")
+        print(f"📡 API Endpoint: http://localhost:{args.port}/api/bloxfruits/stats")
+        print(f"⚙️ Mode: {args.mode}" + (f" x {args.workers} workers" if args.mode == 'async' else ''))
+        print("🎮 Ready to track Blox Fruits players!")
+        print("=" * 60)
+    log_event('info', 'startup', host=args.host, port=args.port, mode=args.mode, workers=args.workers,
+              log_format=LOG_FORMAT)
     
     # Auto-open browser
-    threading.Thread(target=open_browser, daemon=True).start()
+    if not args.no_browser:
+        threading.Thread(target=open_browser, args=(args.port,), daemon=True).start()
     
     # Run server
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    if args.mode == 'async':
+        serve_async(args.host, args.port, args.workers)
+    else:
+        app.run(host=args.host, port=args.port, debug=False, threaded=True)
\ No newline at end of file
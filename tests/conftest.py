@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# server.py mở database và start background threads ngay lúc import:
+# trỏ mọi file vào thư mục tạm trước khi import
+TEST_DIR = tempfile.mkdtemp(prefix='bf-tests-')
+os.environ['BF_DB_FILE'] = os.path.join(TEST_DIR, 'tracker.db')
+os.environ.setdefault('BF_LOG_LEVEL', 'ERROR')
+os.environ.setdefault('BF_COMPACT_INTERVAL', '0')
+os.environ.setdefault('BF_INGEST_FLUSH_INTERVAL', '0.05')
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import server  # noqa: E402
+
+
+def make_payload(name='Tester', **overrides):
+    """Payload giống sendDataToServer trong Lua script"""
+    payload = {
+        'player_name': name,
+        'user_id': 1000,
+        'level': 100,
+        'beli': 5000,
+        'fragments': 10,
+        'bounty': 0,
+        'honor': 0,
+        'equipped_fruit': 'Flame-Flame',
+        'fighting_style': 'Combat',
+        'fighting_styles': {'owned': ['Combat']},
+        'items': {'swords': ['Katana'], 'guns': [], 'fruits': []},
+        'session_id': 'job-1',
+        'timestamp': 1700000000,
+        'server_info': {'place_id': 1, 'job_id': 'job-1', 'players_count': 1}
+    }
+    payload.update(overrides)
+    return payload
+
+
+@pytest.fixture
+def client():
+    """Flask test client trên database rỗng"""
+    test_client = server.app.test_client()
+    assert test_client.post('/api/clear').status_code == 200
+    return test_client
+
+
+@pytest.fixture
+def post_snapshot(client):
+    """POST một payload rồi chờ ingest writer ghi xong"""
+    def post(payload, **kwargs):
+        response = client.post('/api/bloxfruits/stats', json=payload, **kwargs)
+        server.ingest_queue.join()
+        return response
+    return post
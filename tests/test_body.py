@@ -0,0 +1,87 @@
+import asyncio
+import gzip
+import random
+import zlib
+
+import pytest
+
+import benchmark
+import server
+from conftest import make_payload
+
+PAYLOADS = [benchmark.make_payload(i, random.Random(i)) for i in range(3)]
+
+
+def available_formats():
+    for fmt in benchmark.BODY_FORMATS:
+        marks = [pytest.mark.skipif(benchmark.msgpack is None, reason='msgpack not installed')] \
+            if fmt.endswith('msgpack') else []
+        yield pytest.param(fmt, marks=marks, id=fmt)
+
+
+@pytest.mark.parametrize('encoding', list(benchmark.BODY_ENCODINGS))
+@pytest.mark.parametrize('fmt', list(available_formats()))
+@pytest.mark.parametrize('batch', [False, True], ids=['single', 'batch'])
+def test_encode_decode_round_trip(fmt, encoding, batch):
+    if fmt == 'ndjson' and not batch:
+        pytest.skip('NDJSON is batch-only')
+    payloads = PAYLOADS if batch else PAYLOADS[:1]
+    raw = benchmark.BODY_ENCODINGS[encoding](benchmark.encode_body(fmt, payloads, batch))
+    decoded = server.decode_ingest_body(raw, benchmark.BODY_FORMATS[fmt], encoding, batch=batch)
+    if batch:
+        assert [error for _, error in decoded] == [None] * len(payloads)
+        decoded = [payload for payload, _ in decoded]
+        assert decoded == payloads
+    else:
+        assert decoded == payloads[0]
+
+
+def test_multi_member_gzip_is_fully_decoded():
+    lines = [server.json.dumps(p).encode() + b'\n' for p in PAYLOADS]
+    raw = b''.join(gzip.compress(line) for line in lines)
+    entries = server.decode_ingest_body(raw, 'application/x-ndjson', 'gzip', batch=True)
+    assert [payload for payload, _ in entries] == PAYLOADS
+
+
+def test_trailing_data_after_deflate_is_rejected():
+    raw = zlib.compress(b'{"player_name": "A"}') + b'garbage'
+    with pytest.raises(server.BodyError) as error:
+        server.decompress_body(raw, 'deflate')
+    assert error.value.status == 400
+
+
+def test_multi_member_gzip_respects_size_limit(monkeypatch):
+    monkeypatch.setattr(server, 'INGEST_MAX_BODY_BYTES', 100)
+    raw = gzip.compress(b'a' * 60) + gzip.compress(b'b' * 60)
+    with pytest.raises(server.BodyError) as error:
+        server.decompress_body(raw, 'gzip')
+    assert error.value.status == 413
+
+
+def test_flask_rejects_oversized_wire_body(client, monkeypatch):
+    monkeypatch.setattr(server, 'INGEST_MAX_BODY_BYTES', 64)
+    body = server.json.dumps(make_payload()).encode()
+    for path in ('/api/bloxfruits/stats', '/api/bloxfruits/stats/batch'):
+        response = client.post(path, data=body, content_type='application/json')
+        assert response.status_code == 413
+
+
+def test_asgi_read_body_stops_at_limit():
+    chunks = [{'type': 'http.request', 'body': b'x' * 40, 'more_body': True} for _ in range(10)]
+    received = []
+
+    async def receive():
+        received.append(1)
+        return chunks.pop(0)
+
+    scope = {'headers': []}
+    with pytest.raises(server.BodyError) as error:
+        asyncio.run(server.AsyncTracker._read_body(scope, receive, limit=100))
+    assert error.value.status == 413
+    assert len(received) == 3
+
+    async def never():
+        raise AssertionError('body should not be read')
+
+    with pytest.raises(server.BodyError):
+        asyncio.run(server.AsyncTracker._read_body({'headers': [(b'content-length', b'101')]}, never, limit=100))
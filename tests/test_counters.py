@@ -0,0 +1,51 @@
+import server
+from conftest import make_payload
+
+
+def cached_and_recomputed():
+    with server.db_pool.connection() as conn:
+        counters = dict(conn.execute('SELECT name, value FROM tracker_counters'))
+        window = conn.execute('SELECT minute, level_sum, samples FROM level_window').fetchall()
+        recomputed, recomputed_window = server.recompute_counters(conn)
+    return counters, window, recomputed, recomputed_window
+
+
+def test_counters_match_recomputed_values(client, post_snapshot, monkeypatch):
+    post_snapshot(make_payload('Alice', level=10))
+    post_snapshot(make_payload('Alice', level=10))  # heartbeat: dedup skip, không có raw row
+    post_snapshot(make_payload('Bob', level=20))
+    post_snapshot(make_payload('Alice', level=11))
+
+    # Batch có một item lỗi giữa chừng (sau update_counters): savepoint rollback cả counters của nó
+    real_save_items = server.save_player_items
+
+    def save_items(conn, player_name, user_id, items_data):
+        if player_name == 'Broken':
+            raise RuntimeError('boom')
+        return real_save_items(conn, player_name, user_id, items_data)
+
+    monkeypatch.setattr(server, 'save_player_items', save_items)
+    results = server.ingest_batch([make_payload('Carol', level=30), make_payload('Broken', level=99),
+                                   make_payload('Bob', level=20), make_payload('Bob', level=21)])
+    assert results == [None, 'boom', None, None]
+
+    counters, window, recomputed, recomputed_window = cached_and_recomputed()
+    skipped = counters['skipped_snapshots']
+    assert skipped == 2
+    assert {name: counters[name] for name in recomputed} == recomputed == {'total_updates': 7, 'total_players': 3}
+
+    # Heartbeat vẫn là một level sample nhưng không có raw row để tính lại
+    assert sum(row[2] for row in window) == sum(row[2] for row in recomputed_window) + skipped
+    assert sum(row[1] for row in window) == sum(row[1] for row in recomputed_window) + 10 + 20
+    assert server.run_cli_command('check-counters') == 0
+
+
+def test_check_counters_detects_drift(client, post_snapshot):
+    post_snapshot(make_payload(level=10))
+    with server.db_pool.connection() as conn:
+        with conn:
+            conn.execute("UPDATE tracker_counters SET value = value + 5 WHERE name = 'total_updates'")
+    assert server.run_cli_command('check-counters') != 0
+    assert server.run_cli_command('fix-counters') == 0
+    counters, _, recomputed, _ = cached_and_recomputed()
+    assert counters['total_updates'] == recomputed['total_updates'] == 1
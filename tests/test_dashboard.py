@@ -0,0 +1,44 @@
+import server
+from conftest import make_payload
+
+
+def summary(client, **params):
+    response = client.get('/api/dashboard/summary', query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_summary_returns_players_changed_after_cursor(client, post_snapshot):
+    post_snapshot(make_payload('A'))
+    first = summary(client, since=0)
+    assert [p['name'] for p in first['players']] == ['A']
+
+    post_snapshot(make_payload('B'))
+    second = summary(client, since=first['cursor'], epoch=first['epoch'])
+    assert second['reset'] is False
+    assert [p['name'] for p in second['players']] == ['B']
+
+
+def test_clear_bumps_epoch_and_resets_stale_cursor(client, post_snapshot):
+    for name in ('A', 'B', 'C'):
+        post_snapshot(make_payload(name))
+    before = summary(client, since=0)
+
+    assert client.post('/api/clear').status_code == 200
+    post_snapshot(make_payload('D'))
+    # cursor cũ (3) lớn hơn change_seq mới (1): nếu không có epoch thì D không bao giờ hiện ra
+    after = summary(client, since=before['cursor'], epoch=before['epoch'])
+    assert after['epoch'] != before['epoch']
+    assert after['reset'] is True
+    assert [p['name'] for p in after['players']] == ['D']
+
+
+def test_summary_etag_changes_with_epoch(client, post_snapshot):
+    post_snapshot(make_payload('A'))
+    etag = client.get('/api/dashboard/summary').headers['ETag']
+    assert client.get('/api/dashboard/summary', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/api/clear')
+    post_snapshot(make_payload('A'))
+    assert client.get('/api/dashboard/summary', headers={'If-None-Match': etag}).status_code == 200
+    assert 'data-epoch="%d"' % server.live_state.epoch() in client.get('/').get_data(as_text=True)
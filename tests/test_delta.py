@@ -0,0 +1,103 @@
+import server
+from conftest import make_payload
+
+
+def keyframe(seq, **overrides):
+    return dict(make_payload(**overrides), proto=server.DELTA_PROTOCOL_VERSION, kind='keyframe', seq=seq)
+
+
+def delta(seq, name='Tester', unset=None, **fields):
+    message = dict(fields, player_name=name, proto=server.DELTA_PROTOCOL_VERSION, kind='delta', seq=seq)
+    if unset is not None:
+        message['unset'] = unset
+    return message
+
+
+def latest_level(name='Tester'):
+    with server.db_pool.connection() as conn:
+        row = conn.execute('SELECT level FROM player_latest WHERE player_name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+
+def test_keyframe_becomes_base(post_snapshot):
+    response = post_snapshot(keyframe(1, level=150))
+    assert response.status_code == 200
+    assert response.get_json()['seq'] == 1
+    seq, payload = server.live_state.delta_base('Tester')
+    assert seq == 1
+    assert payload['level'] == 150
+    assert 'proto' not in payload and 'seq' not in payload
+    assert latest_level() == 150
+
+
+def test_delta_merges_into_base_and_unsets_fields(post_snapshot):
+    post_snapshot(keyframe(1, level=150, items={'swords': ['Katana'], 'guns': ['Musket'], 'fruits': []}))
+    response = post_snapshot(delta(2, level=151, items={'swords': ['Katana', 'Saber']}, unset=['equipped_fruit']))
+    assert response.status_code == 200
+
+    seq, payload = server.live_state.delta_base('Tester')
+    assert seq == 2
+    assert payload['level'] == 151
+    assert payload['items'] == {'swords': ['Katana', 'Saber'], 'guns': ['Musket'], 'fruits': []}
+    assert 'equipped_fruit' not in payload
+    assert payload['beli'] == 5000
+    assert latest_level() == 151
+
+
+def test_sequence_gap_requests_resync(post_snapshot):
+    post_snapshot(keyframe(1))
+    response = post_snapshot(delta(3, level=101))
+    assert response.status_code == 409
+    body = response.get_json()
+    assert body['resync'] is True
+    assert body['expected_seq'] == 2
+    assert server.live_state.delta_base('Tester')[0] == 1
+
+    # Chưa có base: resync nhưng không biết seq mong đợi
+    response = post_snapshot(delta(1, name='Nobody', level=1))
+    assert response.status_code == 409
+    assert response.get_json()['expected_seq'] is None
+
+
+def test_replayed_delta_is_duplicate(post_snapshot):
+    post_snapshot(keyframe(1))
+    assert post_snapshot(delta(2, level=101)).status_code == 200
+    response = post_snapshot(delta(2, level=999))
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'duplicate'
+    assert latest_level() == 101
+
+
+def test_delta_rejected_with_429_is_applied_on_retry(client, post_snapshot, monkeypatch):
+    post_snapshot(keyframe(1))
+    full = server.IngestQueue(maxsize=1)  # writer thread không chạy
+    assert full.submit(make_payload('Filler'))
+    with monkeypatch.context() as patch:
+        patch.setattr(server, 'ingest_queue', full)
+        assert client.post('/api/bloxfruits/stats', json=delta(2, level=101)).status_code == 429
+    assert server.live_state.delta_base('Tester')[0] == 1
+
+    response = post_snapshot(delta(2, level=101))
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'success'
+    assert server.live_state.delta_base('Tester')[0] == 2
+    assert latest_level() == 101
+
+
+def test_batch_advances_base_only_after_items_are_queued(client, monkeypatch):
+    client.post('/api/bloxfruits/stats', json=keyframe(1))
+    server.ingest_queue.join()
+
+    full = server.IngestQueue(maxsize=1)  # writer thread không chạy
+    with monkeypatch.context() as patch:
+        patch.setattr(server, 'ingest_queue', full)
+        response = client.post('/api/bloxfruits/stats/batch', json=[delta(2, level=101), delta(3, level=102)])
+        assert response.status_code == 429
+    assert server.live_state.delta_base('Tester')[0] == 1
+
+    # Gửi lại đúng các seq đó: vẫn được áp dụng, delta thứ hai dựa trên base chưa commit của item trước
+    body = client.post('/api/bloxfruits/stats/batch', json=[delta(2, level=101), delta(3, level=102)]).get_json()
+    server.ingest_queue.join()
+    assert [r['status'] for r in body['results']] == ['ok', 'ok']
+    assert server.live_state.delta_base('Tester')[0] == 3
+    assert latest_level() == 102
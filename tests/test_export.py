@@ -0,0 +1,99 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+import server
+from conftest import make_payload
+
+# (player, level, timestamp UTC trong DB)
+SNAPSHOTS = [
+    ('Alice', 100, '2024-01-01 10:00:00'),
+    ('Bob', 200, '2024-01-02 10:00:00'),
+    ('Alice', 101, '2024-01-03 10:00:00'),
+    ('Bob', 201, '2024-01-04 10:00:00'),
+    ('Alice', 102, '2024-01-05 10:00:00'),
+]
+
+
+@pytest.fixture
+def history(post_snapshot):
+    for name, level, _ in SNAPSHOTS:
+        post_snapshot(make_payload(name, level=level, beli=level))
+    with server.db_pool.connection() as conn:
+        ids = [row[0] for row in conn.execute('SELECT id FROM player_snapshots ORDER BY id')]
+        assert len(ids) == len(SNAPSHOTS)
+        conn.executemany('UPDATE player_snapshots SET timestamp = ? WHERE id = ?',
+                         [(ts, row_id) for (_, _, ts), row_id in zip(SNAPSHOTS, ids)])
+        conn.commit()
+
+
+def export_levels(client, **args):
+    response = client.get('/api/export', query_string=dict(args, format='ndjson', table='player_stats'))
+    assert response.status_code == 200
+    return [json.loads(line)['level'] for line in response.data.decode().splitlines()]
+
+
+def test_json_export_contains_default_tables(client, history):
+    response = client.get('/api/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    body = json.loads(response.data)
+    assert set(body) == {'export_time', *server.EXPORT_DEFAULT_TABLES}
+    assert len(body['player_stats']) == len(SNAPSHOTS)
+    assert body['player_items']
+
+
+def test_ndjson_export_is_newest_first(client, history):
+    assert export_levels(client) == [102, 201, 101, 200, 100]
+
+
+def test_csv_export_has_header(client, history):
+    response = client.get('/api/export', query_string={'format': 'csv'})
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'].endswith('.csv"')
+    rows = list(csv.reader(io.StringIO(response.data.decode())))
+    assert 'player_name' in rows[0] and 'level' in rows[0]
+    assert len(rows) == len(SNAPSHOTS) + 1
+
+
+def test_gzip_export_decompresses(client, history):
+    response = client.get('/api/export', query_string={'format': 'ndjson', 'table': 'player_stats', 'gzip': '1'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/gzip'
+    lines = gzip.decompress(response.data).decode().splitlines()
+    assert [json.loads(line)['level'] for line in lines] == [102, 201, 101, 200, 100]
+
+
+@pytest.mark.parametrize('args, levels', [
+    ({'since': '2024-01-02 10:00:00', 'until': '2024-01-04 10:00:00'}, [201, 101, 200]),
+    ({'since': '2024-01-02T10:00:00', 'until': '2024-01-04T10:00:00'}, [201, 101, 200]),
+    ({'since': '2024-01-02T10:00:00Z'}, [102, 201, 101, 200]),
+    ({'until': '2024-01-03T17:00:00+07:00'}, [101, 200, 100]),
+    ({'player': 'Alice', 'since': '2024-01-02'}, [102, 101]),
+])
+def test_export_filters(client, history, args, levels):
+    assert export_levels(client, **args) == levels
+
+
+@pytest.mark.parametrize('args', [{'since': 'yesterday'}, {'until': '2024-13-01'}])
+def test_export_rejects_bad_time_filter(client, args):
+    response = client.get('/api/export', query_string=args)
+    assert response.status_code == 400
+    assert 'since/until' in response.get_json()['error']
+
+
+def test_export_reads_in_chunks_without_holding_connection(client, history, monkeypatch):
+    pool = server.ConnectionPool(server.DB_FILE, size=1)
+    monkeypatch.setattr(server, 'db_pool', pool)
+    monkeypatch.setattr(server, 'EXPORT_CHUNK_ROWS', 2)
+    chunks = server.iter_export_rows('player_stats')
+    columns, rows = next(chunks)
+    assert [row[columns.index('level')] for row in rows] == [102, 201]
+    # Giữa hai chunk connection đã trả về pool: client download chậm không chặn writer
+    assert pool._idle.qsize() == 1
+    remaining = [row[columns.index('level')] for _, rows in chunks for row in rows]
+    assert remaining == [101, 200, 100]
+    pool.close_all()
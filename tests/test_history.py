@@ -0,0 +1,34 @@
+import pytest
+
+from conftest import make_payload
+
+
+def history(client, **params):
+    return client.get('/api/history/Tester', query_string=params)
+
+
+@pytest.mark.parametrize('params, expected_from, expected_to', [
+    ({'from': '2024-01-01T07:00:00+07:00', 'to': '2024-01-02T00:00:00Z'},
+     '2024-01-01T00:00:00', '2024-01-02T00:00:00'),
+    ({'from': '2024-01-01T00:00:00', 'to': '2024-01-01T12:00:00-02:00'},
+     '2024-01-01T00:00:00', '2024-01-01T14:00:00'),
+])
+def test_history_normalizes_offsets_to_utc(client, params, expected_from, expected_to):
+    response = history(client, **params)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['from'], body['to']) == (expected_from, expected_to)
+
+
+def test_history_with_only_aware_from_does_not_mix_naive_now(client, post_snapshot):
+    post_snapshot(make_payload())
+    response = history(client, **{'from': '2000-01-01T00:00:00+00:00', 'resolution': 'raw'})
+    assert response.status_code == 200
+    assert len(response.get_json()['points']) == 1
+
+
+@pytest.mark.parametrize('value', ['yesterday', '2024-13-01', '2024-01-01T00:00:00+25:00'])
+def test_history_rejects_bad_timestamps(client, value):
+    response = history(client, **{'from': value})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
@@ -0,0 +1,151 @@
+import pytest
+
+import server
+from conftest import make_payload
+
+
+@pytest.mark.parametrize('overrides, error', [
+    ({'player_name': ''}, 'Invalid data'),
+    ({'player_name': 42}, 'player_name must be a string'),
+    ({'level': '100'}, 'level must be a number'),
+    ({'beli': True}, 'beli must be a number'),
+    ({'beli': None}, 'beli must be a number'),
+    ({'level': None}, 'level must be a number'),
+    ({'user_id': None}, 'user_id must be a number'),
+    ({'fighting_styles': {'owned': 'Combat'}}, 'fighting_styles.owned must be a list of strings'),
+    ({'fighting_styles': {'owned': ['Combat', 1]}}, 'fighting_styles.owned must be a list of strings'),
+    ({'fighting_styles': {'unchanged': 'yes'}}, 'fighting_styles.unchanged must be a boolean'),
+    ({'items': ['Katana']}, 'items must be an object'),
+    ({'items': {'swords': 'Katana'}}, 'items.swords must be a list of strings'),
+    ({'items': {'guns': {'Musket': 1}}}, 'items.guns must be a list of strings'),
+    ({'items': {'fruits': 'Ice-Ice'}}, 'items.fruits must be a list of strings'),
+])
+def test_validate_payload_rejects_bad_shapes(overrides, error):
+    assert server.validate_payload(make_payload(**overrides)) == error
+
+
+def test_validate_payload_accepts_sender_payload():
+    assert server.validate_payload(make_payload()) is None
+    assert server.validate_payload(make_payload(fighting_styles={'unchanged': True})) is None
+
+
+def test_string_inventory_is_rejected_before_ingest(post_snapshot, client):
+    response = post_snapshot(make_payload(items={'swords': 'Katana'}))
+    assert response.status_code == 400
+    assert client.get('/api/account-details/Tester').status_code == 404
+
+
+@pytest.mark.parametrize('field', ['beli', 'level'])
+def test_null_number_is_rejected_before_queue(post_snapshot, client, field):
+    # beli null từng làm record_live_update lỗi 500 sau khi đã enqueue, level null làm writer fail
+    failed = server.ingest_queue.stats()['failed']
+    response = post_snapshot(make_payload(**{field: None}))
+    assert response.status_code == 400
+    assert response.get_json()['error'] == f'{field} must be a number'
+    assert server.ingest_queue.stats()['failed'] == failed
+    assert client.get('/api/account-details/Tester').status_code == 404
+    assert post_snapshot(make_payload()).status_code == 200
+    assert client.get('/api/account-details/Tester').status_code == 200
+
+
+def test_snapshot_is_written_through_queue(post_snapshot, client):
+    assert post_snapshot(make_payload(level=120)).status_code == 200
+    details = client.get('/api/account-details/Tester').get_json()
+    assert details['level'] == 120
+    assert details['items'] == [{'name': 'Katana', 'type': 'Sword'}]
+    assert [style['name'] for style in details['fighting_styles']] == ['Combat']
+
+
+def test_queue_join_times_out_while_items_are_pending():
+    pending = server.IngestQueue()  # writer thread không chạy
+    assert pending.join(0) is True
+    assert pending.submit(make_payload())
+    assert pending.join(0.05) is False
+
+
+def test_submit_many_is_all_or_nothing():
+    pending = server.IngestQueue(maxsize=3)  # writer thread không chạy
+    assert pending.submit_many([make_payload('A'), make_payload('B')])
+    assert not pending.submit_many([make_payload('C'), make_payload('D')])
+    assert pending.stats()['depth'] == 2
+    assert pending.stats()['rejected'] == 2
+    assert pending.submit(make_payload('C'))
+    assert not pending.submit(make_payload('D'))
+
+
+def test_batch_is_written_through_queue(client, monkeypatch):
+    stuck = server.IngestQueue()  # writer thread không chạy: chưa có gì được ghi
+    monkeypatch.setattr(server, 'ingest_queue', stuck)
+    body = client.post('/api/bloxfruits/stats/batch',
+                       json=[make_payload('A'), make_payload('B', level='x'), make_payload('C')]).get_json()
+    assert [r['status'] for r in body['results']] == ['ok', 'error', 'ok']
+    assert body['accepted'] == 2
+    assert stuck.stats()['depth'] == 2
+    assert client.get('/api/account-details/A').status_code == 404
+
+    stuck.start()
+    assert stuck.join(10)
+    stuck.stop()
+    assert client.get('/api/account-details/A').get_json()['level'] == 100
+    assert client.get('/api/account-details/C').status_code == 200
+
+
+def test_batch_returns_429_when_queue_is_full(client, monkeypatch):
+    full = server.IngestQueue(maxsize=2)
+    assert full.submit(make_payload('Filler'))
+    monkeypatch.setattr(server, 'ingest_queue', full)
+    response = client.post('/api/bloxfruits/stats/batch', json=[make_payload('A'), make_payload('B')])
+    assert response.status_code == 429
+    assert response.headers['Retry-After']
+    assert full.stats()['depth'] == 1
+
+
+def test_clear_returns_503_when_queue_does_not_drain(client, monkeypatch):
+    stuck = server.IngestQueue()
+    stuck.submit(make_payload())
+    monkeypatch.setattr(server, 'ingest_queue', stuck)
+    monkeypatch.setattr(server, 'CLEAR_FLUSH_TIMEOUT', 0.05)
+    response = client.post('/api/clear')
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+
+def test_heartbeat_still_counts_as_level_sample(client, post_snapshot):
+    post_snapshot(make_payload(level=100))
+    post_snapshot(make_payload(level=100))  # giống hệt: chỉ heartbeat, không có raw row
+    with server.db_pool.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM player_stats').fetchone()[0] == 1
+        assert conn.execute('SELECT SUM(samples) FROM level_window').fetchone()[0] == 2
+        counters = dict(conn.execute('SELECT name, value FROM tracker_counters'))
+    assert counters['skipped_snapshots'] == 1
+    assert counters['total_updates'] == 2
+    assert counters['total_players'] == 1
+    assert server.run_cli_command('check-counters') == 0
+
+
+def style_names(client, name='Tester'):
+    return sorted(style['name'] for style in client.get(f'/api/account-details/{name}').get_json()['fighting_styles'])
+
+
+def test_unchanged_styles_marker_keeps_stored_styles(client, post_snapshot):
+    post_snapshot(make_payload(level=100, fighting_styles={'owned': ['Combat', 'Dark Step']}))
+    assert post_snapshot(make_payload(level=101, fighting_styles={'unchanged': True})).status_code == 200
+    assert style_names(client) == ['Combat', 'Dark Step']
+    assert client.get('/api/account-details/Tester').get_json()['level'] == 101
+
+    # Cache miss: styles đã biết được đọc lại từ DB
+    server.player_state_cache.invalidate()
+    post_snapshot(make_payload(level=102, fighting_styles={'unchanged': True}))
+    assert style_names(client) == ['Combat', 'Dark Step']
+    with server.db_pool.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM player_styles WHERE owned').fetchone()[0] == 2
+
+
+def test_unchanged_styles_marker_for_unknown_player_is_dropped(client, post_snapshot):
+    assert post_snapshot(make_payload('Newbie', fighting_styles={'unchanged': True})).status_code == 200
+    details = client.get('/api/account-details/Newbie').get_json()
+    assert details['level'] == 100
+    assert details['fighting_styles'] == []
+    with server.db_pool.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM player_styles').fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM progress_log WHERE event_type = 'style_unlocked'").fetchone()[0] == 0
@@ -0,0 +1,63 @@
+import sqlite3
+
+import server
+
+
+def dimension_db():
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    conn.execute('CREATE TABLE players (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)')
+    return conn
+
+
+def test_ids_from_rolled_back_transaction_are_not_cached():
+    interner = server.Interner()
+    conn = dimension_db()
+
+    conn.execute('BEGIN')
+    assert interner.id_for(conn, 'players', 'Ghost') == 1
+    conn.execute('ROLLBACK')
+    interner.discard(conn)
+
+    conn.execute("INSERT INTO players (name) VALUES ('Other')")
+    conn.execute('BEGIN')
+    ghost_id = interner.id_for(conn, 'players', 'Ghost')
+    conn.execute('COMMIT')
+    interner.commit(conn)
+    assert ghost_id == 2
+    assert conn.execute("SELECT id FROM players WHERE name = 'Ghost'").fetchone()[0] == ghost_id
+
+
+def test_pending_ids_are_private_to_their_connection(tmp_path):
+    interner = server.Interner()
+    path = str(tmp_path / 'dims.db')
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute('CREATE TABLE players (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)')
+    reader = sqlite3.connect(path, isolation_level=None)
+
+    writer.execute('BEGIN')
+    player_id = interner.id_for(writer, 'players', 'A')
+    assert interner._ids == {}
+    writer.execute('COMMIT')
+    interner.commit(writer)
+    assert interner.id_for(reader, 'players', 'A') == player_id
+
+
+def test_failed_batch_item_does_not_poison_cache(client, monkeypatch):
+    from conftest import make_payload
+
+    original = server.save_player_items
+
+    def fail_for_ghost(conn, player_name, user_id, items):
+        if player_name == 'Ghost':
+            raise RuntimeError('boom')
+        return original(conn, player_name, user_id, items)
+
+    monkeypatch.setattr(server, 'save_player_items', fail_for_ghost)
+    results = server.ingest_batch([make_payload('Ghost', equipped_fruit='Ghost-Fruit'), make_payload('Real')])
+    assert results == ['boom', None]
+    assert ('players', ('Ghost',)) not in server.interner._ids
+    assert ('fruits', ('Ghost-Fruit',)) not in server.interner._ids
+    with server.db_pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM players WHERE name = 'Ghost'").fetchone()[0] == 0
+        real_id = conn.execute("SELECT id FROM players WHERE name = 'Real'").fetchone()[0]
+    assert server.interner._ids[('players', ('Real',))] == real_id
@@ -0,0 +1,58 @@
+import server
+from conftest import make_payload
+
+COLUMNS = 'player_name, user_id, level, beli, fragments, bounty, honor, equipped_fruit, fighting_style, session_id'
+
+
+def latest_rows(conn):
+    return conn.execute(f'SELECT {COLUMNS} FROM player_latest ORDER BY player_name').fetchall()
+
+
+def newest_history_rows(conn):
+    return conn.execute(f'''
+        SELECT {COLUMNS} FROM player_stats
+        WHERE id IN (SELECT MAX(id) FROM player_stats GROUP BY player_name) ORDER BY player_name
+    ''').fetchall()
+
+
+def ingest_interleaved(post_snapshot):
+    # Nhiều player xen kẽ, timestamp phía client đi lùi (report đến trễ / đồng hồ lệch)
+    reports = [
+        make_payload('Alice', level=10, timestamp=1700000300),
+        make_payload('Bob', level=50, beli=1, timestamp=1700000200),
+        make_payload('Alice', level=12, equipped_fruit='Ice-Ice', timestamp=1700000100),
+        make_payload('Carol', level=5, session_id='job-2'),
+        make_payload('Bob', level=49, beli=2, timestamp=1700000000),
+        make_payload('Alice', level=11, fighting_style='Dark Step', timestamp=1700000050),
+        make_payload('Carol', level=5, session_id='job-2'),  # heartbeat, không có raw row
+    ]
+    for payload in reports:
+        assert post_snapshot(payload).status_code == 200
+    # Thêm một batch cùng transaction
+    assert server.ingest_batch([make_payload('Bob', level=51, beli=3), make_payload('Dave', level=1)]) == [None, None]
+
+
+def test_player_latest_matches_newest_history_row(client, post_snapshot):
+    ingest_interleaved(post_snapshot)
+    with server.db_pool.connection() as conn:
+        rows = latest_rows(conn)
+        assert rows == newest_history_rows(conn)
+    levels = {row[0]: row[2] for row in rows}
+    assert levels == {'Alice': 11, 'Bob': 51, 'Carol': 5, 'Dave': 1}
+    assert dict((row[0], row[8]) for row in rows)['Alice'] == 'Dark Step'
+
+
+def test_rebuild_latest_reproduces_table_from_history(client, post_snapshot):
+    ingest_interleaved(post_snapshot)
+    with server.db_pool.connection() as conn:
+        before = latest_rows(conn)
+        with conn:
+            conn.execute('DELETE FROM player_latest')
+            conn.execute("INSERT INTO player_latest (player_name, level) VALUES ('Ghost', 999)")
+
+    assert server.run_cli_command('rebuild-latest') == 0
+
+    with server.db_pool.connection() as conn:
+        assert latest_rows(conn) == before
+        change_seqs = [row[0] for row in conn.execute('SELECT change_seq FROM player_latest')]
+    assert len(set(change_seqs)) == len(change_seqs)
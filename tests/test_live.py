@@ -0,0 +1,90 @@
+import time
+
+import server
+
+
+def test_wait_since_blocks_after_clear():
+    updates = server.RecentUpdates(10)
+    updates.append({'player_name': 'A'})
+    updates.append({'player_name': 'B'})
+    updates.clear()
+
+    started = time.monotonic()
+    assert updates.wait_since(1, 0.2) == []
+    assert time.monotonic() - started >= 0.2
+
+    seq = updates.append({'player_name': 'C'})
+    assert seq == 3
+    assert [u['player_name'] for u in updates.wait_since(1, 0.2)] == ['C']
+
+
+def test_stream_start_seq_resets_stale_cursors(monkeypatch):
+    state = server.MemoryLiveState(3)
+    monkeypatch.setattr(server, 'live_state', state)
+    assert server.stream_start_seq(None) == 0
+    assert server.stream_start_seq(7) == 0  # Last-Event-ID từ trước khi server restart
+
+    for name in 'ABCDE':
+        state.updates.append({'player_name': name})
+    # buffer còn seq 3..5
+    assert server.stream_start_seq(None) == 5
+    assert server.stream_start_seq(2) == 2
+    assert server.stream_start_seq(4) == 4
+    assert server.stream_start_seq(1) == 5  # đã rớt khỏi buffer
+    assert server.stream_start_seq(9) == 5
+
+    state.clear()
+    assert server.stream_start_seq(4) == 5
+
+
+def test_sqlite_live_state_first_seq(tmp_path):
+    state = server.SqliteLiveState(str(tmp_path / 'live.db'), 2)
+    assert (state.first_seq, state.last_seq) == (1, 0)
+    for name in 'ABC':
+        state.record({'player_name': name}, server.datetime.utcnow(), {'player_name': name})
+    assert (state.first_seq, state.last_seq) == (2, 3)
+    state.clear()
+    assert (state.first_seq, state.last_seq) == (4, 3)
+
+
+def test_async_ingest_runs_blocking_live_state_off_the_event_loop(tmp_path, monkeypatch):
+    import asyncio
+    import json
+    import threading
+
+    from conftest import make_payload
+
+    state = server.SqliteLiveState(str(tmp_path / 'async-live.db'), 10)
+    monkeypatch.setattr(server, 'live_state', state)
+    threads = []
+    original = server.accept_snapshot
+
+    def accept(data):
+        threads.append(threading.current_thread())
+        return original(data)
+
+    monkeypatch.setattr(server, 'accept_snapshot', accept)
+    app = server.AsyncTracker(server.app, workers=2)
+
+    async def post():
+        body = json.dumps(make_payload()).encode()
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'POST', 'path': '/api/bloxfruits/stats', 'query_string': b'',
+                 'headers': [(b'content-type', b'application/json')]}
+        await app(scope, receive, send)
+        return threading.current_thread(), sent[0]['status']
+
+    loop_thread, status = asyncio.run(post())
+    app.executor.shutdown()
+    server.ingest_queue.join()
+    assert status == 200
+    assert threads and threads[0] is not loop_thread
+    assert state.active_count() == 1
@@ -0,0 +1,35 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import REPO_DIR, TEST_DIR
+
+SCRIPT = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+import server
+
+stop = server.ingest_queue.stop
+
+def stop_and_log(*args, **kwargs):
+    stop(*args, **kwargs)
+    server.log_event('warning', 'queue_stopped', 'ingest queue stopped')
+
+server.ingest_queue.stop = stop_and_log
+print('level', server.LOG_LEVEL, flush=True)
+'''
+
+
+def test_bad_log_level_falls_back_and_logs_survive_shutdown():
+    env = dict(os.environ, BF_LOG_LEVEL='LOUD', BF_LOG_FORMAT='json',
+               BF_DB_FILE=os.path.join(TEST_DIR, 'logging.db'))
+    result = subprocess.run([sys.executable, '-c', SCRIPT, REPO_DIR], env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.splitlines()
+    assert 'level INFO' in lines
+    events = [json.loads(line)['event'] for line in lines if line.startswith('{')]
+    assert 'invalid_log_level' in events
+    # Log ghi trong lúc atexit dừng ingest queue vẫn ra được: listener dừng sau cùng
+    assert events[-1] == 'queue_stopped'
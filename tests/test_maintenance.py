@@ -0,0 +1,46 @@
+import server
+from conftest import make_payload
+
+OLD = "datetime('now', '-60 days')"
+
+
+def test_rebuilds_keep_history_older_than_pruned_raw_rows(client, post_snapshot):
+    post_snapshot(make_payload('Old', level=10))
+    post_snapshot(make_payload('Mixed', level=20))
+    post_snapshot(make_payload('Mixed', level=21))
+
+    with server.db_pool.connection() as conn:
+        with conn:
+            conn.execute(f'''
+                UPDATE player_snapshots SET timestamp = {OLD}
+                WHERE player_id = (SELECT id FROM players WHERE name = 'Old')
+                   OR id = (SELECT MIN(id) FROM player_stats WHERE player_name = 'Mixed')
+            ''')
+            server.rebuild_rollups(conn)
+        old_day = conn.execute(f"SELECT strftime('%Y-%m-%d', {OLD})").fetchone()[0]
+
+    assert server.retention_compactor.run_once()['raw_rows_pruned'] == 2
+
+    with server.db_pool.connection() as conn:
+        with conn:
+            server.rebuild_rollups(conn)
+            server.rebuild_player_latest(conn)
+        days = conn.execute('SELECT player_name, bucket, level_last FROM rollup_day ORDER BY player_name, bucket').fetchall()
+        latest = conn.execute('SELECT player_name, level FROM player_latest ORDER BY player_name').fetchall()
+        counters, _ = server.recompute_counters(conn)
+
+    assert ('Old', old_day, 10) in days
+    assert ('Mixed', old_day, 20) in days
+    assert latest == [('Mixed', 21), ('Old', 10)]
+    assert counters == {'total_updates': 3, 'total_players': 2}
+
+
+def test_rebuild_rollups_is_complete_without_pruning(client, post_snapshot):
+    post_snapshot(make_payload(level=5))
+    post_snapshot(make_payload(level=7))
+    with server.db_pool.connection() as conn:
+        before = conn.execute('SELECT * FROM rollup_hour').fetchall()
+        with conn:
+            conn.execute('DELETE FROM rollup_hour')
+            server.rebuild_rollups(conn)
+        assert conn.execute('SELECT * FROM rollup_hour').fetchall() == before
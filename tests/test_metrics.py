@@ -0,0 +1,31 @@
+import pytest
+
+import server
+
+
+def test_profiler_caps_distinct_stacks():
+    profiler = server.SamplingProfiler(max_stacks=2)
+    profiler._record(['a;b', 'a;c'])
+    profiler._record(['a;b', 'x;y', 'x;z'])
+    assert dict(profiler.top()) == {'a;b': 2, 'a;c': 1, server.SamplingProfiler.OTHER: 2}
+    assert profiler.samples == 2
+
+
+@pytest.mark.parametrize('interval', ['0.01', 0, -1, True, 1e9, float('nan'), [0.01]])
+def test_profiler_rejects_bad_interval(client, interval):
+    response = client.post('/api/admin/profiler', json={'enabled': True, 'interval': interval})
+    assert response.status_code == 400
+    assert not server.profiler.running
+
+
+def test_profiler_start_and_stop(client):
+    response = client.post('/api/admin/profiler', json={'enabled': True, 'interval': 0.01})
+    assert response.status_code == 200
+    assert response.get_json()['profiler']['interval_seconds'] == 0.01
+    assert client.post('/api/admin/profiler', json={'enabled': False}).get_json()['profiler']['running'] is False
+
+
+def test_dashboard_aggregates_are_timed(client):
+    assert client.get('/api/dashboard/summary').status_code == 200
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'bf_db_statement_duration_seconds_count{group="aggregates"}' in body
@@ -0,0 +1,77 @@
+import os
+import sqlite3
+
+import server
+from conftest import TEST_DIR
+
+# Schema của server.py trước khi có migrations (user_version = 0)
+LEGACY_SCHEMA = '''
+    CREATE TABLE player_stats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, player_name TEXT NOT NULL, user_id INTEGER,
+        level INTEGER DEFAULT 0, beli INTEGER DEFAULT 0, fragments INTEGER DEFAULT 0,
+        bounty INTEGER DEFAULT 0, honor INTEGER DEFAULT 0, equipped_fruit TEXT, fighting_style TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, session_id TEXT
+    );
+    CREATE TABLE fighting_styles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, player_name TEXT NOT NULL, user_id INTEGER,
+        style_name TEXT NOT NULL, owned BOOLEAN DEFAULT FALSE, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE player_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, player_name TEXT NOT NULL, user_id INTEGER,
+        item_name TEXT NOT NULL, item_type TEXT, rarity TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE progress_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, player_name TEXT NOT NULL, user_id INTEGER,
+        event_type TEXT, old_value TEXT, new_value TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+
+def fresh_pool(name):
+    path = os.path.join(TEST_DIR, name)
+    if os.path.exists(path):
+        os.remove(path)
+    return path, server.ConnectionPool(path, size=1)
+
+
+def test_new_database_is_migrated_and_hot_queries_use_indexes():
+    _, pool = fresh_pool('fresh.db')
+    server.init_database(pool)
+    with pool.connection() as conn:
+        assert server.get_schema_version(conn) == server.MIGRATIONS[-1][0]
+        assert server.check_query_plans(conn) == []
+    pool.close_all()
+
+
+def test_legacy_database_is_upgraded_in_place():
+    path, pool = fresh_pool('legacy.db')
+    legacy = sqlite3.connect(path)
+    legacy.executescript(LEGACY_SCHEMA)
+    legacy.execute("INSERT INTO player_stats (player_name, user_id, level, beli, equipped_fruit, fighting_style) "
+                   "VALUES ('Old', 7, 50, 100, 'Ice-Ice', 'Combat')")
+    legacy.execute("INSERT INTO fighting_styles (player_name, style_name, owned) VALUES ('Old', 'Combat', 1)")
+    legacy.execute("INSERT INTO fighting_styles (player_name, style_name, owned) VALUES ('Old', 'Combat', 1)")
+    legacy.execute("INSERT INTO player_items (player_name, item_name, item_type) VALUES ('Old', 'Katana', 'Sword')")
+    legacy.commit()
+    legacy.close()
+
+    server.init_database(pool)
+    with pool.connection() as conn:
+        assert server.get_schema_version(conn) == server.MIGRATIONS[-1][0]
+        assert server.check_query_plans(conn) == []
+        assert conn.execute('SELECT player_name, level, equipped_fruit FROM player_stats').fetchall() == [
+            ('Old', 50, 'Ice-Ice')]
+        assert conn.execute('SELECT player_name, level FROM player_latest').fetchall() == [('Old', 50)]
+        assert conn.execute('SELECT style_name FROM fighting_styles').fetchall() == [('Combat',)]
+        assert conn.execute('SELECT item_name, item_type FROM player_items').fetchall() == [('Katana', 'Sword')]
+    pool.close_all()
+
+
+def test_check_query_plans_reports_full_scans():
+    _, pool = fresh_pool('noindex.db')
+    server.init_database(pool)
+    with pool.connection() as conn:
+        conn.execute('DROP INDEX idx_player_latest_change_seq')
+        problems = dict(server.check_query_plans(conn))
+    pool.close_all()
+    assert 'changed players (summary)' in problems
@@ -0,0 +1,77 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import server
+from conftest import REPO_DIR
+
+# Một worker process: import server trên DB dùng chung, ingest qua Flask app, chờ flush rồi thoát
+WORKER = '''
+import json, os, sys, time
+sys.path.insert(0, os.environ['REPO_DIR'])
+import server
+
+while not os.path.exists(os.environ['START_FILE']):
+    time.sleep(0.01)
+client = server.app.test_client()
+worker = os.environ['WORKER_NAME']
+for round_no in range(int(os.environ['ROUNDS'])):
+    for index in range(int(os.environ['PLAYERS'])):
+        # Cùng tên player ở cả hai worker: phải chỉ được đếm một lần trong total_players
+        payload = {'player_name': f'Shared{index}', 'user_id': index, 'level': round_no + 1,
+                   'beli': round_no, 'session_id': worker, 'items': {'swords': [f'Blade{round_no}']}}
+        assert client.post('/api/bloxfruits/stats', json=payload).status_code == 200
+    payload = {'player_name': f'{worker}-only', 'level': round_no + 1, 'session_id': worker}
+    assert client.post('/api/bloxfruits/stats', json=payload).status_code == 200
+assert server.ingest_queue.join(60)
+print(json.dumps(server.ingest_queue.stats()))
+'''
+
+ROUNDS = 15
+PLAYERS = 10
+
+
+def test_two_workers_share_one_database(tmp_path):
+    db_file = str(tmp_path / 'shared.db')
+    start_file = str(tmp_path / 'start')
+    env = dict(os.environ, REPO_DIR=REPO_DIR, BF_DB_FILE=db_file, BF_LIVE_STATE='sqlite',
+               BF_LIVE_STATE_FILE=db_file + '.live', START_FILE=start_file,
+               ROUNDS=str(ROUNDS), PLAYERS=str(PLAYERS), BF_LOG_LEVEL='ERROR', BF_INGEST_FLUSH_SIZE='7')
+    # Tạo schema trước, để hai worker không cùng migrate một DB rỗng
+    subprocess.run([sys.executable, '-c', 'import sys; sys.path.insert(0, sys.argv[1]); import server', REPO_DIR],
+                   env=env, check=True, timeout=60)
+
+    workers = [subprocess.Popen([sys.executable, '-c', WORKER], env=dict(env, WORKER_NAME=name),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+               for name in ('w1', 'w2')]
+    open(start_file, 'w').close()
+    for worker in workers:
+        stdout, stderr = worker.communicate(timeout=120)
+        assert worker.returncode == 0, stderr
+        assert '"failed": 0' in stdout
+
+    posts = 2 * ROUNDS * (PLAYERS + 1)
+    players = {f'Shared{i}' for i in range(PLAYERS)} | {'w1-only', 'w2-only'}
+
+    conn = sqlite3.connect(db_file)
+    counters = dict(conn.execute('SELECT name, value FROM tracker_counters'))
+    raw_rows = conn.execute('SELECT COUNT(*) FROM player_stats').fetchone()[0]
+    assert counters['total_updates'] == posts
+    assert raw_rows + counters['skipped_snapshots'] == posts
+    assert counters['total_players'] == len(players)
+    assert {name for (name,) in conn.execute('SELECT player_name FROM player_latest')} == players
+    assert conn.execute('SELECT COUNT(*) FROM players').fetchone()[0] == len(players)
+    # Inventory: mỗi player đúng một item hiện tại, không trùng do hai worker cùng ghi
+    assert conn.execute('''
+        SELECT COUNT(*) FROM (SELECT player_name FROM player_items GROUP BY player_name HAVING COUNT(*) > 1)
+    ''').fetchone()[0] == 0
+    conn.close()
+
+    live = server.SqliteLiveState(db_file + '.live', server.max_recent_updates)
+    assert live.active_count() == len(players)
+    assert live.last_seq == posts
+    feed = live.latest(server.max_recent_updates)
+    assert [update['seq'] for update in feed] == list(range(posts - len(feed) + 1, posts + 1))
+    assert {update['player_name'] for update in feed} >= {'w1-only', 'w2-only'}
+    live.pool.close_all()
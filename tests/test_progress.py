@@ -0,0 +1,114 @@
+import server
+from conftest import make_payload
+
+
+def progress(client, **params):
+    response = client.get('/api/progress/Tester', query_string=params)
+    assert response.status_code == 200
+    return response.get_json()['events']
+
+
+def event_types(client):
+    # Report đầu tiên log inventory ban đầu (new_weapon/new_fruit), chỉ xét các event sau đó
+    return sorted(event['type'] for event in progress(client) if event['old_value'] is not None)
+
+
+def test_small_beli_changes_do_not_flood_progress_log(client, post_snapshot):
+    post_snapshot(make_payload(beli=5000))
+    for beli in (6000, 7000, 8000):
+        post_snapshot(make_payload(beli=beli))
+    assert event_types(client) == []
+
+    post_snapshot(make_payload(beli=5000 + server.BELI_EVENT_THRESHOLD))
+    beli_events = progress(client, type='beli_delta')
+    assert [(e['old_value'], e['new_value']) for e in beli_events] == [
+        ('5000', str(5000 + server.BELI_EVENT_THRESHOLD))]
+
+
+def test_new_fruit_only_for_unseen_fruits(client, post_snapshot):
+    post_snapshot(make_payload(equipped_fruit='Flame-Flame', items={'fruits': ['Ice-Ice']}))
+    # Đổi qua lại giữa fruit đã thấy: không phải fruit mới
+    post_snapshot(make_payload(equipped_fruit='Ice-Ice', items={'fruits': ['Flame-Flame']}))
+    post_snapshot(make_payload(equipped_fruit='Flame-Flame', items={'fruits': ['Ice-Ice']}))
+    assert event_types(client) == []
+
+    post_snapshot(make_payload(equipped_fruit='Flame-Flame', items={'fruits': ['Ice-Ice', 'Dark-Dark']}))
+    assert [e['new_value'] for e in progress(client, type='new_fruit')] == ['Dark-Dark', 'Ice-Ice', 'Flame-Flame']
+
+    # Cache miss (restart): fruit đã thấy được nạp lại từ progress_log
+    server.player_state_cache.invalidate()
+    post_snapshot(make_payload(equipped_fruit='Dark-Dark', items={'fruits': ['Ice-Ice', 'Flame-Flame']}))
+    assert len(progress(client, type='new_fruit')) == 3
+
+
+def test_progress_limit_is_clamped(client, post_snapshot):
+    post_snapshot(make_payload(level=1))
+    post_snapshot(make_payload(level=2))
+    post_snapshot(make_payload(level=3))
+    assert len(progress(client, limit=0)) == 1
+    assert len(progress(client, limit=-5)) == 1
+    assert len(progress(client, limit=5000, type='level_up')) == 2
+
+
+def test_progress_time_filters_accept_iso_timestamps(client, post_snapshot):
+    for level in (1, 2, 3):
+        post_snapshot(make_payload(level=level))
+    with server.db_pool.connection() as conn:
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM progress_log WHERE event_type = 'level_up' ORDER BY id")]
+        conn.executemany('UPDATE progress_log SET timestamp = ? WHERE id = ?',
+                         [('2024-01-01 10:00:00', ids[0]), ('2024-01-02 10:00:00', ids[1])])
+        conn.commit()
+
+    def levels(**params):
+        return [e['new_value'] for e in progress(client, type='level_up', **params)]
+
+    assert levels(since='2024-01-01T12:00:00', until='2024-01-02T10:00:00') == ['3']
+    assert levels(since='2024-01-01T12:00:00Z', until='2024-01-02T17:00:00+07:00') == ['3']
+    assert levels(until='2024-01-01T10:00:00Z') == ['2']
+    assert levels(since='2024-01-03') == []
+
+
+def test_progress_rejects_bad_time_filter(client):
+    for params in ({'since': 'yesterday'}, {'until': '2024-01-01T25:00'}):
+        response = client.get('/api/progress/Tester', query_string=params)
+        assert response.status_code == 400
+        assert 'since/until' in response.get_json()['error']
+
+
+def weapon_events(client):
+    return [(e['type'], e['old_value'], e['new_value']) for e in reversed(progress(client))
+            if e['type'] in ('new_weapon', 'lost_weapon')]
+
+
+def test_first_report_logs_inventory_but_no_stat_events(client, post_snapshot):
+    post_snapshot(make_payload(level=100, bounty=500, items={'swords': ['Katana'], 'guns': ['Musket'], 'fruits': []}))
+    types = {event['type'] for event in progress(client)}
+    assert types <= {'new_weapon', 'new_fruit'}
+    assert sorted(weapon_events(client)) == [('new_weapon', None, 'Katana'), ('new_weapon', None, 'Musket')]
+
+
+def test_weapon_added_and_removed(client, post_snapshot):
+    post_snapshot(make_payload(items={'swords': ['Katana'], 'guns': [], 'fruits': []}))
+    initial = weapon_events(client)
+
+    post_snapshot(make_payload(items={'swords': ['Katana', 'Saber'], 'guns': [], 'fruits': []}))
+    post_snapshot(make_payload(items={'swords': ['Katana', 'Saber'], 'guns': ['Musket'], 'fruits': []}))
+    post_snapshot(make_payload(items={'swords': ['Saber'], 'guns': ['Musket'], 'fruits': []}))
+    post_snapshot(make_payload(items={'swords': ['Saber'], 'guns': [], 'fruits': []}))
+    assert weapon_events(client)[len(initial):] == [
+        ('new_weapon', None, 'Saber'),
+        ('new_weapon', None, 'Musket'),
+        ('lost_weapon', 'Katana', None),
+        ('lost_weapon', 'Musket', None),
+    ]
+
+
+def test_weapon_events_survive_state_cache_invalidation(client, post_snapshot):
+    post_snapshot(make_payload(items={'swords': ['Katana'], 'guns': ['Musket'], 'fruits': []}))
+    initial = weapon_events(client)
+
+    # Cache miss (restart): diff dựa trên inventory đã lưu, không log lại weapon đã có
+    server.player_state_cache.invalidate()
+    post_snapshot(make_payload(items={'swords': ['Katana', 'Saber'], 'guns': [], 'fruits': []}))
+    assert weapon_events(client)[len(initial):] == [('new_weapon', None, 'Saber'), ('lost_weapon', 'Musket', None)]